@@ -0,0 +1,118 @@
+"""
+Recall vs latency benchmark for the FAISS index backends.
+
+Builds each backend from services.index_factory over a synthetic, clustered corpus shaped
+like MiniLM embeddings and reports, per backend and search setting:
+    recall@k against exact flat search
+    p50 / p99 single-query search latency
+    index memory per vector (serialized size)
+
+Usage:
+    python -m benchmarks.bench_ann --sizes 10000,100000,1000000 --queries 500 --k 10
+"""
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+from services.index_factory import IndexConfig, apply_search_params, build_index
+
+
+def synthetic_corpus(n, dim, seed=0, clusters=256):
+    """Normalized vectors drawn around random cluster centres, similar to sentence embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centres[labels] + 0.35 * rng.standard_normal((n, dim), dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def time_queries(index, queries, k):
+    latencies = []
+    results = []
+    for q in queries:
+        start = time.perf_counter()
+        _, I = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(I[0])
+    return np.array(results), np.array(latencies)
+
+
+def bench_size(n, args):
+    corpus = synthetic_corpus(n, args.dim, seed=n)
+    queries = synthetic_corpus(args.queries, args.dim, seed=n + 1)
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(corpus)
+    truth, flat_lat = time_queries(flat, queries, args.k)
+    rows = [report_row(n, "flat", "-", flat, 1.0, flat_lat)]
+
+    nlist = args.nlist or max(16, int(np.sqrt(n)))
+    configs = [
+        ("hnsw", IndexConfig(kind="hnsw", hnsw_m=32), "efSearch", args.ef_search),
+        ("ivf_flat", IndexConfig(kind="ivf_flat", nlist=nlist), "nprobe", args.nprobe),
+        ("ivf_pq", IndexConfig(kind="ivf_pq", nlist=nlist, pq_m=args.pq_m), "nprobe", args.nprobe),
+    ]
+    for kind, config, knob, values in configs:
+        start = time.perf_counter()
+        index = build_index(corpus, config)
+        build_s = time.perf_counter() - start
+        for value in values:
+            if knob == "nprobe":
+                config.nprobe = value
+            else:
+                config.ef_search = value
+            apply_search_params(index, config)
+            found, lat = time_queries(index, queries, args.k)
+            row = report_row(n, kind, f"{knob}={value}", index, recall_at_k(found, truth, args.k), lat)
+            row["build_s"] = round(build_s, 2)
+            rows.append(row)
+    return rows
+
+
+def report_row(n, kind, setting, index, recall, latencies):
+    return {
+        "vectors": n,
+        "index": kind,
+        "setting": setting,
+        "recall_at_k": round(recall, 4),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "bytes_per_vector": round(len(faiss.serialize_index(index)) / n, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated corpus sizes")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF lists (default sqrt(n))")
+    parser.add_argument("--pq-m", type=int, default=48)
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--ef-search", default="32,64,128")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+    args.nprobe = [int(v) for v in args.nprobe.split(",")]
+    args.ef_search = [int(v) for v in args.ef_search.split(",")]
+
+    rows = []
+    header = f"{'vectors':>9} {'index':>9} {'setting':>13} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} {'B/vec':>8}"
+    print(header)
+    for n in (int(s) for s in args.sizes.split(",")):
+        for row in bench_size(n, args):
+            rows.append(row)
+            print(f"{row['vectors']:>9} {row['index']:>9} {row['setting']:>13} {row['recall_at_k']:>9} {row['p50_ms']:>8} {row['p99_ms']:>8} {row['bytes_per_vector']:>8}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Chunker throughput and import cost: native utils.text_splitter vs the LangChain splitter it replaced.
+
+Extracts the text of a PDF (policy.pdf by default), chunks it repeatedly with both
+implementations, checks they produce identical chunks and reports chunks/sec. Import time is
+measured in a fresh interpreter for each module. The LangChain baseline needs
+``pip install langchain``; without it only the native numbers are reported.
+
+    python -m benchmarks.bench_chunker --pdf policy.pdf --repeat 20
+"""
+import argparse
+import json
+import logging
+import re
+import subprocess
+import sys
+import time
+from utils import parser_utils, text_splitter
+
+
+def legacy_extract_document_info(text):
+    """extract_document_info as it was before the native chunker (patterns compiled per call)."""
+    info = {}
+    section_patterns = [
+        r'(Section|Clause|Article|Part)\s*(\d+[\.\d]*)[:\s]+(.+)',
+        r'(\d+[\.\d]*)\s*[:\s]+(.+)',
+        r'([A-Z][A-Z\s]+)[:\s]+(.+)'
+    ]
+    for pattern in section_patterns:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        if matches:
+            info['section_type'] = matches[0][0] if len(matches[0]) > 2 else 'Section'
+            info['section_number'] = matches[0][1] if len(matches[0]) > 2 else matches[0][0]
+            info['section_title'] = matches[0][-1].strip()
+            break
+    numbers = re.findall(r'\d+[\.\d]*%?', text)
+    if numbers:
+        info['numbers'] = numbers[:5]
+    currency = re.findall(r'₹\s*\d+[,\d]*|\$\s*\d+[,\d]*|Rs\.?\s*\d+[,\d]*', text)
+    if currency:
+        info['currency_amounts'] = currency[:3]
+    return info
+
+
+def legacy_semantic_chunk(text, chunk_size=600, chunk_overlap=100):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", ".", "!", "?", " "]
+    )
+    chunks = []
+    for i, chunk in enumerate(splitter.create_documents([text])):
+        metadata = chunk.metadata.copy()
+        metadata.update(legacy_extract_document_info(chunk.page_content))
+        metadata['chunk_id'] = i
+        metadata['text'] = chunk.page_content
+        metadata['length'] = len(chunk.page_content)
+        chunks.append({"text": chunk.page_content, "metadata": metadata})
+    return chunks
+
+
+def import_seconds(module):
+    """Seconds to import module in a fresh interpreter, excluding interpreter startup."""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return round(float(result.stdout.strip().splitlines()[-1]), 3)
+
+
+def throughput(chunk_fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        chunks = chunk_fn(text)
+    elapsed = time.perf_counter() - start
+    return chunks, {
+        "chunks": len(chunks),
+        "chunks_per_sec": round(len(chunks) * repeat / elapsed, 1),
+        "ms_per_document": round(elapsed / repeat * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default="policy.pdf")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    logging.getLogger("text_splitter").setLevel(logging.WARNING)
+
+    text = parser_utils.parse_pdf(args.pdf)
+    native_chunks, native = throughput(text_splitter.semantic_chunk, text, args.repeat)
+    native["import_seconds"] = import_seconds("utils.text_splitter")
+    report = {"pdf": args.pdf, "characters": len(text), "native": native}
+
+    try:
+        legacy_chunks, legacy = throughput(legacy_semantic_chunk, text, args.repeat)
+    except ImportError:
+        report["langchain"] = "not installed"
+    else:
+        legacy["import_seconds"] = import_seconds("langchain.text_splitter")
+        report["langchain"] = legacy
+        report["identical_chunks"] = legacy_chunks == native_chunks
+        report["speedup"] = round(native["chunks_per_sec"] / legacy["chunks_per_sec"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Embedding throughput for services.embedding_engine configurations.
+
+Chunks a PDF (policy.pdf by default), then encodes the chunk texts with a baseline (a single
+default ``model.encode`` call, as ingestion did before the engine) and with each requested
+backend / batch size / worker count. Reports texts/sec and how far each configuration's
+vectors are from the baseline (max absolute difference and minimum cosine similarity).
+
+    python -m benchmarks.bench_embedding --pdf policy.pdf --batch-sizes 32,64,128 --workers 1,4 --backends torch,torch-int8,onnx
+"""
+import argparse
+import json
+import logging
+import time
+import numpy as np
+from sentence_transformers import SentenceTransformer
+from services.embedding_engine import EmbeddingEngine
+from utils import parser_utils, text_splitter
+
+
+def compare(vectors, baseline):
+    a = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    b = baseline / np.linalg.norm(baseline, axis=1, keepdims=True)
+    return {
+        "max_abs_diff": float(np.abs(vectors - baseline).max()),
+        "min_cosine": round(float((a * b).sum(axis=1).min()), 6),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default="policy.pdf")
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--copies", type=int, default=4, help="repeat the document's chunks to enlarge the workload")
+    parser.add_argument("--batch-sizes", default="32,64,128")
+    parser.add_argument("--workers", default="1")
+    parser.add_argument("--backends", default="torch")
+    args = parser.parse_args()
+    logging.getLogger("text_splitter").setLevel(logging.WARNING)
+
+    chunks = text_splitter.semantic_chunk(parser_utils.parse_pdf(args.pdf))
+    # Suffix each copy so the workload is not just repeats of identical strings.
+    texts = [f"{chunk['text']} ({copy})" for copy in range(args.copies) for chunk in chunks]
+
+    model = SentenceTransformer(args.model)
+    start = time.perf_counter()
+    baseline = np.asarray(model.encode(texts, show_progress_bar=False), dtype=np.float32)
+    baseline_seconds = time.perf_counter() - start
+    report = {
+        "texts": len(texts),
+        "baseline": {"texts_per_sec": round(len(texts) / baseline_seconds, 1)},
+        "runs": [],
+    }
+
+    for backend in args.backends.split(","):
+        for workers in (int(w) for w in args.workers.split(",")):
+            for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+                engine = EmbeddingEngine(args.model, batch_size=batch_size, workers=workers, backend=backend, pool_min_texts=1)
+                if workers > 1:
+                    engine.encode(texts[:workers * batch_size])  # Start the pool and load the model in each worker.
+                start = time.perf_counter()
+                vectors = engine.encode(texts)
+                seconds = time.perf_counter() - start
+                engine.close()
+                report["runs"].append({
+                    "backend": backend,
+                    "workers": workers,
+                    "batch_size": batch_size,
+                    "texts_per_sec": round(len(texts) / seconds, 1),
+                    "speedup": round(baseline_seconds / seconds, 2),
+                    **compare(vectors, baseline),
+                })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
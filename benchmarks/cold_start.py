@@ -0,0 +1,129 @@
+"""
+Cold-start cost of the API per STARTUP_MODE (eager, background, lazy).
+
+Import time comes from ``python -X importtime -c "import main"``. It reports the total and
+the slowest top-level packages. For each mode a fresh uvicorn process is started and timed:
+    health_ms        process start until /health first answers
+    ready_ms         process start until /health reports the services loaded ("ready"), polled
+                     alongside the first query; lazy mode never gets there from a query alone
+    first_query_ms   latency of the first /ask-query, sent as soon as /health answers
+    first_answer_ms  process start until that first answer is complete
+    loaded           services built once the first answer is complete
+
+Run it against the stub LLM so the LLM call does not dominate the numbers:
+
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 100 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 python -m benchmarks.cold_start --modes eager,background,lazy
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import httpx
+
+_IMPORTTIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)")
+
+
+def import_report(top=10):
+    """Total microseconds to import main, and the slowest top-level packages."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], capture_output=True, text=True)
+    packages = {}
+    total_us = None
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME.match(line)
+        if not match:
+            continue
+        _, cumulative, _, name = match.groups()
+        if name == "main":
+            total_us = int(cumulative)
+        elif "." not in name:
+            packages[name] = max(packages.get(name, 0), int(cumulative))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "import_main_ms": round(total_us / 1000, 1) if total_us is not None else None,
+        "slowest_packages_ms": {name: round(us / 1000, 1) for name, us in slowest},
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_ready(url, started, timeout, report):
+    """Record ready_ms once /health reports the services ready (or failed)."""
+    with httpx.Client(timeout=timeout) as client:
+        while time.perf_counter() - started < timeout:
+            state = client.get(f"{url}/health").json()["services"]
+            if state in ("ready", "failed"):
+                report["ready_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                report["ready_state"] = state
+                return
+            time.sleep(0.01)
+
+
+def measure_mode(mode, query, timeout):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "STARTUP_MODE": mode}
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    report = {"mode": mode, "ready_ms": None}
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            health = None
+            while health is None:
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"{mode}: /health did not answer within {timeout}s")
+                try:
+                    health = client.get(f"{url}/health").json()
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            report["health_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            report["services_at_health"] = health.get("services")
+
+            poller = None
+            if health.get("services") in ("ready", "failed"):
+                report["ready_ms"], report["ready_state"] = report["health_ms"], health["services"]
+            elif mode != "lazy":
+                poller = threading.Thread(target=wait_ready, args=(url, started, timeout, report), daemon=True)
+                poller.start()
+            sent = time.perf_counter()
+            client.post(f"{url}/ask-query", json={"query": query}).raise_for_status()
+            report["first_query_ms"] = round((time.perf_counter() - sent) * 1000, 1)
+            report["first_answer_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            report["loaded"] = client.get(f"{url}/health").json().get("loaded")
+            if poller is not None:
+                poller.join(timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="eager,background,lazy")
+    parser.add_argument("--query", default="What is the grace period for premium payment?")
+    parser.add_argument("--runs", type=int, default=3, help="server starts per mode; the median run is reported")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    report = {"imports": import_report(), "modes": []}
+    for mode in args.modes.split(","):
+        runs = sorted((measure_mode(mode, args.query, args.timeout) for _ in range(args.runs)), key=lambda run: run["first_answer_ms"])
+        report["modes"].append(runs[len(runs) // 2])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Answer-context recall and latency with and without cross-encoder reranking.
+
+Indexes a PDF (policy.pdf by default) into a temporary directory, then asks a fixed set of
+questions whose answers are known passages of the policy. For each configuration (no
+reranking, then reranking cut to each --top-n) it reports:
+    recall            share of questions whose prompt context contains the answer passage
+    chunks / tokens   chunks and context tokens sent to the LLM per question
+    retrieval_ms      retrieval (+ reranking) latency, p50 / p95
+    end_to_end_ms     answer_query latency including the LLM call, p50 / p95
+
+End-to-end numbers need an LLM; use the stub server so they measure this service rather
+than the provider (pass --no-llm to skip them):
+
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 800 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 python -m benchmarks.eval_rerank --top-n 4,8
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import numpy as np
+from services import llm_client
+from services.context_builder import count_tokens
+from services.doc_ingestion_service import DocIngestionService
+from services.embedding_service import EmbeddingService
+from services.query_reasoning_service import QueryReasoningService
+from services.reranker import RERANK_MODEL, Reranker
+
+# (question, passage the prompt context must contain to answer it) for policy.pdf.
+QUESTIONS = [
+    ("What is the grace period for premium payment?", "grace period for payment of the premium shall be thirty days"),
+    ("What is the waiting period for cataract surgery?", "two years waiting period"),
+    ("Is there a limit on cataract surgery?", "limit for cataract surgery"),
+    ("Are ambulance charges covered?", "expenses incurred for ambulance charges"),
+    ("Does the policy pay for an organ donor's treatment?", "harvesting of the organ"),
+    ("Is AYUSH treatment covered?", "ayurveda, yoga and naturopathy"),
+    ("When are health check-up expenses reimbursed?", "expenses of health check up shall be reimbursed"),
+    ("What is the moratorium period?", "sixty continuous months of coverage"),
+    ("How does the policy define room rent?", "room rent means"),
+    ("Who counts as a family member?", "family members means"),
+    ("Is anti-rabies vaccination covered?", "anti rabies vaccination"),
+    ("Is domiciliary hospitalisation covered?", "domiciliary hospitalisation"),
+]
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def percentiles(values):
+    return {"p50": round(float(np.percentile(values, 50)), 1), "p95": round(float(np.percentile(values, 95)), 1)}
+
+
+async def evaluate(service, questions, with_llm):
+    found, chunks_sent, tokens, retrieval_ms, end_to_end_ms = [], [], [], [], []
+    for question, passage in questions:
+        start = time.perf_counter()
+        chunks = service._retrieve_relevant_content(question)
+        retrieval_ms.append((time.perf_counter() - start) * 1000)
+        prompt_context, packed = service.context_builder.build(chunks)
+        found.append(normalize(passage) in normalize(prompt_context))
+        chunks_sent.append(len(packed))
+        tokens.append(count_tokens(prompt_context))
+        if with_llm:
+            start = time.perf_counter()
+            await service.answer_query(question)
+            end_to_end_ms.append((time.perf_counter() - start) * 1000)
+    report = {
+        "recall": round(sum(found) / len(found), 3),
+        "missed": [question for (question, _), hit in zip(questions, found) if not hit],
+        "chunks": round(float(np.mean(chunks_sent)), 1),
+        "context_tokens": round(float(np.mean(tokens)), 1),
+        "retrieval_ms": percentiles(retrieval_ms),
+    }
+    if with_llm:
+        report["end_to_end_ms"] = percentiles(end_to_end_ms)
+    return report
+
+
+async def run(args):
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [tuple(pair) for pair in json.load(f)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        embedding_service = EmbeddingService(
+            index_path=os.path.join(workdir, "index.bin"), meta_path=os.path.join(workdir, "meta.pkl")
+        )
+        ingestion = DocIngestionService(upload_dir=os.path.join(workdir, "uploads"), embedding_service=embedding_service)
+        ingestion.ingest_document(args.pdf)
+
+        reranker = None
+        report = {"pdf": args.pdf, "questions": len(questions), "runs": []}
+        for top_n in [None] + [int(n) for n in args.top_n.split(",")]:
+            if top_n is not None:
+                reranker = reranker or Reranker(args.model, top_n=top_n)
+                reranker.top_n = top_n
+            service = QueryReasoningService(
+                embedding_service=embedding_service, content_store=ingestion.content_store, reranker=reranker
+            )
+            service.answer_cache = None  # Every question must reach retrieval and the LLM.
+            if top_n is None:
+                service.reranker = None
+            result = await evaluate(service, questions, not args.no_llm)
+            report["runs"].append({"rerank_top_n": top_n, **result})
+            service.close()
+        await llm_client.close_client()
+        embedding_service.close()
+        ingestion.content_store.close()
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", default="policy.pdf")
+    parser.add_argument("--model", default=RERANK_MODEL)
+    parser.add_argument("--top-n", default="4,8", help="comma-separated reranker cut-offs to evaluate")
+    parser.add_argument("--questions", help="JSON list of [question, expected passage] pairs")
+    parser.add_argument("--no-llm", action="store_true", help="skip the end-to-end answer_query timings")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
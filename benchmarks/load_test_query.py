@@ -0,0 +1,75 @@
+"""
+Closed-loop load test for /ask-query.
+
+Keeps ``--concurrency`` requests in flight against a running API for ``--duration`` seconds
+and reports requests/sec and latency percentiles. Each request uses a distinct question so the
+answer cache does not hide the LLM round trip by exact match (pass --repeat to measure cache
+hits instead); semantic matches still would, so run the API with ANSWER_CACHE_SIZE=0.
+
+To compare before/after at a fixed worker count, start the stub LLM server, then run the API
+from each revision with the same settings and point this script at it:
+
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 800 &
+    ANSWER_CACHE_SIZE=0 OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 uvicorn main:app --workers 1 --port 8000 &
+    python -m benchmarks.load_test_query --url http://127.0.0.1:8000 --concurrency 64 --duration 30
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+import httpx
+import numpy as np
+
+
+async def worker(client, url, counter, deadline, latencies, errors, repeat):
+    while time.perf_counter() < deadline:
+        n = next(counter)
+        query = "What is the grace period for premium payment?" if repeat else f"What is the grace period for premium payment? (#{n})"
+        start = time.perf_counter()
+        try:
+            resp = await client.post(f"{url}/ask-query", json={"query": query})
+            resp.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(n)
+
+
+async def run(args):
+    latencies, errors = [], []
+    counter = itertools.count()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[
+            worker(client, args.url, counter, deadline, latencies, errors, args.repeat)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_sec": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(ms, 99)), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--repeat", action="store_true", help="send the same question every time")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Local stand-in for an OpenAI-compatible chat-completions API.
+
+Answers every request with a fixed, well-formed JSON answer after a configurable delay, so
+the query path can be load tested without paying for (or waiting on) a real provider.
+Requests with ``"stream": true`` get the same answer as server-sent event deltas, with the
+first delta after ``--latency-ms`` and one more every ``--token-delay-ms``.
+
+Usage:
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 800
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 uvicorn main:app --workers 1
+"""
+import argparse
+import asyncio
+import json
+import random
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+ANSWER = {
+    "answer": "A grace period of thirty days is allowed for premium payment. " * 4,
+    "confidence": "high",
+    "source_sections": [],
+    "additional_info": "Stub answer from the local benchmark LLM server.",
+}
+
+
+def answer_tokens(text, size=8):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def create_app(latency_ms=800.0, jitter_ms=0.0, token_delay_ms=20.0):
+    app = FastAPI(title="Stub LLM")
+    app.state.requests = 0
+
+    async def stream(content):
+        for token in answer_tokens(content):
+            chunk = {"choices": [{"delta": {"content": token}}]}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            await asyncio.sleep(token_delay_ms / 1000)
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep((latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000)
+        content = json.dumps(ANSWER)
+        if body.get("stream"):
+            return StreamingResponse(stream(content), media_type="text/event-stream")
+        return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=800.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--token-delay-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.latency_ms, args.jitter_ms, args.token_delay_ms), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
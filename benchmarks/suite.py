@@ -0,0 +1,436 @@
+"""
+Reproducible benchmark suite for the ingestion and query paths, with JSON baselines.
+
+``run`` builds a corpus in a temporary directory, either synthetic policy PDFs of a given size
+or copies of a real PDF, and times each stage on its own:
+    parse_pdf       utils.parser_utils.parse_pdf, per document
+    semantic_chunk  utils.text_splitter.semantic_chunk, per document
+    embed_chunks    EmbeddingService.embed_chunks, per document
+    save_index      EmbeddingService.save_index (compaction into index.bin)
+    load_index      EmbeddingService.load_index
+    search          EmbeddingService.search, one pre-encoded question at a time
+    ask_query       POST /ask-query against an API process serving the built index, with the
+                    stub LLM standing in for the provider
+Every stage reports its throughput, p50/p95/p99 latency and peak RSS (of this process; of
+the API process for ask_query). The embedding and answer caches are off so repeated text is
+not served from them. The report is written as JSON, to be kept as a baseline.
+
+``compare`` diffs a report against a baseline. It prints the change of every metric and exits
+with status 1 when one got worse by more than --threshold.
+
+    python -m benchmarks.suite run --docs 20 --pages 12 --output benchmarks/baselines/main.json
+    python -m benchmarks.suite run --pdf policy.pdf --copies 5 --output /tmp/current.json
+    python -m benchmarks.suite compare benchmarks/baselines/main.json /tmp/current.json --threshold 0.15
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUESTIONS = [
+    "What is the grace period for premium payment?",
+    "What is the waiting period for pre-existing diseases?",
+    "Is cataract surgery covered and what is the limit?",
+    "Are ambulance charges covered?",
+    "Does the policy cover organ donor expenses?",
+    "Is AYUSH treatment covered?",
+    "What is the room rent limit?",
+    "Are health check-up expenses reimbursed?",
+    "What is excluded from coverage?",
+    "How is a claim notified?",
+]
+
+# Building blocks of the synthetic policy text.
+_TOPICS = [
+    "Grace Period", "Waiting Period", "Room Rent", "Ambulance Cover", "Cataract Treatment", "Organ Donor",
+    "AYUSH Treatment", "Health Check-up", "Co-payment", "Moratorium Period", "Domiciliary Hospitalisation",
+    "Pre-existing Diseases", "Claim Notification", "Cashless Facility", "Exclusions", "Cumulative Bonus",
+]
+_SENTENCES = [
+    "The Company shall indemnify the Insured Person for {topic} expenses up to Rs. {amount} per policy year.",
+    "A waiting period of {days} days shall apply to {topic} from the first policy commencement date.",
+    "Expenses for {topic} are payable only if the hospitalisation exceeds {hours} consecutive hours.",
+    "{topic} is subject to a co-payment of {percent}% of the admissible claim amount.",
+    "Claims under {topic} must be notified within {days} days of discharge from the hospital.",
+    "The limit for {topic} shall not exceed {percent}% of the Sum Insured or Rs. {amount}, whichever is lower.",
+    "Any {topic} claim shall be settled within {days} days of receipt of the last necessary document.",
+]
+
+
+def policy_text(rng, pages, chars_per_page=2600):
+    """Numbered sections of clause-like text, roughly chars_per_page characters per page."""
+    page_texts = []
+    section = 1
+    for _ in range(pages):
+        lines = []
+        while sum(len(line) for line in lines) < chars_per_page:
+            topic = rng.choice(_TOPICS)
+            lines.append(f"Section 3.{section} {topic}")
+            for _ in range(rng.randint(2, 5)):
+                lines.append(rng.choice(_SENTENCES).format(
+                    topic=topic.lower(), amount=rng.randrange(5, 500) * 1000, days=rng.choice([15, 30, 90, 730]),
+                    hours=rng.choice([24, 48]), percent=rng.choice([10, 20, 25, 50]),
+                ))
+            section += 1
+        page_texts.append("\n".join(lines))
+    return page_texts
+
+
+def write_pdf(path, page_texts):
+    import fitz
+
+    doc = fitz.open()
+    for text in page_texts:
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(40, 40, page.rect.width - 40, page.rect.height - 40), text, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def build_corpus(args, corpus_dir):
+    """Write the corpus PDFs; returns their paths."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    if args.pdf:
+        paths = []
+        for copy in range(args.copies):
+            path = os.path.join(corpus_dir, f"copy_{copy:04d}.pdf")
+            with open(args.pdf, "rb") as src, open(path, "wb") as dst:
+                dst.write(src.read())
+            paths.append(path)
+        return paths
+    rng = random.Random(args.seed)
+    paths = []
+    for doc in range(args.docs):
+        path = os.path.join(corpus_dir, f"policy_{doc:04d}.pdf")
+        write_pdf(path, policy_text(rng, args.pages))
+        paths.append(path)
+    return paths
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux); returns whether per-stage peaks are available."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb(pid="self"):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if pid != "self":
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(latencies, items, unit, seconds=None):
+    """Stage report: throughput in unit/sec, latency percentiles in ms."""
+    latencies = np.asarray(latencies) * 1000
+    seconds = seconds if seconds is not None else latencies.sum() / 1000
+    return {
+        "calls": len(latencies),
+        "unit": unit,
+        "items": items,
+        "throughput_per_sec": round(items / seconds, 2) if seconds else None,
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p95": round(float(np.percentile(latencies, 95)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "mean": round(float(latencies.mean()), 3),
+        },
+    }
+
+
+class Stage:
+    """Times calls of one stage and tracks the process's peak RSS while it runs."""
+
+    def __init__(self, report, name, unit):
+        self.report = report
+        self.name = name
+        self.unit = unit
+        self.latencies = []
+        self.items = 0
+
+    def __enter__(self):
+        reset_peak_rss()
+        return self
+
+    def time(self, fn, *args, items=1):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.latencies.append(time.perf_counter() - start)
+        self.items += items
+        return result
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.report[self.name] = {**summarize(self.latencies, self.items, self.unit), "peak_rss_mb": peak_rss_mb()}
+        return False
+
+
+def ingest(paths, embedding_service, content_store, stages):
+    """Parse, chunk and embed every document, timing each stage per document."""
+    import fitz
+    from services.content_store import text_sha256
+    from services.lexical_index import keyword_groups
+    from utils import parser_utils, text_splitter
+
+    texts = []
+    with Stage(stages, "parse_pdf", "pages") as stage:
+        for path in paths:
+            with fitz.open(path) as doc:
+                pages = doc.page_count
+            texts.append(stage.time(parser_utils.parse_pdf, path, items=pages))
+    documents = []
+    with Stage(stages, "semantic_chunk", "chunks") as stage:
+        for text in texts:
+            chunks = stage.time(text_splitter.semantic_chunk, text, items=0)
+            stage.items += len(chunks)
+            documents.append(chunks)
+    with Stage(stages, "embed_chunks", "chunks") as stage:
+        for path, chunks in zip(paths, documents):
+            doc_id = os.path.splitext(os.path.basename(path))[0]
+            for chunk in chunks:
+                chunk["metadata"].update({"doc_id": doc_id, "filename": os.path.basename(path), "keywords": keyword_groups(chunk["text"])})
+            row_ids = stage.time(embedding_service.embed_chunks, chunks, items=len(chunks))
+            # Registered like an upload would be, so the API serves these documents as usual.
+            content_store.record_document(
+                f"bench/{doc_id}", doc_id, os.path.basename(path),
+                [(chunk["metadata"]["chunk_id"], row_id) for chunk, row_id in zip(chunks, row_ids)],
+                {text_sha256(chunk["text"]): row_id for chunk, row_id in zip(chunks, row_ids)},
+            )
+    return sum(len(chunks) for chunks in documents)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.05)
+    raise TimeoutError(f"{url} did not answer within {timeout}s")
+
+
+def bench_ask_query(args, workdir, stages):
+    """Time /ask-query on an API process started in workdir (where the index was built)."""
+    processes = []
+    try:
+        llm_url = args.llm_url
+        if llm_url is None:
+            llm_port = free_port()
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.stub_llm_server", "--port", str(llm_port), "--latency-ms", str(args.llm_latency_ms)],
+                cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            ))
+            llm_url = f"http://127.0.0.1:{llm_port}/v1"
+            wait_until_up(f"http://127.0.0.1:{llm_port}/", args.timeout)
+        port = free_port()
+        env = {
+            **os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+            "OPENROUTER_BASE_URL": llm_url, "ANSWER_CACHE_SIZE": "0", "EMBEDDING_CACHE_ENTRIES": "0", "STARTUP_MODE": "eager",
+        }
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", "1", "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        processes.append(server)
+        url = f"http://127.0.0.1:{port}"
+        wait_until_up(f"{url}/health", args.timeout)
+        latencies = []
+        with httpx.Client(timeout=args.timeout) as client:
+            for n in range(args.ask_queries):
+                query = QUESTIONS[n % len(QUESTIONS)]
+                start = time.perf_counter()
+                client.post(f"{url}/ask-query", json={"query": query}).raise_for_status()
+                latencies.append(time.perf_counter() - start)
+        stages["ask_query"] = {**summarize(latencies, len(latencies), "queries"), "peak_rss_mb": peak_rss_mb(server.pid)}
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+
+
+def git_revision():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def run(args):
+    from services.embedding_service import EmbeddingService
+    from services.content_store import ContentStore
+
+    stages = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        index_dir = os.path.join(workdir, "data", "faiss_index")
+        os.makedirs(index_dir)
+        paths = build_corpus(args, os.path.join(workdir, "corpus"))
+        embedding_service = EmbeddingService(
+            model_name=args.model, index_path=os.path.join(index_dir, "index.bin"), meta_path=os.path.join(index_dir, "meta.pkl"),
+            compact_segments=10 ** 9, refresh_seconds=0,
+        )
+        if embedding_service.embedding_cache is not None:
+            # Copies of one PDF repeat every chunk; each must reach the model.
+            embedding_service.embedding_cache.close()
+            embedding_service.embedding_cache = None
+        content_store = ContentStore(os.path.join(index_dir, "content.db"))
+        chunks = ingest(paths, embedding_service, content_store, stages)
+
+        with Stage(stages, "save_index", "calls") as stage:
+            for _ in range(args.repeat):
+                stage.time(embedding_service.save_index)
+        with Stage(stages, "load_index", "calls") as stage:
+            for _ in range(args.repeat):
+                stage.time(embedding_service.load_index)
+
+        queries = embedding_service.encode([QUESTIONS[n % len(QUESTIONS)] for n in range(args.search_queries)])
+        with Stage(stages, "search", "queries") as stage:
+            for query in queries:
+                stage.time(embedding_service.search, query.reshape(1, -1), args.k)
+        embedding_service.close()
+        content_store.close()
+
+        if args.ask_queries:
+            bench_ask_query(args, workdir, stages)
+
+    return {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            # Without a resettable counter peak_rss_mb is the process peak so far, not the stage's.
+            "per_stage_peak_rss": reset_peak_rss(),
+        },
+        "config": {
+            "corpus": {"pdf": args.pdf, "copies": args.copies} if args.pdf else {"docs": args.docs, "pages": args.pages, "seed": args.seed},
+            "documents": len(paths), "chunks": chunks, "model": args.model, "index_type": embedding_service.index_config.kind,
+            "k": args.k, "llm_latency_ms": args.llm_latency_ms if args.llm_url is None else None,
+        },
+        "stages": stages,
+    }
+
+
+# Metrics compared between reports, and whether a higher value is better.
+COMPARED_METRICS = [
+    ("throughput_per_sec", True),
+    ("latency_ms.p50", False),
+    ("latency_ms.p95", False),
+    ("latency_ms.p99", False),
+    ("peak_rss_mb", False),
+]
+
+
+def _metric(stage, name):
+    value = stage
+    for key in name.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_reports(baseline, current, threshold):
+    """Return one row per stage metric present in both reports.
+
+    Each row is (stage, metric, baseline, current, relative change, regressed); the change is
+    positive when the metric got worse.
+    """
+    rows = []
+    for stage_name, base_stage in baseline["stages"].items():
+        stage = current["stages"].get(stage_name)
+        if stage is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            before, after = _metric(base_stage, metric), _metric(stage, metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if higher_is_better:
+                change = -change
+            rows.append((stage_name, metric, before, after, round(change, 4), change > threshold))
+    return rows
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get("config") != current.get("config"):
+        print("warning: the reports were run with different configs; differences may not be regressions", file=sys.stderr)
+    rows = compare_reports(baseline, current, args.threshold)
+    print(f"{'stage':<16}{'metric':<22}{'baseline':>14}{'current':>14}{'worse by':>10}")
+    for stage, metric, before, after, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{stage:<16}{metric:<22}{before:>14g}{after:>14g}{change:>+10.1%}{flag}")
+    regressions = sum(row[-1] for row in rows)
+    print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the suite and write a JSON report")
+    run_parser.add_argument("--docs", type=int, default=10, help="synthetic documents to generate")
+    run_parser.add_argument("--pages", type=int, default=10, help="pages per synthetic document")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--pdf", help="benchmark copies of this PDF instead of a synthetic corpus")
+    run_parser.add_argument("--copies", type=int, default=5)
+    run_parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    run_parser.add_argument("--repeat", type=int, default=5, help="save_index / load_index calls to time")
+    run_parser.add_argument("--search-queries", type=int, default=500)
+    run_parser.add_argument("--k", type=int, default=20)
+    run_parser.add_argument("--ask-queries", type=int, default=50, help="/ask-query calls to time (0 skips the API)")
+    run_parser.add_argument("--llm-url", help="OpenAI-compatible base URL; by default a stub LLM server is started")
+    run_parser.add_argument("--llm-latency-ms", type=float, default=200.0)
+    run_parser.add_argument("--timeout", type=float, default=300)
+    run_parser.add_argument("--output", help="write the report here (default: print it)")
+
+    compare_parser = commands.add_parser("compare", help="diff a report against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        sys.exit(compare(args))
+    logging.disable(logging.INFO)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Time-to-first-byte of /ask-query/stream versus the buffered /ask-query.
+
+For each run it records time to the first byte, to the "sources" event, to the first
+"token" event and to the complete answer. Questions are numbered so the answer cache does
+not short-circuit the LLM call.
+
+    python -m benchmarks.stub_llm_server --port 9100 --latency-ms 800 --token-delay-ms 20 &
+    OPENROUTER_BASE_URL=http://127.0.0.1:9100/v1 uvicorn main:app --port 8000 &
+    python -m benchmarks.ttfb_stream --url http://127.0.0.1:8000 --runs 20
+"""
+import argparse
+import json
+import time
+import httpx
+import numpy as np
+
+
+def measure_stream(client, url, query):
+    timings = {}
+    start = time.perf_counter()
+    with client.stream("POST", f"{url}/ask-query/stream", json={"query": query}) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            now = (time.perf_counter() - start) * 1000
+            timings.setdefault("first_byte_ms", now)
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+                timings.setdefault(f"first_{event}_ms", now)
+    timings["total_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def measure_buffered(client, url, query):
+    start = time.perf_counter()
+    resp = client.post(f"{url}/ask-query", json={"query": query})
+    resp.raise_for_status()
+    elapsed = (time.perf_counter() - start) * 1000
+    return {"first_byte_ms": elapsed, "total_ms": elapsed}
+
+
+def summarize(runs):
+    keys = sorted({key for run in runs for key in run})
+    return {
+        key: {
+            "p50": round(float(np.percentile([r[key] for r in runs if key in r], 50)), 1),
+            "p95": round(float(np.percentile([r[key] for r in runs if key in r], 95)), 1),
+        }
+        for key in keys
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    with httpx.Client(timeout=120) as client:
+        streamed = [measure_stream(client, args.url, f"What is the grace period? (stream #{i})") for i in range(args.runs)]
+        buffered = [measure_buffered(client, args.url, f"What is the grace period? (buffered #{i})") for i in range(args.runs)]
+    print(json.dumps({"stream": summarize(streamed), "buffered": summarize(buffered)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
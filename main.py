@@ -13,6 +13,7 @@ Insurance Reasoning Engine - Quickstart
    - POST /upload-docs: Upload and index insurance documents (PDF, DOCX, EML)
    - POST /ask-query: Ask a natural language query about coverage
    - GET /clauses/{id}: Retrieve full text of a clause by chunk_id
+   - GET /metrics: Prometheus metrics
    - GET /health: Healthcheck
 
 5. Run tests:
@@ -20,19 +21,45 @@ Insurance Reasoning Engine - Quickstart
 
 6. Deploy to Vercel: vercel --prod
 """
-from fastapi import FastAPI
-from routes import upload, query, clauses
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from routes import upload, query, clauses, metrics
+from services import llm_client
+from services.registry import registry
+from utils.metrics import REQUEST_SECONDS
 
-app = FastAPI(title="Insurance Reasoning Engine")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load the shared model and FAISS index once per worker; release them and the LLM connection pool on shutdown."""
+    registry.startup()
+    yield
+    await llm_client.close_client()
+    registry.shutdown()
+
+app = FastAPI(title="Insurance Reasoning Engine", lifespan=lifespan)
 
 # Include routers
 app.include_router(upload.router)
 app.include_router(query.router)
 app.include_router(clauses.router)
+app.include_router(metrics.router)
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Observe every request in the rag_http_request_seconds histogram, by route template."""
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
 
 @app.get("/health")
 def healthcheck():
-    """Healthcheck endpoint."""
-    return {"status": "ok"}
-
-# TODO: Add startup/shutdown events for FAISS index, model loading, etc.
\ No newline at end of file
+    """Healthcheck endpoint; answers before the model and index are loaded (see STARTUP_MODE)."""
+    return {"status": "ok", "services": registry.current_state(), "loaded": registry.loaded()}
\ No newline at end of file
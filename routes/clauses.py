@@ -1,35 +1,65 @@
-from fastapi import APIRouter
-from services.embedding_service import EmbeddingService
+from fastapi import APIRouter, Depends
+from services.registry import get_embedding_service, get_ingestion_service, get_query_service
 
 router = APIRouter()
-embedding_service = EmbeddingService()
 
 @router.get("/clauses/{id}")
-def get_clause(id: str):
-    """Return full text of clause by ID (chunk_id)."""
+def get_clause(id: str, doc_id: str = None, doc_service=Depends(get_ingestion_service)):
+    """Return full text of clause by ID (chunk_id).
+
+    chunk_id restarts at 0 in every document, so pass doc_id; without it the lookup only
+    succeeds when a single document has that chunk_id.
+    """
     try:
         chunk_id = int(id)
-        for meta in embedding_service.metadata:
-            if meta.get("chunk_id") == chunk_id:
-                return {"text": meta.get("text", ""), "metadata": meta}
-        return {"error": "Clause not found."}
+        if doc_id is not None:
+            meta = doc_service.get_clause(doc_id, chunk_id)
+        else:
+            matches = doc_service.embedding_service.chunk_store.find_by_chunk_id(chunk_id)
+            if len(matches) > 1:
+                return {"error": "Clause id is ambiguous across documents; pass doc_id."}
+            meta = matches[0][1] if matches else None
+        if meta is None:
+            return {"error": "Clause not found."}
+        return {"text": meta.get("text", ""), "metadata": meta}
     except Exception as e:
         return {"error": str(e)}
 
 @router.get("/debug/chunks")
-def list_all_chunks():
-    """Debug endpoint to list all available chunks."""
+def list_all_chunks(offset: int = 0, limit: int = 100, embedding_service=Depends(get_embedding_service)):
+    """Debug endpoint to list stored chunks, a page at a time."""
     try:
+        chunk_store = embedding_service.chunk_store
         chunks = []
-        for i, meta in enumerate(embedding_service.metadata):
+        for row_id, meta in chunk_store.page(offset, limit):
             chunks.append({
-                "chunk_id": i,
+                "row_id": row_id,
                 "text_preview": meta.get("text", "")[:200] + "..." if len(meta.get("text", "")) > 200 else meta.get("text", ""),
                 "metadata": meta
             })
         return {
-            "total_chunks": len(chunks),
+            "total_chunks": chunk_store.count(),
+            "offset": offset,
             "chunks": chunks
         }
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@router.get("/debug/embedding-cache")
+def embedding_cache_stats(embedding_service=Depends(get_embedding_service)):
+    """Hit-rate statistics for the embedding cache."""
+    if embedding_service.embedding_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **embedding_service.embedding_cache.stats()}
+
+@router.get("/debug/embedding-engine")
+def embedding_engine_stats(embedding_service=Depends(get_embedding_service)):
+    """Encode throughput per batch, for sizing ingestion nodes."""
+    return embedding_service.engine.stats()
+
+@router.get("/debug/reranker")
+def reranker_stats(query_service=Depends(get_query_service)):
+    """Score-cache statistics for the cross-encoder reranker."""
+    if query_service.reranker is None:
+        return {"enabled": False}
+    return {"enabled": True, **query_service.reranker.stats()}
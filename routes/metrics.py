@@ -0,0 +1,42 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from services.registry import registry
+from utils.metrics import CONTENT_TYPE, INDEX_GENERATION, INDEX_SIZE, REGISTRY, format_family
+
+router = APIRouter()
+
+def _update_index_gauges(embedding_service):
+    index = embedding_service.index
+    INDEX_SIZE.set(index.ntotal if index is not None else 0, kind="vectors")
+    INDEX_SIZE.set(len(embedding_service.tombstones), kind="tombstones")
+    INDEX_SIZE.set(embedding_service.chunk_store.count(), kind="chunks")
+    INDEX_GENERATION.set(embedding_service.generation)
+
+def _cache_lines(embedding_service, query_service):
+    samples = []
+    caches = {}
+    if query_service is not None:
+        caches["answer"] = (query_service.answer_cache, {"exact_hits": "hit", "semantic_hits": "semantic_hit", "misses": "miss"})
+    if embedding_service is not None:
+        caches["embedding"] = (embedding_service.embedding_cache, {"memory_hits": "hit", "disk_hits": "disk_hit", "misses": "miss"})
+    if query_service is not None:
+        caches["rerank"] = (query_service.reranker, {"hits": "hit", "misses": "miss"})
+    for cache, (owner, results) in caches.items():
+        if owner is None:
+            continue
+        stats = owner.stats()
+        samples.extend(("", [("cache", cache), ("result", result)], stats[key]) for key, result in results.items())
+    return format_family("rag_cache_lookups_total", "counter", "Cache lookups by cache and result.", samples)
+
+@router.get("/metrics")
+def metrics():
+    """Prometheus metrics: stage latency histograms, request latency, LLM tokens, index size and cache hits.
+
+    Index and cache figures come only from services already loaded: a scrape never loads the
+    model or the index (STARTUP_MODE=lazy).
+    """
+    embedding_service, query_service = registry.built("embedding"), registry.built("query")
+    if embedding_service is not None:
+        _update_index_gauges(embedding_service)
+    extra = _cache_lines(embedding_service, query_service)
+    return PlainTextResponse(REGISTRY.render(extra), media_type=CONTENT_TYPE)
@@ -1,11 +1,42 @@
-from fastapi import APIRouter, Body
-from services.query_reasoning_service import QueryReasoningService
+import json
+import os
+from typing import List
+from fastapi import APIRouter, Body, Depends, Response
+from fastapi.responses import StreamingResponse
+from services.registry import get_query_service
 
 router = APIRouter()
-query_service = QueryReasoningService()
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
 
 @router.post("/ask-query")
-def ask_query(query: str = Body(..., embed=True)):
-    """Accepts a natural language query and returns structured JSON decision."""
-    result = query_service.answer_query(query)
-    return result
\ No newline at end of file
+async def ask_query(response: Response, query: str = Body(..., embed=True), doc_id: str = Body(None, embed=True), tenant: str = Body(None, embed=True), query_service=Depends(get_query_service)):
+    """Accepts a natural language query and returns structured JSON decision.
+
+    doc_id / tenant restrict retrieval to one document / one tenant's documents.
+    """
+    result = await query_service.answer_query(query, doc_id=doc_id, tenant=tenant)
+    response.headers["X-Answer-Cache"] = "hit" if result.get("cached") else "miss"
+    return result
+
+
+@router.post("/ask-query/stream")
+async def ask_query_stream(query: str = Body(..., embed=True), doc_id: str = Body(None, embed=True), tenant: str = Body(None, embed=True), query_service=Depends(get_query_service)):
+    """Same as /ask-query, streamed as server-sent events: sources, answer tokens, then the final result."""
+    async def events():
+        async for event, data in query_service.stream_answer(query, doc_id=doc_id, tenant=tenant):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/ask-query/batch")
+async def ask_query_batch(queries: List[str] = Body(..., embed=True), doc_id: str = Body(None, embed=True), tenant: str = Body(None, embed=True), query_service=Depends(get_query_service)):
+    """Answer many questions in one request; results are returned in the same order as the queries."""
+    if len(queries) > BATCH_MAX_QUERIES:
+        return {"error": f"At most {BATCH_MAX_QUERIES} queries per batch."}
+    return {"results": await query_service.answer_queries(queries, doc_id=doc_id, tenant=tenant)}
@@ -1,25 +1,135 @@
-from fastapi import APIRouter, UploadFile, File
+from fastapi import APIRouter, UploadFile, File, Form, Depends, Request
+from fastapi.responses import JSONResponse
 import os
-import tempfile
-from services.doc_ingestion_service import DocIngestionService
+import shutil
+from starlette.concurrency import run_in_threadpool
+from services.ingestion_jobs import QueueFullError
+from services.registry import get_ingestion_jobs, get_ingestion_service
+from utils.multipart_stream import stream_multipart
 
 router = APIRouter()
-doc_service = DocIngestionService()
+
+SUPPORTED_SUFFIXES = (".pdf", ".docx", ".eml")
+# Seconds clients are told to wait before retrying when the ingestion queue is full.
+RETRY_AFTER_SECONDS = 30
+# Files accepted by one /upload-docs/batch request.
+MAX_BATCH_FILES = int(os.getenv("UPLOAD_BATCH_MAX_FILES", "1000"))
+# Bytes copied at a time from an upload to disk.
+UPLOAD_COPY_BYTES = 1024 * 1024
+
+def _queue_full_response(e):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(e)},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
+
+def _remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def _queue_upload(file, jobs, replaces=None, tenant=None):
+    """Write an upload to the jobs' incoming directory and queue it; returns the response body."""
+    filename = os.path.basename(file.filename)
+    suffix = os.path.splitext(filename)[1].lower()
+    if suffix not in SUPPORTED_SUFFIXES:
+        return {"error": f"Unsupported file type: {suffix}"}
+    job_id = jobs.new_job_id()
+    upload_path = jobs.incoming_path(job_id, suffix)
+    with open(upload_path, "wb") as out:
+        shutil.copyfileobj(file.file, out, UPLOAD_COPY_BYTES)
+    try:
+        job = jobs.submit(job_id, upload_path, filename, replaces=replaces, tenant=tenant)
+    except QueueFullError as e:
+        os.remove(upload_path)
+        return _queue_full_response(e)
+    return {"job_id": job["job_id"], "status": job["status"]}
 
 @router.post("/upload-docs")
-def upload_docs(file: UploadFile = File(...)):
-    """Upload and index insurance documents (PDF, DOCX, EML)."""
-    # Save uploaded file to temp location
+def upload_docs(file: UploadFile = File(...), tenant: str = Form(None), jobs=Depends(get_ingestion_jobs)):
+    """Upload insurance documents (PDF, DOCX, EML) and queue them for indexing.
+
+    Returns a job id immediately; poll /upload-jobs/{job_id} for progress and the doc_id.
+    tenant groups the document for scoped questions.
+    """
+    try:
+        return _queue_upload(file, jobs, tenant=tenant)
+    except Exception as e:
+        return {"error": str(e)}
+
+@router.post("/upload-docs/batch")
+async def upload_docs_batch(request: Request, jobs=Depends(get_ingestion_jobs)):
+    """Upload many documents in one multipart request (repeat the `files` field) and queue them as one job.
+
+    Files are streamed to disk as they arrive rather than buffered. The job ingests them
+    through the bulk pipeline; poll /upload-jobs/{job_id} for progress and, once finished,
+    a doc_id or error per file. Unsupported files are listed in `rejected` and skipped.
+    """
+    job_id = jobs.new_job_id()
+    saved, rejected = [], []
+
+    # Called from the parser's worker thread, so opening and writing never block the event loop.
+    def open_file(field, filename):
+        filename = os.path.basename(filename)
+        suffix = os.path.splitext(filename)[1].lower()
+        if suffix not in SUPPORTED_SUFFIXES:
+            rejected.append({"filename": filename, "error": f"Unsupported file type: {suffix}"})
+            return None
+        if len(saved) >= MAX_BATCH_FILES:
+            rejected.append({"filename": filename, "error": f"More than {MAX_BATCH_FILES} files in one batch"})
+            return None
+        path = jobs.incoming_path(f"{job_id}-{len(saved)}", suffix)
+        saved.append((path, filename))
+        return open(path, "wb")
+
+    try:
+        fields = await stream_multipart(request, open_file)
+        if not saved:
+            return {"error": "No supported files in the upload.", "rejected": rejected}
+        job = await run_in_threadpool(jobs.submit_batch, job_id, saved, tenant=fields.get("tenant"))
+    except Exception as e:
+        await run_in_threadpool(_remove_files, [path for path, _ in saved])
+        if isinstance(e, QueueFullError):
+            return _queue_full_response(e)
+        return {"error": str(e)}
+    return {"job_id": job["job_id"], "status": job["status"], "files": len(saved), "rejected": rejected}
+
+@router.put("/documents/{doc_id}")
+def replace_document(doc_id: str, file: UploadFile = File(...), tenant: str = Form(None), jobs=Depends(get_ingestion_jobs), doc_service=Depends(get_ingestion_service)):
+    """Upload a new version of a document; the old one is deleted once the new one is indexed.
+
+    Returns a job id like /upload-docs; the new version gets its own doc_id and keeps the
+    old version's tenant unless another is given.
+    """
     try:
-        suffix = os.path.splitext(file.filename)[1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(file.file.read())
-            tmp_path = tmp.name
-        doc_id = doc_service.ingest_document(tmp_path)
-        os.remove(tmp_path)
-        if doc_id:
-            return {"doc_id": doc_id}
-        else:
-            return {"error": "Failed to ingest document."}
+        if not doc_service.has_document(doc_id):
+            return {"error": "Document not found."}
+        if tenant is None:
+            tenant = (doc_service.content_store.get_document(doc_id) or {}).get("tenant")
+        return _queue_upload(file, jobs, replaces=doc_id, tenant=tenant)
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@router.delete("/documents/{doc_id}")
+def delete_document(doc_id: str, doc_service=Depends(get_ingestion_service)):
+    """Delete a document; its chunks stop appearing in search results immediately."""
+    try:
+        deleted = doc_service.delete_document(doc_id)
+        if deleted is None:
+            return {"error": "Document not found."}
+        return {"doc_id": doc_id, "deleted_chunks": deleted}
+    except Exception as e:
+        return {"error": str(e)}
+
+@router.get("/upload-jobs/{job_id}")
+def upload_job_status(job_id: str, jobs=Depends(get_ingestion_jobs)):
+    """Report an ingestion job's status, progress and, once finished, its doc_id."""
+    job = jobs.get(job_id)
+    if job is None:
+        return {"error": "Job not found."}
+    job.pop("file_path", None)
+    job.pop("pending_doc_id", None)
+    if "files" in job:
+        job["files"] = [f["filename"] for f in job["files"]]
+    return job
@@ -0,0 +1,105 @@
+"""
+Cache of /ask-query answers matched by normalized question text or embedding similarity.
+
+Entries expire after a TTL, the least recently used entry is evicted when the cache is full,
+and everything is dropped as soon as the generation (of the index and of the documents
+recorded over it) changes, so answers never outlive the document set they were produced
+from. Answers to scoped questions (one document or tenant) are only reused within the same
+scope.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return _WHITESPACE.sub(" ", query.lower()).strip().rstrip("?.!").strip()
+
+
+class AnswerCache:
+    def __init__(self, max_entries=1000, ttl_seconds=3600, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()  # (scope, normalized query) -> (created_at, unit embedding or None, result)
+        self._generation = None
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _sync_generation(self, generation):
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def _expire(self, now):
+        expired = [key for key, (created_at, _, _) in self._entries.items() if now - created_at > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get_exact(self, query, generation, scope=None):
+        """Return a cached result for the same normalized question, or None."""
+        key = (scope, normalize_query(query))
+        with self._lock:
+            self._sync_generation(generation)
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return dict(entry[2])
+
+    def get_similar(self, query_embedding, generation, scope=None):
+        """Return the cached result of the most similar question above the threshold, or None."""
+        with self._lock:
+            self._sync_generation(generation)
+            self._expire(time.time())
+            candidates = [
+                (key, entry[1]) for key, entry in self._entries.items() if entry[1] is not None and key[0] == scope
+            ]
+            if not candidates or self.similarity_threshold > 1:
+                self.misses += 1
+                return None
+            matrix = np.stack([vector for _, vector in candidates])
+            scores = matrix @ self._unit(query_embedding)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            key = candidates[best][0]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return dict(self._entries[key][2])
+
+    def put(self, query, query_embedding, generation, result, scope=None):
+        key = (scope, normalize_query(query))
+        vector = self._unit(query_embedding) if query_embedding is not None else None
+        with self._lock:
+            self._sync_generation(generation)
+            self._entries[key] = (time.time(), vector, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,356 @@
+"""
+Pipelined ingestion of many documents at once.
+
+Documents flow through three stages that run at the same time, connected by bounded queues:
+    parse   a process pool hashes, parses and chunks whole documents
+    embed   one thread batches chunks across documents (skipping text the index already
+            holds) and encodes each batch with the embedding model
+    write   one thread adds each batch's vectors to the index and records the documents
+            whose chunks are all written, each under the locks a single-file ingest takes
+Only a few documents are being parsed, and a few batches queued, at any time, so memory
+stays bounded however many files are ingested. The report gives docs/sec and chunks/sec and
+how long each stage was busy, which shows the bottleneck.
+
+Ingest a local directory (recursively) with:
+    python -m services.bulk_ingestion path/to/policies --tenant acme
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from services.content_store import chunk_key, file_sha256
+from services.lexical_index import keyword_groups
+from utils import parser_utils, text_splitter
+from utils.metrics import STAGE_SECONDS, span
+from utils.logging_utils import get_logger
+
+logger = get_logger("bulk_ingestion")
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".eml")
+# Processes parsing and chunking documents (1 parses on the calling thread).
+BULK_PARSE_WORKERS = int(os.getenv("BULK_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Chunks encoded per batch; batches span documents so small files still fill them.
+BULK_EMBED_BATCH_CHUNKS = int(os.getenv("BULK_EMBED_BATCH_CHUNKS", "512"))
+# Parsed documents (and encoded batches) that may wait between stages.
+BULK_QUEUE_SIZE = int(os.getenv("BULK_QUEUE_SIZE", "8"))
+
+_DONE = None
+
+
+def parse_document(file_path):
+    """Hash, parse and chunk one file. Runs in a parse worker process; returns a picklable dict."""
+    result = {"file_path": file_path, "chunks": [], "pages": 0, "parse_seconds": 0.0, "chunk_seconds": 0.0, "error": None}
+    try:
+        result["file_hash"] = file_sha256(file_path)
+        start = time.perf_counter()
+        ext = os.path.splitext(file_path)[1].lower()
+        if ext == ".pdf":
+            pages = list(parser_utils.iter_pdf_pages(file_path, workers=1))
+        else:
+            text = parser_utils.parse_docx(file_path) if ext == ".docx" else parser_utils.parse_eml(file_path)
+            pages = [(None, text)] if text else []
+        result["pages"] = len(pages)
+        parsed = time.perf_counter()
+        result["parse_seconds"] = parsed - start
+        chunks = list(text_splitter.semantic_chunk_pages(iter(pages)))
+        for chunk in chunks:
+            chunk["metadata"]["keywords"] = keyword_groups(chunk["text"])
+        result["chunks"] = chunks
+        result["chunk_seconds"] = time.perf_counter() - parsed
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+class BulkIngestionPipeline:
+    def __init__(self, ingestion_service, parse_workers=None, batch_chunks=BULK_EMBED_BATCH_CHUNKS, queue_size=BULK_QUEUE_SIZE):
+        self.ingestion_service = ingestion_service
+        self.embedding_service = ingestion_service.embedding_service
+        self.content_store = ingestion_service.content_store
+        self.parse_workers = parse_workers or BULK_PARSE_WORKERS
+        self.batch_chunks = batch_chunks
+        self.queue_size = queue_size
+
+    def run(self, files, progress=None, tenant=None, move_sources=False, doc_ids=None):
+        """Ingest (file_path, filename) pairs. Returns a report with a result per file, in order.
+
+        Each result has a status: "ingested", "duplicate" (already indexed; doc_id is the
+        existing document) or "failed". progress(stage, **counts) is called as documents are
+        written. move_sources moves each original into upload_dir instead of copying it.
+        doc_ids, one per file, are the ids new documents are recorded under (default: fresh ones).
+        """
+        progress = progress or (lambda stage, **counts: None)
+        run = _Run(files, tenant, move_sources, progress, doc_ids)
+        parsed_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            threading.Thread(target=self._guard, args=(run, self._embed_stage, parsed_queue, write_queue), name="bulk-embed", daemon=True),
+            threading.Thread(target=self._guard, args=(run, self._write_stage, write_queue), name="bulk-write", daemon=True),
+        ]
+        for thread in stages:
+            thread.start()
+        progress("processing", documents_total=len(files), documents_done=0)
+        try:
+            self._parse_stage(run, parsed_queue)
+        finally:
+            parsed_queue.put(_DONE)
+            for thread in stages:
+                thread.join()
+            # Vectors no recorded document uses: the run failed before their documents were
+            # recorded, or a concurrent upload of the same file was recorded first.
+            self.ingestion_service.discard_rows(run.unrecorded.values())
+        if run.error is not None:
+            raise run.error
+        return run.report()
+
+    def _guard(self, run, stage, *queues):
+        """Run a stage thread; on failure keep draining its input so upstream stages never block."""
+        try:
+            stage(run, *queues)
+        except Exception as e:
+            logger.exception("Bulk ingestion stage failed")
+            run.error = run.error or e
+            inbox = queues[0]
+            while inbox.get() is not _DONE:
+                pass
+            if len(queues) > 1:
+                queues[1].put(_DONE)
+
+    def _parse_stage(self, run, parsed_queue):
+        paths = [path for path, _ in run.files]
+        if self.parse_workers <= 1:
+            for index, path in enumerate(paths):
+                if run.error is not None:
+                    return
+                parsed_queue.put((index, parse_document(path)))
+            return
+        # Spawned workers avoid forking a process that has request and ingestion threads running.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=context) as pool:
+            # Results are handed on in file order, so the first copy of a repeated file is the one ingested.
+            pending = deque()
+            remaining = iter(enumerate(paths))
+            while True:
+                while run.error is None and len(pending) < self.parse_workers * 2:
+                    item = next(remaining, None)
+                    if item is None:
+                        break
+                    pending.append((item[0], pool.submit(parse_document, item[1])))
+                if not pending:
+                    return
+                index, future = pending.popleft()
+                parsed_queue.put((index, future.result()))
+
+    def _embed_stage(self, run, parsed_queue, write_queue):
+        batch = []  # (chunk hash, chunk) to encode
+        waiting = []  # documents whose new chunks are in the current batch
+        queued_hashes = set()  # chunk texts already sent to be embedded during this run
+
+        def flush():
+            if batch:
+                start = time.perf_counter()
+                with span("embed"):
+                    vectors = self.embedding_service.encode([chunk["text"] for _, chunk in batch])
+                run.busy["embed"] += time.perf_counter() - start
+                write_queue.put(("vectors", [h for h, _ in batch], [chunk for _, chunk in batch], vectors))
+                batch.clear()
+            for document in waiting:
+                write_queue.put(("document", document))
+            waiting.clear()
+
+        while True:
+            item = parsed_queue.get()
+            if item is _DONE:
+                break
+            if run.error is not None:
+                continue  # The writer failed; just drain the queue.
+            index, parsed = item
+            run.busy["parse"] += parsed["parse_seconds"] + parsed["chunk_seconds"]
+            STAGE_SECONDS.observe(parsed["parse_seconds"], stage="parse")
+            STAGE_SECONDS.observe(parsed["chunk_seconds"], stage="chunk")
+            document = self._prepare(run, index, parsed)
+            if document is None:
+                continue
+            hashes = [chunk_key(chunk["text"], run.tenant) for chunk in parsed["chunks"]]
+            known_rows = self.content_store.find_chunk_rows(hashes)
+            document["hashes"] = hashes
+            document["chunks"] = parsed["chunks"]
+            for chunk_hash, chunk in zip(hashes, parsed["chunks"]):
+                if chunk_hash in known_rows or chunk_hash in queued_hashes:
+                    continue
+                queued_hashes.add(chunk_hash)
+                batch.append((chunk_hash, chunk))
+            waiting.append(document)
+            if len(batch) >= self.batch_chunks:
+                flush()
+        flush()
+        write_queue.put(_DONE)
+
+    def _prepare(self, run, index, parsed):
+        """Assign a doc_id to a parsed file, or record why it is skipped. Returns the document or None."""
+        file_path, filename = run.files[index]
+        if parsed["error"] is not None:
+            run.finish(index, status="failed", error=parsed["error"])
+            return None
+        file_hash = parsed["file_hash"]
+        if run.tenant is not None:
+            # Tenants do not share documents, so each gets its own copy of a common file.
+            file_hash = f"{run.tenant}/{file_hash}"
+        existing = self.content_store.find_document(file_hash) or run.doc_ids.get(file_hash)
+        if existing:
+            run.finish(index, status="duplicate", doc_id=existing)
+            return None
+        if not parsed["chunks"]:
+            run.finish(index, status="failed", error="No text extracted from document.")
+            return None
+        doc_id = run.assigned_doc_ids[index] if run.assigned_doc_ids else str(uuid.uuid4())
+        run.doc_ids[file_hash] = doc_id
+        for chunk in parsed["chunks"]:
+            chunk["metadata"].update({"doc_id": doc_id, "filename": filename})
+            if run.tenant is not None:
+                chunk["metadata"]["tenant"] = run.tenant
+        return {
+            "index": index, "doc_id": doc_id, "file_hash": file_hash, "file_path": file_path, "filename": filename,
+            "pages": parsed["pages"],
+        }
+
+    def _write_stage(self, run, write_queue):
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                return
+            start = time.perf_counter()
+            if item[0] == "vectors":
+                _, hashes, chunks, vectors = item
+                run.unrecorded.update(zip(hashes, self.embedding_service.add_embeddings(chunks, vectors)))
+                run.chunks_embedded += len(chunks)
+            else:
+                self._record(run, item[1])
+            run.busy["write"] += time.perf_counter() - start
+
+    def _record(self, run, document):
+        with self.ingestion_service.ingest_lock(document["file_hash"]):
+            existing = self.content_store.find_document(document["file_hash"])
+            if existing:
+                run.finish(document["index"], status="duplicate", doc_id=existing)
+                return
+            # Looked up again under the lock: a document deleted since the embed stage
+            # looked may have taken rows with it, and those chunks are embedded again.
+            rows = self.content_store.find_chunk_rows(document["hashes"])
+            new_rows = {h: run.unrecorded[h] for h in document["hashes"] if h not in rows and h in run.unrecorded}
+            missing = {
+                h: chunk for h, chunk in zip(document["hashes"], document["chunks"]) if h not in rows and h not in new_rows
+            }
+            if missing:
+                embedded = dict(zip(missing, self.embedding_service.embed_chunks(list(missing.values()))))
+                run.unrecorded.update(embedded)
+                new_rows.update(embedded)
+                run.chunks_embedded += len(embedded)
+            rows.update(new_rows)
+            chunk_rows = [(chunk["metadata"]["chunk_id"], rows[h]) for h, chunk in zip(document["hashes"], document["chunks"])]
+            self.content_store.record_document(
+                document["file_hash"], document["doc_id"], document["filename"], chunk_rows, new_rows, tenant=run.tenant,
+            )
+            for chunk_hash in new_rows:
+                run.unrecorded.pop(chunk_hash, None)
+            self.ingestion_service.store_original(document["file_path"], document["doc_id"], document["filename"], move=run.move_sources)
+        run.chunks += len(chunk_rows)
+        run.finish(document["index"], status="ingested", doc_id=document["doc_id"], chunks=len(chunk_rows), pages=document["pages"])
+
+
+class _Run:
+    """State and results of one pipeline run, shared by its stages."""
+
+    def __init__(self, files, tenant, move_sources, progress, assigned_doc_ids=None):
+        self.files = files
+        self.assigned_doc_ids = assigned_doc_ids  # doc_id per file given by the caller, if any
+        self.tenant = tenant
+        self.move_sources = move_sources
+        self.progress = progress
+        self.results = [None] * len(files)
+        self.doc_ids = {}  # file hash -> doc_id assigned during this run
+        self.unrecorded = {}  # chunk hash -> row id of vectors written but not yet recorded
+        self.chunks = 0
+        self.chunks_embedded = 0
+        self.busy = {"parse": 0.0, "embed": 0.0, "write": 0.0}
+        self.error = None
+        self.done = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def finish(self, index, status, **fields):
+        with self._lock:
+            self.results[index] = {"filename": self.files[index][1], "status": status, **fields}
+            self.done += 1
+            done = self.done
+        self.progress("processing", documents_total=len(self.files), documents_done=done, chunks_total=self.chunks, chunks_embedded=self.chunks_embedded)
+
+    def report(self):
+        seconds = time.perf_counter() - self.started
+        counts = {status: sum(1 for r in self.results if r and r["status"] == status) for status in ("ingested", "duplicate", "failed")}
+        return {
+            "documents": len(self.files),
+            **counts,
+            "chunks": self.chunks,
+            "chunks_embedded": self.chunks_embedded,
+            "seconds": round(seconds, 3),
+            "docs_per_sec": round(len(self.files) / seconds, 2) if seconds else None,
+            "chunks_per_sec": round(self.chunks / seconds, 2) if seconds else None,
+            "stage_busy_seconds": {stage: round(busy, 3) for stage, busy in self.busy.items()},
+            "results": self.results,
+        }
+
+
+def find_documents(root):
+    """Every supported file under root (or root itself if it is a file), sorted."""
+    if os.path.isfile(root):
+        return [root]
+    found = []
+    for dirpath, _, filenames in os.walk(root):
+        found.extend(os.path.join(dirpath, name) for name in filenames if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS)
+    return sorted(found)
+
+
+def main():
+    from services.doc_ingestion_service import DocIngestionService
+    from services.embedding_service import EmbeddingService
+
+    parser = argparse.ArgumentParser(description="Ingest every PDF, DOCX and EML file under a directory.")
+    parser.add_argument("paths", nargs="+", help="files or directories to ingest")
+    parser.add_argument("--tenant")
+    parser.add_argument("--parse-workers", type=int, default=BULK_PARSE_WORKERS)
+    parser.add_argument("--move", action="store_true", help="move the files into data/uploaded_docs instead of copying them")
+    parser.add_argument("--model", default=os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    args = parser.parse_args()
+
+    paths = [path for root in args.paths for path in find_documents(root)]
+    if not paths:
+        logger.error("No PDF, DOCX or EML files found.")
+        return
+    embedding_service = EmbeddingService(model_name=args.model)
+    ingestion = DocIngestionService(embedding_service=embedding_service)
+    last_log = 0.0
+
+    def progress(stage, documents_done=0, documents_total=0, **counts):
+        nonlocal last_log
+        if time.monotonic() - last_log >= 5 or documents_done == documents_total:
+            last_log = time.monotonic()
+            logger.info(f"{documents_done}/{documents_total} documents, {counts.get('chunks_total', 0)} chunks")
+
+    report = ingestion.ingest_many([(path, os.path.basename(path)) for path in paths], progress=progress, tenant=args.tenant, move_sources=args.move, parse_workers=args.parse_workers)
+    embedding_service.close()
+    ingestion.content_store.close()
+    print(json.dumps({key: value for key, value in report.items() if key != "results"}, indent=2))
+    for path, result in zip(paths, report["results"]):
+        if result["status"] == "failed":
+            logger.error(f"{path}: {result['error']}")
+
+
+if __name__ == "__main__":
+    main()
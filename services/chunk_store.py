@@ -0,0 +1,208 @@
+"""
+SQLite-backed store of chunk text and metadata, keyed by FAISS row id.
+
+Replaces the pickled metadata list that every process used to hold in RAM. Rows are read on
+demand (search results, clause lookups) through a memory-mapped database file, so resident
+memory no longer grows with the corpus text. Rows are also indexed by (doc_id, chunk_id) for
+clause lookups. Row ids double as FAISS vector ids and are never handed out twice, even after
+the rows are deleted. An FTS5 table over the chunk text, kept in step by triggers, is the
+inverted index behind BM25 keyword search.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from utils.logging_utils import get_logger
+
+logger = get_logger("chunk_store")
+
+# Bytes of the database file SQLite may memory-map for reads.
+CHUNK_STORE_MMAP_BYTES = int(os.getenv("CHUNK_STORE_MMAP_BYTES", str(256 * 1024 * 1024)))
+
+
+class ChunkStore:
+    def __init__(self, db_path="data/faiss_index/chunks.db"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA mmap_size={CHUNK_STORE_MMAP_BYTES}")
+        # INSERT OR REPLACE must fire the delete trigger so the replaced text leaves the FTS index.
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        has_fts = self._conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone()
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                row_id INTEGER PRIMARY KEY,
+                doc_id TEXT,
+                chunk_id INTEGER,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_by_doc ON chunks (doc_id, chunk_id);
+            CREATE INDEX IF NOT EXISTS chunks_by_chunk_id ON chunks (chunk_id);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text, content='chunks', content_rowid='row_id', tokenize='porter unicode61'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.row_id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.row_id, old.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_fts_update AFTER UPDATE OF text ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.row_id, old.text);
+                INSERT INTO chunks_fts (rowid, text) VALUES (new.row_id, new.text);
+            END;
+        """)
+        if not has_fts:
+            # First open since keyword search was added: index the rows stored so far.
+            self._conn.execute("INSERT INTO chunks_fts (chunks_fts) VALUES ('rebuild')")
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(row_id, metadata):
+        meta = {key: value for key, value in metadata.items() if key != "text"}
+        return (row_id, meta.get("doc_id"), meta.get("chunk_id"), metadata.get("text", ""), json.dumps(meta))
+
+    @staticmethod
+    def _decode(text, metadata_json):
+        metadata = json.loads(metadata_json)
+        metadata["text"] = text
+        return metadata
+
+    def put_rows(self, start_row, metadata, replace=True):
+        """Store metadata dicts for rows start_row, start_row + 1, ... in one transaction."""
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"{verb} INTO chunks (row_id, doc_id, chunk_id, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [self._encode(start_row + i, meta) for i, meta in enumerate(metadata)],
+            )
+            # Recorded with the rows so their ids stay taken after they are deleted.
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES ('next_row_id', ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = MAX(value, excluded.value)",
+                (start_row + len(metadata),),
+            )
+
+    def next_row_id(self):
+        """The lowest row id that has never been used."""
+        with self._lock:
+            counter = self._conn.execute("SELECT value FROM counters WHERE name = 'next_row_id'").fetchone()
+            max_row = self._conn.execute("SELECT MAX(row_id) FROM chunks").fetchone()[0]
+        return max(counter[0] if counter else 0, max_row + 1 if max_row is not None else 0)
+
+    def get_rows(self, row_ids):
+        """Return {row_id: metadata} for the requested rows that exist; metadata includes 'text'."""
+        ids = list({int(row_id) for row_id in row_ids})
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row_id, text, metadata_json in self._conn.execute(
+                    f"SELECT row_id, text, metadata FROM chunks WHERE row_id IN ({placeholders})", batch
+                ):
+                    found[row_id] = self._decode(text, metadata_json)
+        return found
+
+    def find(self, doc_id, chunk_id):
+        """Return (row_id, metadata) for a document's chunk, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT row_id, text, metadata FROM chunks WHERE doc_id = ? AND chunk_id = ? LIMIT 1", (doc_id, chunk_id)
+            ).fetchone()
+        return (row[0], self._decode(row[1], row[2])) if row else None
+
+    def find_by_chunk_id(self, chunk_id, limit=2):
+        """Return up to limit (row_id, metadata) pairs with this chunk_id, across documents."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_id, text, metadata FROM chunks WHERE chunk_id = ? ORDER BY row_id LIMIT ?", (chunk_id, limit)
+            ).fetchall()
+        return [(row_id, self._decode(text, metadata_json)) for row_id, text, metadata_json in rows]
+
+    def page(self, offset=0, limit=100):
+        """Return (row_id, metadata) pairs in row order, for listing."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_id, text, metadata FROM chunks ORDER BY row_id LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [(row_id, self._decode(text, metadata_json)) for row_id, text, metadata_json in rows]
+
+    def lexical_search(self, match, k, row_ids=None):
+        """BM25-rank rows against an FTS5 MATCH expression. Returns up to k (row_id, score), best first.
+
+        row_ids restricts the search to those rows. Scores are FTS5 bm25() values (lower is better).
+        """
+        sql = "SELECT rowid, bm25(chunks_fts) AS score FROM chunks_fts WHERE chunks_fts MATCH ?"
+        params = [match]
+        if row_ids is not None:
+            sql += " AND rowid IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps([int(row_id) for row_id in row_ids]))
+        sql += " ORDER BY score LIMIT ?"
+        params.append(k)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def row_ids(self):
+        """Return every stored row id."""
+        with self._lock:
+            return [row_id for (row_id,) in self._conn.execute("SELECT row_id FROM chunks")]
+
+    def doc_row_ids(self, doc_id):
+        """Return the row ids labelled with doc_id, in chunk order."""
+        with self._lock:
+            return [row_id for (row_id,) in self._conn.execute(
+                "SELECT row_id FROM chunks WHERE doc_id = ? ORDER BY chunk_id", (doc_id,)
+            )]
+
+    def delete_rows(self, row_ids):
+        """Delete rows by id; returns how many existed."""
+        ids = [int(row_id) for row_id in row_ids]
+        deleted = 0
+        with self._lock, self._conn:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                deleted += self._conn.execute(f"DELETE FROM chunks WHERE row_id IN ({placeholders})", batch).rowcount
+        return deleted
+
+    def relabel(self, row_id, doc_id, chunk_id, filename):
+        """Attribute a row to another document (when the document it was stored for is deleted)."""
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT metadata FROM chunks WHERE row_id = ?", (row_id,)).fetchone()
+            if row is None:
+                return
+            meta = json.loads(row[0])
+            meta.update(doc_id=doc_id, chunk_id=chunk_id, filename=filename)
+            self._conn.execute(
+                "UPDATE chunks SET doc_id = ?, chunk_id = ?, metadata = ? WHERE row_id = ?",
+                (doc_id, chunk_id, json.dumps(meta), row_id),
+            )
+
+    def migrate_pickle(self, meta_path):
+        """One-time import of a legacy meta.pkl metadata list; the file is renamed afterwards."""
+        if not os.path.exists(meta_path):
+            return 0
+        with open(meta_path, "rb") as f:
+            metadata = pickle.load(f)
+        # Rows already in the store win: they are newer than the pickle.
+        self.put_rows(0, metadata, replace=False)
+        os.replace(meta_path, f"{meta_path}.migrated")
+        logger.info(f"Migrated {len(metadata)} chunk rows from {meta_path}")
+        return len(metadata)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
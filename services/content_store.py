@@ -0,0 +1,204 @@
+"""
+Content-addressed bookkeeping for ingested documents and chunks.
+
+Documents are keyed by the SHA-256 of the uploaded file and chunks by the SHA-256 of their
+text, so re-uploading a known file returns its existing doc_id and identical chunks across
+documents share one FAISS vector. Both keys are prefixed with the tenant, so tenants never
+share a document or a vector. Documents can belong to a tenant; the vectors of a document
+or tenant are looked up here to scope searches.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    """Hash a file without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_key(text: str, tenant=None) -> str:
+    """Key under which a chunk's vector is shared: its text hash, only within one tenant."""
+    chunk_hash = text_sha256(text)
+    return chunk_hash if tenant is None else f"{tenant}/{chunk_hash}"
+
+
+class ContentStore:
+    def __init__(self, db_path="data/faiss_index/content.db"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                file_hash TEXT PRIMARY KEY,
+                doc_id TEXT UNIQUE NOT NULL,
+                filename TEXT,
+                created_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS chunk_vectors (
+                chunk_hash TEXT PRIMARY KEY,
+                row_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS doc_chunks (
+                doc_id TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                row_id INTEGER NOT NULL,
+                PRIMARY KEY (doc_id, chunk_id)
+            );
+            CREATE INDEX IF NOT EXISTS chunk_vectors_by_row ON chunk_vectors (row_id);
+            CREATE INDEX IF NOT EXISTS doc_chunks_by_row ON doc_chunks (row_id);
+            CREATE TABLE IF NOT EXISTS content_version (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                version INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO content_version (id, version) VALUES (0, 0);
+        """)
+        columns = {name for _, name, *_ in self._conn.execute("PRAGMA table_info(documents)")}
+        if "tenant" not in columns:
+            self._conn.execute("ALTER TABLE documents ADD COLUMN tenant TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_by_tenant ON documents (tenant)")
+        self._conn.commit()
+
+    def version(self):
+        """Counter bumped by every committed document change, in any process sharing the database.
+
+        Vectors are written before their document is recorded, so caches of what a question
+        can see are keyed on this as well as on the index generation.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT version FROM content_version WHERE id = 0").fetchone()[0]
+
+    def _bump_version(self):
+        self._conn.execute("UPDATE content_version SET version = version + 1 WHERE id = 0")
+
+    def find_document(self, file_hash: str):
+        """Return the doc_id previously ingested for this file hash, or None."""
+        with self._lock:
+            row = self._conn.execute("SELECT doc_id FROM documents WHERE file_hash = ?", (file_hash,)).fetchone()
+        return row[0] if row else None
+
+    def find_chunk_rows(self, chunk_hashes):
+        """Map each known chunk hash to the FAISS row holding its vector."""
+        found = {}
+        hashes = list(set(chunk_hashes))
+        with self._lock:
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for chunk_hash, row_id in self._conn.execute(
+                    f"SELECT chunk_hash, row_id FROM chunk_vectors WHERE chunk_hash IN ({placeholders})", batch
+                ):
+                    found[chunk_hash] = row_id
+        return found
+
+    def record_document(self, file_hash, doc_id, filename, chunk_rows, new_chunk_rows, tenant=None):
+        """Register a document in one transaction.
+
+        chunk_rows: list of (chunk_id, row_id) for every chunk in the document.
+        new_chunk_rows: dict of chunk_hash -> row_id for vectors added by this document.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents (file_hash, doc_id, filename, created_at, tenant) VALUES (?, ?, ?, ?, ?)",
+                (file_hash, doc_id, filename, time.time(), tenant),
+            )
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO chunk_vectors (chunk_hash, row_id) VALUES (?, ?)",
+                list(new_chunk_rows.items()),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO doc_chunks (doc_id, chunk_id, row_id) VALUES (?, ?, ?)",
+                [(doc_id, chunk_id, row_id) for chunk_id, row_id in chunk_rows],
+            )
+            self._bump_version()
+
+    def document_rows(self, doc_id):
+        """Return the FAISS rows making up a document, in chunk order."""
+        with self._lock:
+            return [row for (row,) in self._conn.execute(
+                "SELECT row_id FROM doc_chunks WHERE doc_id = ? ORDER BY chunk_id", (doc_id,)
+            )]
+
+    def chunk_row(self, doc_id, chunk_id):
+        """Return the FAISS row holding a document's chunk, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT row_id FROM doc_chunks WHERE doc_id = ? AND chunk_id = ?", (doc_id, chunk_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def get_document(self, doc_id):
+        """Return {"doc_id", "filename", "file_hash", "tenant"} for a document, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_hash, filename, tenant FROM documents WHERE doc_id = ?", (doc_id,)
+            ).fetchone()
+        return {"doc_id": doc_id, "filename": row[1], "file_hash": row[0], "tenant": row[2]} if row else None
+
+    def scope_chunks(self, doc_id=None, tenant=None):
+        """Return (row_id, doc_id, chunk_id, filename, tenant) for the chunks of one document and/or
+        all of a tenant's documents, one entry per FAISS row."""
+        clauses, params = [], []
+        if doc_id is not None:
+            clauses.append("c.doc_id = ?")
+            params.append(doc_id)
+        if tenant is not None:
+            clauses.append("d.tenant = ?")
+            params.append(tenant)
+        where = " AND ".join(clauses) or "1"
+        chunks = {}
+        with self._lock:
+            for row in self._conn.execute(
+                f"SELECT c.row_id, c.doc_id, c.chunk_id, d.filename, d.tenant FROM doc_chunks c "
+                f"JOIN documents d ON d.doc_id = c.doc_id WHERE {where} ORDER BY c.doc_id, c.chunk_id",
+                params,
+            ):
+                chunks.setdefault(row[0], row)
+        return list(chunks.values())
+
+    def other_owners(self, row_ids, doc_id):
+        """Map each row also used by a document other than doc_id to one (doc_id, chunk_id, filename)."""
+        ids = list({int(row_id) for row_id in row_ids})
+        owners = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for row_id, owner, chunk_id, filename in self._conn.execute(
+                    f"SELECT c.row_id, c.doc_id, c.chunk_id, d.filename FROM doc_chunks c "
+                    f"LEFT JOIN documents d ON d.doc_id = c.doc_id "
+                    f"WHERE c.row_id IN ({placeholders}) AND c.doc_id != ? ORDER BY c.doc_id, c.chunk_id",
+                    batch + [doc_id],
+                ):
+                    owners.setdefault(row_id, (owner, chunk_id, filename))
+        return owners
+
+    def delete_document(self, doc_id, deleted_rows):
+        """Forget a document and the chunk hashes of the rows removed with it, in one transaction."""
+        rows = [int(row_id) for row_id in deleted_rows]
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM documents WHERE doc_id = ?", (doc_id,))
+            self._conn.execute("DELETE FROM doc_chunks WHERE doc_id = ?", (doc_id,))
+            for start in range(0, len(rows), 500):
+                batch = rows[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunk_vectors WHERE row_id IN ({placeholders})", batch)
+            self._bump_version()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
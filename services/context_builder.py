@@ -0,0 +1,161 @@
+"""
+Token-budgeted packing of retrieved chunks into the LLM prompt.
+
+Retrieval hands over up to ~30 chunks, and neighbouring chunks of a document repeat up to
+``chunk_overlap`` characters of each other. The builder walks the chunks best first and
+keeps each one whose new text (its overlap with neighbours already kept removed) still fits
+the token budget, then merges runs of adjacent chunks of one document into a single section
+so shared text appears once. Sections are ordered by their best chunk's rank.
+
+Tokens are counted with tiktoken when it is installed and estimated from the character
+count (about 4 characters per token for English text) otherwise.
+"""
+import math
+import os
+from utils.logging_utils import get_logger
+
+logger = get_logger("context_builder")
+
+# Tokens of document content sent with each question.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# tiktoken encoding used for counting; the estimate is used without tiktoken.
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+
+CHARS_PER_TOKEN = 4
+# Shorter suffix/prefix matches between neighbours are treated as coincidence, not overlap.
+MIN_OVERLAP_CHARS = 8
+# Tokens taken by a section header and separator in the prompt.
+SECTION_OVERHEAD_TOKENS = 8
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.info(f"tiktoken unavailable ({e!r}); estimating tokens from characters")
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in text (estimated when tiktoken is not installed)."""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def overlap_length(left, right, min_chars=MIN_OVERLAP_CHARS):
+    """Length of the longest suffix of left that is also a prefix of right (0 below min_chars)."""
+    if len(right) < min_chars:
+        return 0
+    probe = right[:min_chars]
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+def _position(chunk, rank):
+    """(document key, chunk number) of a chunk; chunks without both stand alone."""
+    meta = chunk["metadata"]
+    doc_id, chunk_id = meta.get("doc_id"), meta.get("chunk_id")
+    if doc_id is None or not isinstance(chunk_id, int):
+        return ("", rank), None
+    return doc_id, chunk_id
+
+
+class ContextBuilder:
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET):
+        self.token_budget = token_budget
+
+    def pack(self, chunks):
+        """Pick and merge chunks (best first) to fit the token budget.
+
+        Returns (sections, packed): sections are dicts with doc_id, chunk_ids, text,
+        overlap_chars (removed) and relevance_score (of the best chunk), in prompt order;
+        packed are the input chunks that made it into the prompt, best first. The best chunk
+        is always kept.
+        """
+        kept = {}  # (doc key, chunk number) -> (rank, chunk)
+        used = 0
+        for rank, chunk in enumerate(chunks):
+            doc, number = _position(chunk, rank)
+            if (doc, number) in kept:
+                continue
+            text = chunk["text"]
+            if number is not None:
+                before = kept.get((doc, number - 1))
+                after = kept.get((doc, number + 1))
+                start = overlap_length(before[1]["text"], text) if before else 0
+                end = len(text) - (overlap_length(text, after[1]["text"]) if after else 0)
+                text = text[start:max(start, end)]
+            cost = count_tokens(text) + SECTION_OVERHEAD_TOKENS
+            if kept and used + cost > self.token_budget:
+                continue
+            kept[(doc, number)] = (rank, chunk)
+            used += cost
+
+        sections = []
+        by_doc = {}
+        for (doc, number), entry in kept.items():
+            by_doc.setdefault(doc, []).append((number, entry))
+        for doc, entries in by_doc.items():
+            entries.sort(key=lambda item: item[0])  # Stand-alone chunks are the only entry of their key.
+            run = []
+            for number, entry in entries:
+                if run and number != run[-1][0] + 1:
+                    sections.append(self._merge(run))
+                    run = []
+                run.append((number, entry))
+            sections.append(self._merge(run))
+        sections.sort(key=lambda section: section["rank"])
+        packed = [chunk for _, chunk in sorted(kept.values(), key=lambda entry: entry[0])]
+        return [{key: value for key, value in section.items() if key != "rank"} for section in sections], packed
+
+    @staticmethod
+    def _merge(run):
+        """One section from a run of adjacent chunks, with the text they share kept once."""
+        text = run[0][1][1]["text"]
+        previous = text
+        removed = 0
+        for _, (_, chunk) in run[1:]:
+            overlap = overlap_length(previous, chunk["text"])
+            text += chunk["text"][overlap:] if overlap else "\n" + chunk["text"]
+            previous = chunk["text"]
+            removed += overlap
+        best_rank, best = min((entry for _, entry in run), key=lambda entry: entry[0])
+        meta = best["metadata"]
+        return {
+            "rank": best_rank,
+            "doc_id": meta.get("doc_id"),
+            "chunk_ids": [chunk["metadata"].get("chunk_id", "?") for _, (_, chunk) in run],
+            "text": text,
+            "overlap_chars": removed,
+            "relevance_score": best.get("relevance_score"),
+        }
+
+    def build(self, chunks):
+        """Document content for the prompt. Returns (content, packed chunks)."""
+        sections, packed = self.pack(chunks)
+        content = "\n\n---\n\n".join(f"{self.section_label(section)}:\n{section['text']}" for section in sections)
+        logger.info(
+            f"Packed {len(packed)} of {len(chunks)} chunks into {len(sections)} sections: "
+            f"{count_tokens(content)} context tokens (budget {self.token_budget}), "
+            f"{sum(section['overlap_chars'] for section in sections)} overlapping characters removed"
+        )
+        return content, packed
+
+    @staticmethod
+    def section_label(section):
+        ids = section["chunk_ids"]
+        return f"Section {ids[0]}" if len(ids) == 1 else f"Sections {ids[0]}-{ids[-1]}"
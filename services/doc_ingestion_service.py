@@ -1,47 +1,245 @@
 """
 Service for ingesting, parsing, chunking, embedding, and indexing insurance documents.
 """
+import glob
+import hashlib
 import os
 import shutil
+import threading
 import uuid
+from contextlib import contextmanager
 from utils import parser_utils, text_splitter
+from services.content_store import ContentStore, chunk_key, file_sha256
 from services.embedding_service import EmbeddingService
+from services.lexical_index import keyword_groups
+from utils.locks import RWLock, file_lock
+from utils.metrics import STAGE_SECONDS, timed_iter
 from utils.logging_utils import get_logger
 
 logger = get_logger("doc_ingestion_service")
 
+# Chunks embedded per batch while pages stream in; progress is reported after each batch.
+EMBED_BATCH_CHUNKS = int(os.getenv("EMBED_BATCH_CHUNKS", "256"))
+# Lock files that serialize ingests of the same file across worker processes (by file hash).
+INGEST_LOCK_STRIPES = 64
+
 class DocIngestionService:
-    def __init__(self, upload_dir="data/uploaded_docs"):
+    def __init__(self, upload_dir="data/uploaded_docs", embedding_service=None, content_store=None):
         self.upload_dir = upload_dir
         os.makedirs(self.upload_dir, exist_ok=True)
-        self.embedding_service = EmbeddingService()
+        self.embedding_service = embedding_service or EmbeddingService()
+        self.content_store = content_store or ContentStore(
+            os.path.join(os.path.dirname(self.embedding_service.index_path), "content.db")
+        )
+        # Serializes ingests of the same file so concurrent re-uploads are deduplicated too.
+        self._hash_locks = {}
+        self._hash_locks_guard = threading.Lock()
+        # Ingests share chunk vectors with existing documents, so deletes wait for them (and vice versa).
+        self._documents_lock = RWLock()
+        # The same two locks across worker processes, as files next to the index. The index's
+        # own index.lock is taken inside add_embeddings/delete_rows and cannot be nested.
+        self._lock_dir = os.path.join(os.path.dirname(self.embedding_service.index_path), "locks")
+        os.makedirs(self._lock_dir, exist_ok=True)
+
+    def _lock_for(self, file_hash):
+        with self._hash_locks_guard:
+            return self._hash_locks.setdefault(file_hash, threading.Lock())
+
+    def _file_lock_for(self, file_hash):
+        stripe = int(hashlib.sha256(file_hash.encode("utf-8")).hexdigest()[:8], 16) % INGEST_LOCK_STRIPES
+        return file_lock(os.path.join(self._lock_dir, f"ingest-{stripe}.lock"))
+
+    def _documents_file_lock(self, shared):
+        return file_lock(os.path.join(self._lock_dir, "documents.lock"), shared=shared)
 
-    def ingest_document(self, file_path: str):
-        """Parse, chunk, embed, and index a document. Returns document UUID."""
+    @contextmanager
+    def ingest_lock(self, file_hash):
+        """Held while a file is checked for and recorded: no other ingest of the same file, no deletes,
+        in this process or another worker."""
+        with self._lock_for(file_hash), self._file_lock_for(file_hash):
+            with self._documents_lock.read_lock(), self._documents_file_lock(shared=True):
+                yield
+
+    def ingest_document(self, file_path: str, filename=None, progress=None, tenant=None, move_source=False, doc_id=None):
+        """Parse, chunk, embed, and index a document. Returns document UUID.
+
+        Files that were already ingested (for the same tenant) return their existing doc_id
+        without being parsed again. filename overrides the name recorded for the document
+        (defaults to the file's basename). tenant scopes the document for retrieval.
+        progress(stage, **counts) is called while the document is hashed and then processed
+        (pages parsed, chunks embedded). move_source moves the file into upload_dir instead
+        of copying it (for uploads that are discarded afterwards anyway). doc_id is the id a new
+        document is recorded under (default: a fresh one); ingestion jobs pass their own so an
+        interrupted run can be cleaned up with discard_unrecorded.
+        """
+        progress = progress or (lambda stage, **counts: None)
+        filename = filename or os.path.basename(file_path)
         ext = os.path.splitext(file_path)[1].lower()
-        if ext == ".pdf":
-            text = parser_utils.parse_pdf(file_path)
-        elif ext == ".docx":
-            text = parser_utils.parse_docx(file_path)
-        elif ext == ".eml":
-            text = parser_utils.parse_eml(file_path)
-        else:
+        if ext not in (".pdf", ".docx", ".eml"):
             logger.error(f"Unsupported file type: {ext}")
             return None
-        if not text:
-            logger.error("No text extracted from document.")
+        progress("hashing")
+        file_hash = file_sha256(file_path)
+        if tenant is not None:
+            # Tenants do not share documents, so each gets its own copy of a common file.
+            file_hash = f"{tenant}/{file_hash}"
+        with self.ingest_lock(file_hash):
+            existing_doc_id = self.content_store.find_document(file_hash)
+            if existing_doc_id:
+                logger.info(f"Document {file_path} already ingested as {existing_doc_id}")
+                return existing_doc_id
+            return self._ingest_new_document(file_path, filename, ext, file_hash, progress, tenant, move_source, doc_id)
+
+    def ingest_many(self, files, progress=None, tenant=None, move_sources=False, parse_workers=None, doc_ids=None):
+        """Ingest many (file_path, filename) pairs through the pipelined bulk ingester.
+
+        Returns its report: one result per file plus docs/sec and chunks/sec. doc_ids, one per
+        file, are the ids new documents are recorded under (see ingest_document).
+        """
+        from services.bulk_ingestion import BulkIngestionPipeline
+
+        pipeline = BulkIngestionPipeline(self, parse_workers=parse_workers)
+        return pipeline.run(files, progress=progress, tenant=tenant, move_sources=move_sources, doc_ids=doc_ids)
+
+    def store_original(self, file_path, doc_id, filename, move=False):
+        """Keep the original file in upload_dir, moved (no copy) when the caller discards it anyway."""
+        dest_path = os.path.join(self.upload_dir, f"{doc_id}_{filename}")
+        if move:
+            shutil.move(file_path, dest_path)
+        else:
+            shutil.copy2(file_path, dest_path)
+        return dest_path
+
+    def discard_rows(self, row_ids):
+        """Remove vectors written for a document whose ingest failed before it was recorded."""
+        row_ids = list(row_ids)
+        if not row_ids:
+            return
+        try:
+            self.embedding_service.delete_rows(row_ids)
+            logger.warning(f"Rolled back {len(row_ids)} chunks of a failed ingest")
+        except Exception as e:
+            logger.error(f"Could not roll back {len(row_ids)} chunks of a failed ingest: {e!r}")
+
+    def discard_unrecorded(self, doc_id):
+        """Remove chunks an interrupted ingest wrote under doc_id if the document was never recorded.
+
+        Returns the number of chunks removed.
+        """
+        with self._documents_lock.write_lock(), self._documents_file_lock(shared=False):
+            if self.content_store.get_document(doc_id) is not None:
+                return 0
+            row_ids = self.embedding_service.chunk_store.doc_row_ids(doc_id)
+            self.discard_rows(row_ids)
+        return len(row_ids)
+
+    def has_document(self, doc_id):
+        return self.content_store.get_document(doc_id) is not None or bool(self.embedding_service.chunk_store.doc_row_ids(doc_id))
+
+    def delete_document(self, doc_id):
+        """Remove a document and every vector only it uses. Returns the number of chunks deleted, or None if unknown.
+
+        Vectors shared with other documents (identical chunk text) stay, attributed to one of
+        those documents instead. The file can be uploaded again afterwards and is re-ingested.
+        """
+        with self._documents_lock.write_lock(), self._documents_file_lock(shared=False):
+            chunk_store = self.embedding_service.chunk_store
+            if not self.has_document(doc_id):
+                return None
+            rows = set(self.content_store.document_rows(doc_id)) | set(chunk_store.doc_row_ids(doc_id))
+            owners = self.content_store.other_owners(rows, doc_id)
+            for row_id, (owner, chunk_id, filename) in owners.items():
+                chunk_store.relabel(row_id, owner, chunk_id, filename)
+            deleted_rows = rows - set(owners)
+            # Vectors first: if this fails part-way, the document is still recorded and the delete can be retried.
+            deleted = self.embedding_service.delete_rows(deleted_rows)
+            self.content_store.delete_document(doc_id, deleted_rows)
+        for path in glob.glob(os.path.join(glob.escape(self.upload_dir), f"{doc_id}_*")):
+            os.remove(path)
+        logger.info(f"Deleted document {doc_id} ({deleted} chunks removed, {len(owners)} shared chunks kept)")
+        return deleted
+
+    def get_clause(self, doc_id, chunk_id):
+        """Return the metadata (with text) of a document's chunk, or None.
+
+        Chunks whose text was already indexed share another document's row, so the row's
+        metadata is relabelled with the requested document's ids.
+        """
+        found = self.embedding_service.chunk_store.find(doc_id, chunk_id)
+        if found:
+            return found[1]
+        row_id = self.content_store.chunk_row(doc_id, chunk_id)
+        if row_id is None:
+            return None
+        metadata = self.embedding_service.chunk_store.get_rows([row_id]).get(row_id)
+        if metadata is None:
             return None
-        chunks = text_splitter.semantic_chunk(text)
-        doc_id = str(uuid.uuid4())
-        for i, chunk in enumerate(chunks):
-            chunk["metadata"].update({
-                "doc_id": doc_id,
-                "filename": os.path.basename(file_path),
-                "chunk_id": i
-            })
-        self.embedding_service.embed_chunks(chunks)
-        # Save original file to uploaded_docs
-        dest_path = os.path.join(self.upload_dir, f"{doc_id}_{os.path.basename(file_path)}")
-        shutil.copy2(file_path, dest_path)
+        return {**metadata, "doc_id": doc_id, "chunk_id": chunk_id}
+
+    def _iter_pages(self, file_path, ext, progress):
+        """Yield (page_no, text) pairs; DOCX and EML have no pages and come back as one block."""
+        if ext == ".pdf":
+            return parser_utils.iter_pdf_pages(
+                file_path, on_page=lambda done, total: progress("processing", pages_parsed=done, pages_total=total)
+            )
+        text = parser_utils.parse_docx(file_path) if ext == ".docx" else parser_utils.parse_eml(file_path)
+        return [(None, text)] if text else []
+
+    def _ingest_new_document(self, file_path, filename, ext, file_hash, progress, tenant=None, move_source=False, doc_id=None):
+        # Pages are parsed, chunked and embedded as a stream, so a large PDF never has to sit
+        # in memory as one string before embedding starts.
+        progress("processing")
+        doc_id = doc_id or str(uuid.uuid4())
+        chunk_rows = []
+        new_rows = {}
+        batch = []
+
+        def flush():
+            # Only embed chunk texts the index has never seen; repeats share the existing vector.
+            chunk_hashes = [chunk_key(chunk["text"], tenant) for chunk in batch]
+            known_rows = self.content_store.find_chunk_rows(chunk_hashes)
+            known_rows.update((h, new_rows[h]) for h in chunk_hashes if h in new_rows)
+            new_chunks = {}
+            for chunk_hash, chunk in zip(chunk_hashes, batch):
+                if chunk_hash not in known_rows and chunk_hash not in new_chunks:
+                    new_chunks[chunk_hash] = chunk
+            if new_chunks:
+                new_rows.update(zip(new_chunks, self.embedding_service.embed_chunks(list(new_chunks.values()))))
+            for chunk_hash, chunk in zip(chunk_hashes, batch):
+                chunk_rows.append((chunk["metadata"]["chunk_id"], known_rows.get(chunk_hash, new_rows.get(chunk_hash))))
+            batch.clear()
+            progress(
+                "processing",
+                chunks_total=len(chunk_rows),
+                chunks_embedded=len(new_rows),
+                chunks_reused=len(chunk_rows) - len(new_rows),
+            )
+
+        # Parsing runs inside the chunk generator, so both are timed as they are pulled through.
+        seconds = {}
+        try:
+            pages = timed_iter(self._iter_pages(file_path, ext, progress), seconds, "parse")
+            for chunk in timed_iter(text_splitter.semantic_chunk_pages(pages), seconds, "chunk"):
+                chunk["metadata"].update({"doc_id": doc_id, "filename": filename, "keywords": keyword_groups(chunk["text"])})
+                if tenant is not None:
+                    chunk["metadata"]["tenant"] = tenant
+                batch.append(chunk)
+                if len(batch) >= EMBED_BATCH_CHUNKS:
+                    flush()
+            if batch:
+                flush()
+            STAGE_SECONDS.observe(seconds.get("parse", 0.0), stage="parse")
+            STAGE_SECONDS.observe(seconds.get("chunk", 0.0) - seconds.get("parse", 0.0), stage="chunk")
+            if not chunk_rows:
+                logger.error("No text extracted from document.")
+                return None
+            self.content_store.record_document(file_hash, doc_id, filename, chunk_rows, new_rows, tenant=tenant)
+        except Exception:
+            # Batches already written belong to no recorded document: nothing could find or delete them.
+            self.discard_rows(new_rows.values())
+            raise
+        logger.info(f"Embedded {len(new_rows)} new chunks, reused {len(chunk_rows) - len(new_rows)} existing vectors")
+
+        self.store_original(file_path, doc_id, filename, move=move_source)
         logger.info(f"Document {file_path} ingested as {doc_id}")
-        return doc_id
\ No newline at end of file
+        return doc_id
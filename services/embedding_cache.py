@@ -0,0 +1,145 @@
+"""
+Two-tier cache of text embeddings keyed by model name + text hash.
+
+An in-memory LRU sits in front of a SQLite table of float32 vectors. The disk tier is
+trimmed to ``max_entries`` by last use and wiped when the embedding model changes. The
+"model name" may be any namespace string; EmbeddingService passes the engine's
+``cache_namespace`` so switching backend or quantization also starts a fresh cache.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from utils.logging_utils import get_logger
+
+logger = get_logger("embedding_cache")
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, db_path="data/faiss_index/embedding_cache.db", max_entries=200_000, memory_entries=10_000):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cache_info (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+        """)
+        self._invalidate_if_model_changed()
+        # Upper bound on disk rows (replaced keys are counted twice); recounted before evicting.
+        self._disk_entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _invalidate_if_model_changed(self):
+        with self._conn:
+            row = self._conn.execute("SELECT value FROM cache_info WHERE key = 'model_name'").fetchone()
+            if row and row[0] != self.model_name:
+                logger.info(f"Embedding model changed from {row[0]} to {self.model_name}, clearing cache")
+                self._conn.execute("DELETE FROM embeddings")
+            self._conn.execute("INSERT OR REPLACE INTO cache_info (key, value) VALUES ('model_name', ?)", (self.model_name,))
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, texts):
+        """Return ({position: vector} for cached texts, [positions of misses])."""
+        found = {}
+        keys = [self._key(t) for t in texts]
+        with self._lock:
+            disk_lookup = {}
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[i] = vector
+                    self.memory_hits += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+            if disk_lookup:
+                lookup_keys = list(disk_lookup)
+                for start in range(0, len(lookup_keys), 500):
+                    batch = lookup_keys[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        for i in disk_lookup.pop(key):
+                            found[i] = vector
+                            self.disk_hits += 1
+                    if rows:
+                        now = time.time()
+                        with self._conn:
+                            self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows])
+            missing = sorted(i for positions in disk_lookup.values() for i in positions)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, texts, vectors):
+        """Store freshly computed vectors for texts."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self._key(text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._disk_entries += len(rows)
+            if self._disk_entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._disk_entries = count
+        if count <= self.max_entries:
+            return
+        # Trim to 90% so eviction does not run again on the very next insert.
+        excess = count - int(self.max_entries * 0.9)
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+        self._disk_entries -= excess
+        logger.info(f"Evicted {excess} cached embeddings")
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": entries,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
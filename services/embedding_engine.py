@@ -0,0 +1,188 @@
+"""
+Batched, optionally multi-process SentenceTransformer encoding.
+
+Texts are sorted by length before batching so each batch pads to similar lengths, encoded in
+``batch_size`` batches and returned in the caller's order. Large requests (bulk ingestion)
+can be spread over a pool of worker processes, each holding its own copy of the model.
+Per-batch timings are kept so node sizing can be based on measured texts/sec.
+
+Backends:
+    torch        SentenceTransformer as-is (default)
+    torch-int8   torch dynamic int8 quantization of the Linear layers
+    onnx         ONNX Runtime via sentence-transformers' onnx backend (needs optimum + onnxruntime)
+    onnx-int8    as onnx, loading the quantized model file (EMBED_ONNX_FILE)
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from utils.logging_utils import get_logger
+
+logger = get_logger("embedding_engine")
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# Worker processes for large encode requests; 1 encodes in-process.
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+# Requests smaller than this are encoded in-process even when a pool is configured.
+EMBED_POOL_MIN_TEXTS = int(os.getenv("EMBED_POOL_MIN_TEXTS", "256"))
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", "onnx/model_qint8_avx2.onnx")
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def load_model(model_name, backend="torch"):
+    """Load a SentenceTransformer for the given backend, falling back to torch if it is unavailable."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    # Imported here: sentence_transformers pulls in torch, which dominates process start-up.
+    from sentence_transformers import SentenceTransformer
+
+    if backend in ("onnx", "onnx-int8"):
+        kwargs = {"model_kwargs": {"file_name": EMBED_ONNX_FILE}} if backend == "onnx-int8" else {}
+        try:
+            return SentenceTransformer(model_name, backend="onnx", **kwargs)
+        except Exception as e:
+            logger.warning(f"ONNX backend unavailable ({e}); using torch")
+            return SentenceTransformer(model_name)
+    model = SentenceTransformer(model_name)
+    if backend == "torch-int8":
+        import torch
+
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+# Set in each pool worker by _init_worker.
+_worker_model = None
+
+
+def _init_worker(model_name, backend):
+    global _worker_model
+    import torch
+
+    # Each worker gets one core's worth of threads; the pool provides the parallelism.
+    torch.set_num_threads(1)
+    _worker_model = load_model(model_name, backend)
+
+
+def _encode_in_worker(texts, batch_size):
+    start = time.perf_counter()
+    vectors = _worker_model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    return np.asarray(vectors, dtype=np.float32), time.perf_counter() - start
+
+
+class EmbeddingEngine:
+    def __init__(self, model_name, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS, backend=EMBED_BACKEND, pool_min_texts=EMBED_POOL_MIN_TEXTS):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.workers = workers
+        self.backend = backend
+        self.pool_min_texts = pool_min_texts
+        self.model = load_model(model_name, backend)
+        if backend.startswith("onnx") and getattr(self.model, "backend", "torch") != "onnx":
+            # load_model fell back to torch; record what actually encodes.
+            self.backend = "torch"
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._totals = {"texts": 0, "batches": 0, "seconds": 0.0}
+        self._recent = deque(maxlen=100)
+
+    @property
+    def cache_namespace(self):
+        """Identifies the vectors this engine produces: model, backend and quantized file."""
+        if self.backend == "onnx-int8":
+            return f"{self.model_name}|{self.backend}|{EMBED_ONNX_FILE}"
+        return f"{self.model_name}|{self.backend}"
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=context,
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.backend),
+                )
+                logger.info(f"Started {self.workers} embedding worker processes ({self.backend})")
+            return self._pool
+
+    def _record(self, size, chars, seconds):
+        batch = {
+            "texts": size,
+            "chars": chars,
+            "seconds": round(seconds, 4),
+            "texts_per_sec": round(size / seconds, 1) if seconds > 0 else None,
+        }
+        with self._stats_lock:
+            self._totals["texts"] += size
+            self._totals["batches"] += 1
+            self._totals["seconds"] += seconds
+            self._recent.append(batch)
+        logger.debug(f"Encoded batch of {size} texts in {seconds * 1000:.1f} ms")
+
+    def encode(self, texts):
+        """Encode texts into a float32 array, one row per text in the given order."""
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Longest first: batches hold similar lengths, so little compute goes to padding.
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        use_pool = self.workers > 1 and len(texts) >= self.pool_min_texts
+
+        started = time.perf_counter()
+        out = None
+        if use_pool:
+            pool = self._get_pool()
+            futures = [pool.submit(_encode_in_worker, [texts[i] for i in batch], self.batch_size) for batch in batches]
+            results = ((batch, *future.result()) for batch, future in zip(batches, futures))
+        else:
+            results = (
+                (batch, *self._encode_batch([texts[i] for i in batch]))
+                for batch in batches
+            )
+        for batch, vectors, seconds in results:
+            if out is None:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[batch] = vectors
+            self._record(len(batch), sum(len(texts[i]) for i in batch), seconds)
+
+        elapsed = time.perf_counter() - started
+        if len(texts) >= self.batch_size:
+            logger.info(f"Encoded {len(texts)} texts in {len(batches)} batches: {len(texts) / elapsed:.1f} texts/sec")
+        return out
+
+    def _encode_batch(self, texts):
+        start = time.perf_counter()
+        vectors = self.model.encode(texts, batch_size=len(texts), show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(vectors, dtype=np.float32), time.perf_counter() - start
+
+    def stats(self):
+        """Cumulative and recent per-batch encode throughput.
+
+        With a worker pool, seconds is encode time summed over workers, so texts_per_sec is
+        the per-process rate.
+        """
+        with self._stats_lock:
+            totals = dict(self._totals)
+            recent = list(self._recent)
+        totals["seconds"] = round(totals["seconds"], 3)
+        totals["texts_per_sec"] = round(totals["texts"] / totals["seconds"], 1) if totals["seconds"] else None
+        return {
+            "backend": self.backend,
+            "batch_size": self.batch_size,
+            "workers": self.workers,
+            **totals,
+            "recent_batches": recent,
+        }
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -1,51 +1,376 @@
 """
 Service for generating embeddings and managing FAISS index.
 """
-from sentence_transformers import SentenceTransformer
+import copy
 import faiss
 import numpy as np
 import os
-import pickle
+import threading
+from services.chunk_store import ChunkStore
+from services.embedding_cache import EmbeddingCache
+from services.embedding_engine import EmbeddingEngine
+from services.index_factory import (
+    IndexConfig, apply_search_params, build_index, can_build, create_empty_index, index_kind, migrate_index,
+    needs_migration, reconstruct_all, remove_ids, supports_remove,
+)
+from services.index_store import SegmentedIndexStore
+from services.layered_index import LayeredIndex
+from utils.locks import RWLock
 from utils.logging_utils import get_logger
+from utils.metrics import span
 
 logger = get_logger("embedding_service")
 
+# Number of pending segments that triggers a background compaction into the base index.
+COMPACT_SEGMENTS = int(os.getenv("INDEX_COMPACT_SEGMENTS", "16"))
+# Vectors added since the last compaction (held in RAM by every worker) that trigger one.
+COMPACT_DELTA_VECTORS = int(os.getenv("INDEX_COMPACT_DELTA", "50000"))
+# Share of indexed vectors that may be tombstoned before a compaction rebuilds the index.
+COMPACT_TOMBSTONE_RATIO = float(os.getenv("INDEX_COMPACT_TOMBSTONES", "0.1"))
+# Disk-backed embedding cache size in entries; 0 disables the cache.
+EMBEDDING_CACHE_ENTRIES = int(os.getenv("EMBEDDING_CACHE_ENTRIES", "200000"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "10000"))
+# Scoped searches over at most this many vectors compare against just those vectors exactly;
+# larger scopes search the index through an id selector.
+SEARCH_EXACT_SUBSET_MAX = int(os.getenv("SEARCH_EXACT_SUBSET_MAX", "8192"))
+# Seconds between checks for index changes published by other worker processes; 0 disables polling.
+INDEX_REFRESH_SECONDS = float(os.getenv("INDEX_REFRESH_SECONDS", "1"))
+
+
 class EmbeddingService:
-    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", index_path="data/faiss_index/index.bin", meta_path="data/faiss_index/meta.pkl"):
-        self.model = SentenceTransformer(model_name)
+    """Embeds chunks and searches them.
+
+    The index is shared by every worker process using the same directory: the compacted base
+    is memory-mapped read-only, each worker keeps only the vectors added since (and the ids
+    deleted since) in RAM, and changes published by other workers are picked up within
+    refresh_seconds.
+    """
+
+    def __init__(self, model_name="sentence-transformers/all-MiniLM-L6-v2", index_path="data/faiss_index/index.bin", meta_path="data/faiss_index/meta.pkl", segment_dir=None, compact_segments=COMPACT_SEGMENTS, index_config=None, embedding_cache=None, engine=None, chunk_store=None, refresh_seconds=INDEX_REFRESH_SECONDS):
+        self.engine = engine or EmbeddingEngine(model_name)
+        self.model = self.engine.model
+        self.model_name = model_name
         self.index_path = index_path
         self.meta_path = meta_path
-        self.index = None
-        self.metadata = []  # List of dicts, one per chunk
+        self.index = None  # LayeredIndex, None until the first vector is stored
+        self.generation = 0  # Bumped whenever the indexed content changes
+        self.next_row_id = 0  # Row (vector) ids are never reused, even after deletes
+        # Position in the shared store: the published generation, the segment the base was
+        # compacted through and the last segment applied on top of it.
+        self.published_generation = None
+        self.base_seq = 0
+        self.applied_seq = 0
+        # Guards the index: queries take the read side, ingestion the write side.
+        self.lock = RWLock()
+        self.store = SegmentedIndexStore(index_path, segment_dir)
+        # Chunk text and metadata by FAISS row id; read on demand instead of held in RAM.
+        self.chunk_store = chunk_store or ChunkStore(os.path.join(os.path.dirname(index_path), "chunks.db"))
+        self.compact_segments = compact_segments
+        self.index_config = index_config or IndexConfig.from_env()
+        if embedding_cache is None and EMBEDDING_CACHE_ENTRIES > 0:
+            # Namespaced by backend too: quantized and ONNX vectors differ slightly from torch's.
+            embedding_cache = EmbeddingCache(
+                self.engine.cache_namespace,
+                os.path.join(os.path.dirname(index_path), "embedding_cache.db"),
+                max_entries=EMBEDDING_CACHE_ENTRIES,
+                memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES,
+            )
+        self.embedding_cache = embedding_cache
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self.refresh_seconds = refresh_seconds
+        self._stop_refresh = threading.Event()
+        self._refresh_thread = None
         self.load_index()
+        if refresh_seconds > 0:
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    @property
+    def tombstones(self):
+        """Deleted ids still inside the read-only base; filtered from searches until compaction."""
+        return self.index.tombstones if self.index is not None else set()
+
+    def encode(self, texts):
+        """Encode a list of texts into float32 embeddings, reusing cached vectors where possible."""
+        if self.embedding_cache is None or not texts:
+            return self._encode_uncached(texts)
+        cached, missing = self.embedding_cache.get_many(texts)
+        if missing:
+            missing_texts = list(dict.fromkeys(texts[i] for i in missing))
+            fresh = self._encode_uncached(missing_texts)
+            self.embedding_cache.put_many(missing_texts, fresh)
+            by_text = dict(zip(missing_texts, fresh))
+            cached.update((i, by_text[texts[i]]) for i in missing)
+        return np.stack([cached[i] for i in range(len(texts))]).astype(np.float32, copy=False)
+
+    def _encode_uncached(self, texts):
+        return self.engine.encode(texts)
 
     def embed_chunks(self, chunks):
-        """Generate embeddings for a list of text chunks. Each chunk is a dict with 'text' and 'metadata'."""
-        texts = [c["text"] for c in chunks]
-        embeddings = self.model.encode(texts, show_progress_bar=False)
-        if self.index is None:
-            self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        self.index.add(np.array(embeddings, dtype=np.float32))
-        self.metadata.extend([c["metadata"] for c in chunks])
-        self.save_index()
-        return embeddings
+        """Generate embeddings for a list of text chunks. Each chunk is a dict with 'text' and 'metadata'.
+
+        Returns the row ids (FAISS vector ids) assigned to the chunks, in order.
+        """
+        if not chunks:
+            return []
+        with span("embed"):
+            embeddings = self.encode([c["text"] for c in chunks])
+        return self.add_embeddings(chunks, embeddings)
+
+    def add_embeddings(self, chunks, embeddings):
+        """Index chunks whose vectors were already computed with encode(). Returns their row ids, in order."""
+        if not chunks:
+            return []
+        metadata = [c["metadata"] for c in chunks]
+        with span("index_write"), self.store.lock():
+            # Ids and segment numbers must follow whatever other workers have written.
+            self._sync()
+            with self.lock.write_lock():
+                if self.index is None:
+                    self.index = LayeredIndex(embeddings.shape[1])
+                start_row = max(self.next_row_id, self.chunk_store.next_row_id())
+                ids = np.arange(start_row, start_row + len(chunks), dtype=np.int64)
+                # Rows go in before the segment: a crash in between leaves rows without vectors,
+                # which load_index() drops.
+                self.chunk_store.put_rows(start_row, metadata)
+                self.applied_seq = self.store.append_segment(ids, embeddings)
+                self.index.add(ids, embeddings)
+                self.next_row_id = start_row + len(chunks)
+                self._publish()
+        self._maybe_compact()
+        return ids.tolist()
+
+    def delete_rows(self, row_ids):
+        """Remove vectors and their chunk rows by id. Returns the number of chunk rows deleted.
+
+        Vectors in the read-only base are tombstoned; searches skip them and the next
+        compaction writes a base without them.
+        """
+        ids = np.array(sorted({int(row_id) for row_id in row_ids}), dtype=np.int64)
+        if not len(ids):
+            return 0
+        with self.store.lock():
+            self._sync()
+            with self.lock.write_lock():
+                # The delete segment goes first: after a crash, load_index() replays it.
+                self.applied_seq = self.store.append_deletes(ids)
+                if self.index is not None:
+                    self.index.remove(ids)
+                deleted = self.chunk_store.delete_rows(ids)
+                self._publish()
+        logger.info(f"Deleted {deleted} chunk rows ({len(self.tombstones)} vectors tombstoned)")
+        self._maybe_compact()
+        return deleted
+
+    def _publish(self):
+        """Announce a change to the other workers. Needs the store lock and the write lock."""
+        self.published_generation = self.store.publish()["generation"]
+        self.generation += 1
+
+    def search(self, query_embeddings, k, ids=None):
+        """Search the index. Returns (distances, indices, metadata rows per query) or None if no index.
+
+        ids restricts the search to those vector ids (one document or tenant), so its cost
+        follows the size of the scope: small scopes are compared exactly against just their
+        vectors, larger ones search the index through an id selector.
+        """
+        queries = np.array(query_embeddings, dtype=np.float32)
+        with self.lock.read_lock():
+            if self.index is None:
+                return None
+            if ids is not None:
+                D, I = self.index.search_subset(queries, k, np.asarray(ids, dtype=np.int64), SEARCH_EXACT_SUBSET_MAX)
+            else:
+                D, I = self.index.search(queries, k)
+        # Look each distinct row up once, however many queries retrieved it.
+        rows_by_id = self.chunk_store.get_rows(idx for idx in np.unique(I) if idx >= 0)
+        rows = [[rows_by_id.get(int(idx)) for idx in ids] for ids in I]
+        return D, I, rows
+
+    def refresh(self):
+        """Catch up with changes published by other worker processes. Returns True if there were any."""
+        with self.store.lock(shared=True):
+            return self._sync()
+
+    def _sync(self):
+        """Apply every change published since this worker last looked. Needs the store lock."""
+        state = self.store.read_generation()
+        if state["generation"] == self.published_generation:
+            return False
+        if state["base_seq"] != self.base_seq:
+            # A new base was compacted: map it and rebuild the delta from the segments after it.
+            index, applied_seq = self._read_index(state["base_seq"])
+            with self.lock.write_lock():
+                self.index, self.base_seq, self.applied_seq = index, state["base_seq"], applied_seq
+                self._advance_row_ids()
+                self.published_generation = state["generation"]
+                self.generation += 1
+            logger.info(f"Switched to compacted index (segments <= {self.base_seq}, {index.ntotal if index else 0} vectors)")
+            return True
+        segments = list(self.store.read_segments(after_seq=self.applied_seq))
+        with self.lock.write_lock():
+            for seq, segment in segments:
+                self.index = self._replay(self.index, segment)
+                self.applied_seq = seq
+            self._advance_row_ids()
+            self.published_generation = state["generation"]
+            self.generation += 1
+        return True
+
+    def _advance_row_ids(self):
+        if self.index is not None and self.index.ntotal:
+            self.next_row_id = max(self.next_row_id, int(self.index.stored_ids().max()) + 1)
+
+    def _replay(self, index, segment, on_metadata=None):
+        """Apply one segment to index (created on the first vectors). Returns the index."""
+        if "deleted_ids" in segment:
+            if index is not None:
+                index.remove(segment["deleted_ids"])
+            return index
+        if on_metadata and segment.get("metadata"):
+            on_metadata(segment["start_row"], segment["metadata"])
+        vectors = segment["vectors"]
+        if index is None:
+            index = LayeredIndex(vectors.shape[1])
+        index.add(segment["ids"], vectors)
+        return index
+
+    def _read_index(self, base_seq, on_metadata=None):
+        """Map the base and replay the segments after base_seq. Returns (index, last applied seq)."""
+        base = self.store.read_base()
+        index = None
+        if base is not None:
+            apply_search_params(base, self.index_config)
+            index = LayeredIndex(base.d, base)
+        applied_seq = base_seq
+        for seq, segment in self.store.read_segments(after_seq=base_seq):
+            index = self._replay(index, segment, on_metadata)
+            applied_seq = seq
+        return index, applied_seq
+
+    def _refresh_loop(self):
+        while not self._stop_refresh.wait(self.refresh_seconds):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Index refresh failed: {e}")
 
     def save_index(self):
-        """Persist FAISS index and metadata to disk."""
-        if self.index is not None:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.meta_path, "wb") as f:
-                pickle.dump(self.metadata, f)
-            logger.info("FAISS index and metadata saved.")
+        """Fold the delta and tombstones into a new compacted base and publish it to every worker.
+
+        The base is rebuilt when it should be migrated to the configured backend, or holds
+        tombstoned vectors its backend cannot remove in place.
+        """
+        with self._compaction_lock:
+            self.refresh()
+            with self.lock.read_lock():
+                index = self.index
+                if index is None:
+                    return
+                base_seq, through_seq = self.base_seq, self.applied_seq
+                base_bytes = faiss.serialize_index(index.base) if index.base is not None else None
+                ids, vectors = reconstruct_all(index.delta)
+                tombstones = set(index.tombstones)
+                dim = index.d
+            # Build off the lock; queries keep using the current index.
+            merged = self._merged_base(dim, base_bytes, ids, vectors, tombstones)
+            with self.store.lock():
+                if self.store.read_generation()["base_seq"] != base_seq:
+                    logger.info("Index was compacted by another worker; dropping this compaction")
+                    return
+                self.store.write_base(faiss.serialize_index(merged))
+                self.store.publish(base_seq=through_seq)
+                self.store.drop_segments(through_seq)
+            self.refresh()
+            logger.info(f"FAISS index saved ({merged.ntotal} vectors, segments <= {through_seq} compacted).")
+
+    def _merged_base(self, dim, base_bytes, ids, vectors, tombstones):
+        config = self.index_config
+        if base_bytes is None:
+            if can_build(config, len(ids)):
+                return build_index(vectors.reshape(-1, dim), config, ids)
+            merged = create_empty_index(dim, config)
+            merged.add_with_ids(vectors, ids)
+            return merged
+        merged = faiss.deserialize_index(base_bytes)
+        if len(ids):
+            merged.add_with_ids(vectors, ids)
+        if needs_migration(merged, config):
+            return migrate_index(merged, config, exclude=tombstones)
+        if tombstones and supports_remove(merged):
+            remove_ids(merged, np.fromiter(tombstones, dtype=np.int64, count=len(tombstones)))
+        elif tombstones:
+            config = copy.copy(config)
+            config.kind = index_kind(merged)
+            return migrate_index(merged, config, exclude=tombstones)
+        return merged
+
+    def _maybe_compact(self):
+        """Start a background compaction once enough segments, delta vectors or tombstones have piled up."""
+        index = self.index
+        if index is None:
+            return
+        tombstoned = len(index.tombstones) > COMPACT_TOMBSTONE_RATIO * index.ntotal
+        pending = len(self.store.list_segments()) >= self.compact_segments or index.delta.ntotal >= COMPACT_DELTA_VECTORS
+        current = index.base if index.base is not None else index.delta
+        migrate = index_kind(current) != self.index_config.kind and can_build(self.index_config, index.ntotal)
+        if not (pending or tombstoned or migrate):
+            return
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self._compact_in_background, name="index-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def _compact_in_background(self):
+        try:
+            self.save_index()
+        except Exception as e:
+            logger.error(f"Index compaction failed: {e}")
+
+    def close(self):
+        """Stop polling for changes, wait for any running compaction and release the stores and workers."""
+        self._stop_refresh.set()
+        if self._refresh_thread is not None:
+            self._refresh_thread.join()
+        if self._compaction_thread is not None:
+            self._compaction_thread.join()
+        self.engine.close()
+        self.chunk_store.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
 
     def load_index(self):
-        """Load FAISS index and metadata from disk."""
-        if os.path.exists(self.index_path):
-            self.index = faiss.read_index(self.index_path)
-            if os.path.exists(self.meta_path):
-                with open(self.meta_path, "rb") as f:
-                    self.metadata = pickle.load(f)
-            logger.info("FAISS index and metadata loaded.")
-        else:
-            self.index = None
-            self.metadata = []
\ No newline at end of file
+        """Map the base FAISS index from disk and replay any pending segments.
+
+        Metadata from a legacy meta.pkl or old segments is migrated into the chunk store, and
+        chunk rows whose vectors never made it to disk are dropped. A meta.pkl without an index
+        to go with it is left alone, since every one of its rows would be dropped.
+        """
+        # Exclusive: no other worker may be between writing chunk rows and their segment.
+        with self.store.lock():
+            # Converted here, under the exclusive lock, so workers can map the base as it is.
+            self.store.upgrade_base()
+            state = self.store.read_generation()
+            index, applied_seq = self._read_index(
+                state["base_seq"],
+                on_metadata=lambda start_row, metadata: self.chunk_store.put_rows(start_row, metadata, replace=False),
+            )
+            if index is not None:
+                self.chunk_store.migrate_pickle(self.meta_path)
+            elif os.path.exists(self.meta_path):
+                logger.warning(f"Found {self.meta_path} but no index for it; not migrating it until {self.index_path} exists")
+            ids = index.stored_ids() if index is not None else np.zeros(0, dtype=np.int64)
+            live = set(ids.tolist()) - (index.tombstones if index is not None else set())
+            orphans = [row_id for row_id in self.chunk_store.row_ids() if row_id not in live]
+            if orphans:
+                self.chunk_store.delete_rows(orphans)
+                logger.warning(f"Dropped {len(orphans)} chunk rows without vectors")
+            with self.lock.write_lock():
+                self.index, self.base_seq, self.applied_seq = index, state["base_seq"], applied_seq
+                self.published_generation = state["generation"]
+                self.next_row_id = max(self.chunk_store.next_row_id(), int(ids.max()) + 1 if len(ids) else 0)
+                self.generation += 1
+        if index is not None:
+            base_kind = index_kind(index.base) if index.base is not None else "none"
+            logger.info(f"FAISS index loaded ({index.ntotal} vectors: {base_kind} base + {index.delta.ntotal} in delta, {len(index.tombstones)} tombstoned).")
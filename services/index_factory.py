@@ -0,0 +1,294 @@
+"""
+Construction, training and migration of FAISS index backends.
+
+Supported ``INDEX_TYPE`` values:
+    flat      exact brute-force L2 search (default)
+    hnsw      graph index, tuned with INDEX_HNSW_M / INDEX_EF_SEARCH
+    ivf_flat  inverted lists over full vectors, tuned with INDEX_NLIST / INDEX_NPROBE
+    ivf_pq    inverted lists over product-quantized vectors, adds INDEX_PQ_M
+
+IVF backends need training data, so the service keeps a flat index until the corpus holds
+enough vectors and converts it during the next compaction.
+
+Vectors are stored under stable ids (the chunk store's row ids) rather than by position:
+flat and HNSW indexes are wrapped in an IndexIDMap2, IVF indexes take ids natively and keep
+a hashtable direct map so vectors can be reconstructed and removed by id. Indexes written
+before ids existed are converted on load with id == position, so existing row ids stay valid.
+
+Migrate an existing index on disk with:
+    python -m services.index_factory --type hnsw
+Running workers pick the migrated base up; run them with the same INDEX_TYPE, or their next
+compaction converts it back.
+"""
+import argparse
+import os
+import faiss
+import numpy as np
+from utils.logging_utils import get_logger
+
+logger = get_logger("index_factory")
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+
+
+class IndexConfig:
+    """Index backend choice plus its build and search parameters."""
+
+    def __init__(self, kind="flat", nlist=1024, nprobe=16, pq_m=48, pq_nbits=8, hnsw_m=32, ef_construction=200, ef_search=64):
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type '{kind}', expected one of {INDEX_TYPES}")
+        self.kind = kind
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            kind=os.getenv("INDEX_TYPE", "flat"),
+            nlist=int(os.getenv("INDEX_NLIST", "1024")),
+            nprobe=int(os.getenv("INDEX_NPROBE", "16")),
+            pq_m=int(os.getenv("INDEX_PQ_M", "48")),
+            pq_nbits=int(os.getenv("INDEX_PQ_NBITS", "8")),
+            hnsw_m=int(os.getenv("INDEX_HNSW_M", "32")),
+            ef_construction=int(os.getenv("INDEX_EF_CONSTRUCTION", "200")),
+            ef_search=int(os.getenv("INDEX_EF_SEARCH", "64")),
+        )
+
+    @property
+    def needs_training(self):
+        return self.kind in ("ivf_flat", "ivf_pq")
+
+    @property
+    def min_training_vectors(self):
+        """FAISS wants roughly 39 points per centroid to train k-means without warnings."""
+        if not self.needs_training:
+            return 0
+        centroids = self.nlist
+        if self.kind == "ivf_pq":
+            centroids = max(centroids, 2 ** self.pq_nbits)
+        return 39 * centroids
+
+    def __repr__(self):
+        return f"IndexConfig(kind={self.kind!r}, nlist={self.nlist}, nprobe={self.nprobe}, pq_m={self.pq_m}, hnsw_m={self.hnsw_m}, ef_search={self.ef_search})"
+
+
+def index_kind(index):
+    """Return the INDEX_TYPES name of an index, or its FAISS class name if unknown."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexFlat):
+        return "flat"
+    if isinstance(index, faiss.IndexHNSWFlat):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "ivf_flat"
+    return type(index).__name__
+
+
+def create_empty_index(dim, config):
+    """Create an index that can take vectors (with ids) right away.
+
+    IVF backends cannot be used before training, so they start out flat.
+    """
+    if config.kind == "hnsw":
+        inner = faiss.IndexHNSWFlat(dim, config.hnsw_m)
+        inner.hnsw.efConstruction = config.ef_construction
+        index = faiss.IndexIDMap2(inner)
+        apply_search_params(index, config)
+        return index
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+
+def can_build(config, num_vectors):
+    """Whether the configured backend can be built from num_vectors vectors."""
+    return num_vectors >= config.min_training_vectors
+
+
+def build_index(vectors, config, ids=None):
+    """Build (and train, if needed) an index of the configured type holding vectors.
+
+    ids defaults to the vectors' positions.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+    dim = vectors.shape[1]
+    if config.kind == "ivf_flat":
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, config.nlist)
+        index.train(vectors)
+    elif config.kind == "ivf_pq":
+        if dim % config.pq_m:
+            raise ValueError(f"INDEX_PQ_M={config.pq_m} must divide the embedding dimension {dim}")
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFPQ(quantizer, dim, config.nlist, config.pq_m, config.pq_nbits)
+        index.train(vectors)
+    else:
+        index = create_empty_index(dim, config)
+    if config.needs_training:
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    index.add_with_ids(vectors, ids)
+    apply_search_params(index, config)
+    return index
+
+
+def apply_search_params(index, config):
+    """Set nprobe / efSearch on an index if it supports them."""
+    kind = index_kind(index)
+    params = faiss.ParameterSpace()
+    if kind in ("ivf_flat", "ivf_pq"):
+        params.set_index_parameter(index, "nprobe", config.nprobe)
+    elif kind == "hnsw":
+        params.set_index_parameter(index, "efSearch", config.ef_search)
+
+
+def has_stable_ids(index):
+    """True if vectors can be looked up and removed by id without converting the index first."""
+    if isinstance(index, faiss.IndexIDMap):
+        return True
+    ivf = faiss.try_extract_index_ivf(index)
+    return ivf is not None and ivf.direct_map.type == faiss.DirectMap.Hashtable
+
+
+def with_stable_ids(index):
+    """Return an index that stores vectors by id, converting a positional (pre-id) index.
+
+    Legacy flat and HNSW indexes are rebuilt inside an IndexIDMap2 with id == position;
+    IVF indexes already carry those ids and only need a hashtable direct map. The index must
+    be in memory: a memory-mapped one is read-only.
+    """
+    if has_stable_ids(index):
+        return index
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        if ivf.direct_map.type != faiss.DirectMap.Hashtable:
+            ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+        return index
+    inner = faiss.downcast_index(index)
+    vectors = inner.reconstruct_n(0, inner.ntotal) if inner.ntotal else None
+    empty = faiss.clone_index(inner)
+    empty.reset()
+    mapped = faiss.IndexIDMap2(empty)
+    if vectors is not None:
+        mapped.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        logger.info(f"Converted positional {index_kind(inner)} index ({len(vectors)} vectors) to stable ids")
+    return mapped
+
+
+def stored_ids(index):
+    """Return the ids of every vector stored in an index, as an int64 array."""
+    if index is None:
+        return np.zeros(0, dtype=np.int64)
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype(np.int64, copy=False)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        invlists = ivf.invlists
+        parts = [
+            faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+            for l in range(ivf.nlist) if invlists.list_size(l)
+        ]
+        return np.concatenate(parts).astype(np.int64) if parts else np.zeros(0, dtype=np.int64)
+    return np.arange(index.ntotal, dtype=np.int64)
+
+
+def supports_remove(index):
+    """Whether vectors can be removed in place; HNSW graphs cannot drop nodes."""
+    return index_kind(index) != "hnsw"
+
+
+def remove_ids(index, ids):
+    """Remove vectors by id; returns how many were removed. Unknown ids are ignored."""
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if not len(ids):
+        return 0
+    # IVF's hashtable direct map can only remove through an explicit id array.
+    selector = faiss.IDSelectorArray(ids) if faiss.try_extract_index_ivf(index) is not None else faiss.IDSelectorBatch(ids)
+    return index.remove_ids(selector)
+
+
+def selector_params(index, ids):
+    """Search parameters restricting a search to ids, keeping the index's own nprobe."""
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def reconstruct_ids(index, ids):
+    """Return the stored vectors for ids, in order (approximate for PQ indexes)."""
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_batch(ids)
+
+
+def reconstruct_all(index, exclude=None):
+    """Return (ids, vectors) for every vector in an index, skipping ids in exclude."""
+    ids = stored_ids(index)
+    if exclude:
+        ids = ids[~np.isin(ids, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))]
+    return ids, reconstruct_ids(index, ids)
+
+
+def needs_migration(index, config):
+    """Whether an index should be rebuilt to match the configured backend."""
+    return index is not None and index_kind(index) != config.kind and can_build(config, index.ntotal)
+
+
+def migrate_index(index, config, exclude=None):
+    """Rebuild an existing index as the configured backend, keeping vector ids.
+
+    Ids in exclude (tombstoned vectors) are left out of the new index.
+    """
+    source_kind = index_kind(index)
+    if source_kind == "ivf_pq":
+        logger.warning("Migrating from ivf_pq uses reconstructed (lossy) vectors")
+    ids, vectors = reconstruct_all(index, exclude)
+    migrated = build_index(vectors, config, ids) if len(ids) else create_empty_index(index.d, config)
+    logger.info(f"Rebuilt {len(ids)} vectors from {source_kind} as {index_kind(migrated)}")
+    return migrated
+
+
+def main():
+    from services.embedding_service import EmbeddingService
+    from services.registry import EMBEDDING_MODEL
+
+    parser = argparse.ArgumentParser(description="Convert the on-disk FAISS index to another backend.")
+    parser.add_argument("--type", choices=INDEX_TYPES, default=os.getenv("INDEX_TYPE", "flat"))
+    parser.add_argument("--index-path", default="data/faiss_index/index.bin")
+    parser.add_argument("--meta-path", default="data/faiss_index/meta.pkl", help="legacy metadata pickle to migrate")
+    args = parser.parse_args()
+
+    config = IndexConfig.from_env()
+    config.kind = args.type
+    # Loaded like a worker does: legacy metadata reaches the chunk store and every segment is replayed.
+    service = EmbeddingService(
+        model_name=EMBEDDING_MODEL, index_path=args.index_path, meta_path=args.meta_path, index_config=config, refresh_seconds=0
+    )
+    try:
+        if service.index is None:
+            logger.error("No index found to migrate.")
+            return
+        live = service.index.ntotal - len(service.tombstones)
+        if not can_build(config, live):
+            logger.error(f"{config.kind} needs at least {config.min_training_vectors} vectors, index has {live}")
+            return
+        # A compaction rebuilds the base as config.kind under index.lock and publishes it,
+        # so running workers switch to it instead of compacting their old one over it.
+        service.save_index()
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
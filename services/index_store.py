@@ -0,0 +1,156 @@
+"""
+Append-only persistence for the FAISS index.
+
+The store keeps a compacted base (``index.bin``) plus a directory of small, immutable
+segments. Every ingest appends one segment holding only its new vectors and their ids, and
+every delete one segment listing the removed ids, so persisting a change costs the same
+however large the corpus is. Compaction folds the segments back into the base. Ids are never
+reused, which makes replay idempotent: vectors already in the base are skipped. Chunk metadata lives in services.chunk_store. Every file is written to a temporary name, fsynced
+and renamed into place, so a crash never leaves a torn file behind.
+
+Several worker processes can share one store. Changes are made under an exclusive file lock
+(``index.lock``) and published by bumping ``generation.json``, which also records the last
+segment written and the last one folded into the base; workers poll it and catch up.
+"""
+import json
+import os
+import pickle
+import re
+import faiss
+import numpy as np
+from services.index_factory import has_stable_ids, with_stable_ids
+from utils.file_utils import atomic_write
+from utils.locks import file_lock
+from utils.logging_utils import get_logger
+
+logger = get_logger("index_store")
+
+SEGMENT_PATTERN = re.compile(r"^(\d{8})\.seg$")
+
+# Map the compacted base read-only instead of reading it into every worker's memory.
+INDEX_MMAP = os.getenv("INDEX_MMAP", "1") != "0"
+
+
+class SegmentedIndexStore:
+    def __init__(self, index_path, segment_dir=None):
+        self.index_path = index_path
+        index_dir = os.path.dirname(index_path) or "."
+        self.segment_dir = segment_dir or os.path.join(index_dir, "segments")
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self.generation_path = os.path.join(index_dir, "generation.json")
+        self.lock_path = os.path.join(index_dir, "index.lock")
+        self.last_seq = 0
+
+    def _segment_path(self, seq):
+        return os.path.join(self.segment_dir, f"{seq:08d}.seg")
+
+    def lock(self, shared=False):
+        """Cross-process lock on the store: exclusive to change it, shared to read a consistent view."""
+        return file_lock(self.lock_path, shared=shared)
+
+    def read_generation(self):
+        """Return the published state: {"generation", "last_seq", "base_seq"} (zeros if never published)."""
+        try:
+            with open(self.generation_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "last_seq": 0, "base_seq": 0}
+
+    def publish(self, base_seq=None):
+        """Bump the generation after a change; base_seq records a new compacted base. Needs the exclusive lock."""
+        state = self.read_generation()
+        state["generation"] += 1
+        state["last_seq"] = max(state["last_seq"], self.last_seq)
+        if base_seq is not None:
+            state["base_seq"] = base_seq
+        atomic_write(self.generation_path, json.dumps(state).encode())
+        return state
+
+    def list_segments(self):
+        """Return the sequence numbers of all committed segments, oldest first."""
+        seqs = []
+        for name in os.listdir(self.segment_dir):
+            match = SEGMENT_PATTERN.match(name)
+            if match:
+                seqs.append(int(match.group(1)))
+        return sorted(seqs)
+
+    def _append(self, payload):
+        # Other processes may have written segments (or compacted them away) since our last one.
+        seq = max([self.last_seq, self.read_generation()["last_seq"]] + self.list_segments()) + 1
+        payload["seq"] = seq
+        atomic_write(self._segment_path(seq), pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL))
+        self.last_seq = seq
+        return seq
+
+    def append_segment(self, ids, vectors):
+        """Persist one ingest as a new immutable segment. Returns its sequence number."""
+        return self._append({
+            "ids": np.asarray(ids, dtype=np.int64),
+            "vectors": np.asarray(vectors, dtype=np.float32),
+        })
+
+    def append_deletes(self, ids):
+        """Persist the removal of vector ids as a new segment. Returns its sequence number."""
+        return self._append({"deleted_ids": np.asarray(ids, dtype=np.int64)})
+
+    def write_base(self, index_bytes):
+        """Atomically replace the compacted base with a serialized index."""
+        atomic_write(self.index_path, np.asarray(index_bytes, dtype=np.uint8).tobytes())
+
+    def drop_segments(self, through_seq):
+        """Delete segments already folded into the base."""
+        for seq in self.list_segments():
+            if seq <= through_seq:
+                os.remove(self._segment_path(seq))
+
+    def _read_index_file(self, mmap):
+        if not mmap:
+            return faiss.read_index(self.index_path)
+        try:
+            return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # IVF indexes map their inverted lists instead of the whole file.
+            return faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+    def read_base(self, mmap=INDEX_MMAP):
+        """Return the compacted base with stable ids, or None if there is none yet.
+
+        With mmap the vectors stay in the page cache, shared by every process mapping the
+        file; such an index is read-only and must never be added to or removed from. A
+        positional (pre-id) base is converted in memory only, since this runs under the shared
+        lock; upgrade_base() persists the conversion.
+        """
+        if not os.path.exists(self.index_path):
+            return None
+        index = self._read_index_file(mmap)
+        if has_stable_ids(index):
+            return index
+        # A mapped index is read-only and cannot be converted in place.
+        return with_stable_ids(self._read_index_file(mmap=False) if mmap else index)
+
+    def upgrade_base(self):
+        """Rewrite a positional base with stable ids so it can be mapped as it is. Needs the exclusive lock.
+
+        Returns True if the base was rewritten.
+        """
+        if not os.path.exists(self.index_path) or has_stable_ids(self._read_index_file(mmap=INDEX_MMAP)):
+            return False
+        self.write_base(faiss.serialize_index(with_stable_ids(self._read_index_file(mmap=False))))
+        logger.info(f"Converted {self.index_path} to stable vector ids")
+        return True
+
+    def read_segments(self, after_seq=0):
+        """Yield (seq, segment) for every committed segment newer than after_seq, oldest first.
+
+        Segments written before vectors had ids get ids == row.
+        """
+        for seq in self.list_segments():
+            if seq <= after_seq:
+                continue
+            with open(self._segment_path(seq), "rb") as f:
+                segment = pickle.load(f)
+            self.last_seq = max(self.last_seq, seq)
+            if "vectors" in segment and segment.get("ids") is None:
+                segment["ids"] = np.arange(segment["start_row"], segment["start_row"] + len(segment["vectors"]), dtype=np.int64)
+            yield seq, segment
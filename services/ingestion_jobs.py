@@ -0,0 +1,351 @@
+"""
+Background ingestion jobs for /upload-docs.
+
+Uploads are written to ``jobs_dir/incoming`` and queued; a small pool of worker threads runs
+``DocIngestionService.ingest_document`` on them and records progress. Each job's state lives
+in ``jobs_dir/<job_id>.json`` (written atomically), so jobs that were queued or running when
+the process stopped are picked up again on the next start. With several worker processes
+sharing ``jobs_dir``, the process running (or queueing) a job holds an exclusive lock on
+``<job_id>.lock``; recovery only takes jobs whose lock it can get, so no job runs twice and
+jobs of a crashed worker are picked up by the next one that starts. Before a job writes any
+vector it records the doc_id it ingests under (``pending_doc_id``, per file for batches); a
+recovered run first discards what an interrupted one wrote under it but never recorded, so a
+killed worker leaves no orphaned chunks behind. A job can replace an existing
+document: the old one is deleted once the new upload has been ingested. Batch jobs carry many
+files and run them through ``DocIngestionService.ingest_many``'s pipeline.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from utils.file_utils import atomic_write
+from utils.locks import try_lock_file
+from utils.logging_utils import get_logger
+
+logger = get_logger("ingestion_jobs")
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+# Minimum seconds between progress writes for one job; stage changes are always written.
+PROGRESS_INTERVAL = 0.5
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue has no room for another job."""
+
+
+class IngestionJobManager:
+    def __init__(self, ingestion_service, jobs_dir="data/jobs", workers=INGEST_WORKERS, max_queue=INGEST_QUEUE_SIZE):
+        self.ingestion_service = ingestion_service
+        self.jobs_dir = jobs_dir
+        self.incoming_dir = os.path.join(jobs_dir, "incoming")
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._claims = {}  # job_id -> open lock file, held while this process owns the job
+        self._running = set()  # job_ids a worker thread is running right now
+        self._lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _read(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _claim(self, job_id):
+        """Lock job_id for this process. Returns False if another process (or manager) holds it."""
+        claim = try_lock_file(os.path.join(self.jobs_dir, f"{job_id}.lock"))
+        if claim is None:
+            return False
+        self._claims[job_id] = claim
+        return True
+
+    def _release(self, job_id, finished=False):
+        claim = self._claims.pop(job_id, None)
+        if claim is None:
+            return
+        if finished:
+            # A finished job needs no claim; the file goes while still held so they do not pile up.
+            try:
+                os.remove(os.path.join(self.jobs_dir, f"{job_id}.lock"))
+            except FileNotFoundError:
+                pass
+        claim.close()
+
+    def _save(self, job):
+        atomic_write(self._job_path(job["job_id"]), json.dumps(job).encode("utf-8"))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields, updated_at=time.time())
+            self._save(job)
+            return dict(job)
+
+    def incoming_path(self, job_id, suffix):
+        """Where the upload for job_id should be written before it is submitted."""
+        return os.path.join(self.incoming_dir, f"{job_id}{suffix}")
+
+    def new_job_id(self):
+        return str(uuid.uuid4())
+
+    def submit(self, job_id, file_path, filename, replaces=None, tenant=None):
+        """Queue an uploaded file for ingestion. Raises QueueFullError when the queue is full.
+
+        replaces names a doc_id to delete after the file is ingested successfully; tenant is
+        passed on to ingestion.
+        """
+        with self._lock:
+            if self._queue.qsize() >= self.max_queue:
+                raise QueueFullError(f"Ingestion queue is full ({self.max_queue} jobs)")
+            if not self._claim(job_id):
+                raise ValueError(f"Ingestion job {job_id} already exists")
+            now = time.time()
+            job = {
+                "job_id": job_id,
+                "status": QUEUED,
+                "filename": filename,
+                "file_path": file_path,
+                "doc_id": None,
+                "replaces": replaces,
+                "tenant": tenant,
+                "error": None,
+                "progress": {"stage": QUEUED},
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._jobs[job_id] = job
+            self._save(job)
+            self._queue.put(job_id)
+            snapshot = dict(job)
+        logger.info(f"Queued ingestion job {job_id} for {filename}")
+        return snapshot
+
+    def submit_batch(self, job_id, files, tenant=None):
+        """Queue many uploaded (file_path, filename) pairs as one job. Raises QueueFullError when the queue is full.
+
+        The job's "documents" lists the result of every file once it has run.
+        """
+        with self._lock:
+            if self._queue.qsize() >= self.max_queue:
+                raise QueueFullError(f"Ingestion queue is full ({self.max_queue} jobs)")
+            if not self._claim(job_id):
+                raise ValueError(f"Ingestion job {job_id} already exists")
+            now = time.time()
+            job = {
+                "job_id": job_id,
+                "status": QUEUED,
+                "files": [{"file_path": path, "filename": filename} for path, filename in files],
+                "documents": None,
+                "tenant": tenant,
+                "error": None,
+                "progress": {"stage": QUEUED},
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._jobs[job_id] = job
+            self._save(job)
+            self._queue.put(job_id)
+            snapshot = dict(job)
+        logger.info(f"Queued batch ingestion job {job_id} for {len(files)} files")
+        return snapshot
+
+    def get(self, job_id):
+        """Return a copy of the job's state, or None if it is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+        path = self._job_path(job_id)
+        if os.path.exists(path):
+            return self._read(path)
+        return None
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _recover(self):
+        """Re-queue jobs that were queued or running when their process stopped.
+
+        Jobs another live process has claimed are left to it.
+        """
+        recovered = []
+        for name in sorted(os.listdir(self.jobs_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                job = self._read(path)
+                if job.get("status") not in (QUEUED, RUNNING) or not self._claim(job["job_id"]):
+                    continue
+                # Read again under the claim: its last owner may have finished it meanwhile.
+                job = self._read(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable job file {name}: {e}")
+                self._release(name[:-len(".json")])
+                continue
+            if job.get("status") not in (QUEUED, RUNNING):
+                self._release(job["job_id"], finished=True)
+                continue
+            paths = [f["file_path"] for f in job["files"]] if "files" in job else [job.get("file_path", "")]
+            if not all(os.path.exists(path) for path in paths):
+                job.update(status=FAILED, error="Upload was lost before ingestion finished.", updated_at=time.time())
+                self._save(job)
+                self._release(job["job_id"], finished=True)
+                continue
+            job.update(status=QUEUED, progress={"stage": QUEUED}, updated_at=time.time())
+            recovered.append(job)
+        recovered.sort(key=lambda job: job["created_at"])
+        with self._lock:
+            for job in recovered:
+                self._jobs[job["job_id"]] = job
+                self._save(job)
+                self._queue.put(job["job_id"])
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} unfinished ingestion jobs")
+
+    def start(self):
+        """Recover unfinished jobs and start the worker threads."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, timeout=None):
+        """Stop the workers after their current job; queued jobs resume on the next start."""
+        self._stopping.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        # Queued jobs are left for whichever process starts next.
+        with self._lock:
+            unstarted = [job_id for job_id in self._claims if job_id not in self._running]
+        for job_id in unstarted:
+            self._release(job_id)
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None or self._stopping.is_set():
+                # Jobs left in the queue stay "queued" on disk and are recovered on restart.
+                return
+            with self._lock:
+                self._running.add(job_id)
+            try:
+                self._run(job_id)
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+                self._release(job_id, finished=True)
+                self._queue.task_done()
+
+    def _progress_reporter(self, job_id, progress):
+        """Return a progress(stage, **counts) callback that records into progress and the job file."""
+        last_write = 0.0
+
+        def report(stage, **counts):
+            nonlocal last_write
+            stage_changed = stage != progress.get("stage")
+            progress.update(counts, stage=stage)
+            now = time.monotonic()
+            if stage_changed or now - last_write >= PROGRESS_INTERVAL:
+                last_write = now
+                self._update(job_id, progress=dict(progress))
+
+        return report
+
+    def _assign_doc_ids(self, job):
+        """Record the doc_ids the job's files are ingested under, before any vector is written.
+
+        A run of this job that was interrupted (the process was killed) may have written vectors
+        under them that no document records; those are discarded and the ids reused.
+        """
+        entries = [dict(f) for f in job["files"]] if "files" in job else [job]
+        for entry in entries:
+            if entry.get("pending_doc_id"):
+                self.ingestion_service.discard_unrecorded(entry["pending_doc_id"])
+            else:
+                entry["pending_doc_id"] = str(uuid.uuid4())
+        if "files" in job:
+            return self._update(job["job_id"], files=entries)
+        return self._update(job["job_id"], pending_doc_id=entries[0]["pending_doc_id"])
+
+    def _run(self, job_id):
+        job = self._update(job_id, status=RUNNING, progress={"stage": "starting"})
+        job = self._assign_doc_ids(job)
+        progress = dict(job["progress"])
+        report = self._progress_reporter(job_id, progress)
+        if "files" in job:
+            self._run_batch(job, progress, report)
+            return
+        try:
+            doc_id = self.ingestion_service.ingest_document(
+                job["file_path"], filename=job["filename"], progress=report, tenant=job.get("tenant"), move_source=True,
+                doc_id=job["pending_doc_id"],
+            )
+        except Exception as e:
+            logger.exception(f"Ingestion job {job_id} failed")
+            self._update(job_id, status=FAILED, error=str(e), progress=dict(progress))
+        else:
+            if doc_id:
+                try:
+                    self._replace(job, doc_id, report)
+                except Exception as e:
+                    logger.exception(f"Ingestion job {job_id} could not delete {job['replaces']}")
+                    self._update(job_id, status=FAILED, doc_id=doc_id, error=f"Ingested as {doc_id}, but deleting {job['replaces']} failed: {e}", progress=dict(progress))
+                else:
+                    progress["stage"] = "done"
+                    self._update(job_id, status=SUCCEEDED, doc_id=doc_id, progress=dict(progress))
+                    logger.info(f"Ingestion job {job_id} finished as {doc_id}")
+            else:
+                self._update(job_id, status=FAILED, error="Failed to ingest document.", progress=dict(progress))
+        if os.path.exists(job["file_path"]):
+            os.remove(job["file_path"])
+
+    def _run_batch(self, job, progress, report):
+        job_id = job["job_id"]
+        try:
+            result = self.ingestion_service.ingest_many(
+                [(f["file_path"], f["filename"]) for f in job["files"]], progress=report, tenant=job.get("tenant"), move_sources=True,
+                doc_ids=[f["pending_doc_id"] for f in job["files"]],
+            )
+        except Exception as e:
+            logger.exception(f"Batch ingestion job {job_id} failed")
+            self._update(job_id, status=FAILED, error=str(e), progress=dict(progress))
+        else:
+            documents = result.pop("results")
+            progress.update(result, stage="done")
+            status = SUCCEEDED if result["failed"] < result["documents"] else FAILED
+            self._update(job_id, status=status, documents=documents, progress=dict(progress),
+                         error=None if status == SUCCEEDED else "No document could be ingested.")
+            logger.info(f"Batch ingestion job {job_id} finished: {result['ingested']} ingested, {result['duplicate']} duplicates, {result['failed']} failed")
+        for f in job["files"]:
+            if os.path.exists(f["file_path"]):
+                os.remove(f["file_path"])
+
+    def _replace(self, job, doc_id, report):
+        """Delete the document this job replaces, unless the upload turned out to be that same document."""
+        replaces = job.get("replaces")
+        if not replaces or replaces == doc_id:
+            return
+        report("deleting_replaced")
+        deleted = self.ingestion_service.delete_document(replaces)
+        logger.info(f"Ingestion job {job['job_id']} replaced {replaces} ({deleted} chunks deleted)")
@@ -0,0 +1,125 @@
+"""
+A read-only (memory-mapped) base index plus an in-RAM delta of the changes made since.
+
+FAISS cannot change an index mapped from disk, so vectors added after the base was written go
+to a small exact delta index and deleted base vectors are tombstoned. Searches query both and
+merge the hits by distance; compaction folds the delta and the tombstones into a new base.
+"""
+import faiss
+import numpy as np
+from services.index_factory import reconstruct_ids, remove_ids, selector_params, stored_ids
+
+
+def _drop_ids(D, I, excluded, k):
+    """Remove excluded ids from search results, keeping k hits per query and padding like FAISS."""
+    out_D = np.full((len(I), k), np.finfo(np.float32).max, dtype=np.float32)
+    out_I = np.full((len(I), k), -1, dtype=np.int64)
+    for q, (distances, ids) in enumerate(zip(D, I)):
+        keep = np.fromiter((idx not in excluded for idx in ids.tolist()), dtype=bool, count=len(ids))
+        kept = ids[keep][:k]
+        out_I[q, :len(kept)] = kept
+        out_D[q, :len(kept)] = distances[keep][:k]
+    return out_D, out_I
+
+
+def _pad(D, I, k):
+    """Pad search results with fewer than k columns the way FAISS does."""
+    missing = k - I.shape[1]
+    if missing <= 0:
+        return D, I
+    return (
+        np.hstack([D, np.full((len(D), missing), np.finfo(np.float32).max, dtype=np.float32)]),
+        np.hstack([I, np.full((len(I), missing), -1, dtype=np.int64)]),
+    )
+
+
+def _merge(results, k, num_queries):
+    """Merge (distances, ids) results from several indexes into the k nearest hits per query."""
+    if not results:
+        return _pad(np.zeros((num_queries, 0), dtype=np.float32), np.zeros((num_queries, 0), dtype=np.int64), k)
+    if len(results) == 1:
+        return results[0]
+    D = np.hstack([distances for distances, _ in results])
+    I = np.hstack([ids for _, ids in results])
+    order = np.argsort(D, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+class LayeredIndex:
+    def __init__(self, dim, base=None):
+        self.base = base
+        self.base_ids = np.sort(stored_ids(base))
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+        # Deleted base ids; filtered from searches until compaction writes a base without them.
+        self.tombstones = set()
+
+    @property
+    def d(self):
+        return self.delta.d
+
+    @property
+    def ntotal(self):
+        """Stored vectors, tombstoned ones included."""
+        return len(self.base_ids) + self.delta.ntotal
+
+    def _in_base(self, ids):
+        if not len(self.base_ids):
+            return np.zeros(len(ids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.base_ids, ids), len(self.base_ids) - 1)
+        return self.base_ids[positions] == ids
+
+    def stored_ids(self):
+        return np.concatenate([self.base_ids, stored_ids(self.delta)])
+
+    def add(self, ids, vectors):
+        """Add vectors under ids, skipping ids that are already stored (replayed segments)."""
+        ids = np.asarray(ids, dtype=np.int64)
+        new = ~(self._in_base(ids) | np.isin(ids, stored_ids(self.delta)))
+        if new.any():
+            self.delta.add_with_ids(np.ascontiguousarray(vectors[new], dtype=np.float32), ids[new])
+
+    def remove(self, ids):
+        """Remove vectors by id: delta vectors directly, base vectors by tombstone."""
+        ids = np.asarray(ids, dtype=np.int64)
+        in_base = self._in_base(ids)
+        self.tombstones.update(ids[in_base].tolist())
+        remove_ids(self.delta, ids[~in_base])
+
+    def search(self, queries, k):
+        results = []
+        if self.base is not None and self.base.ntotal:
+            if self.tombstones:
+                # Over-fetch so k live hits remain after the tombstoned ones are dropped.
+                D, I = self.base.search(queries, k + len(self.tombstones))
+                results.append(_drop_ids(D, I, self.tombstones, k))
+            else:
+                results.append(self.base.search(queries, k))
+        if self.delta.ntotal:
+            results.append(self.delta.search(queries, k))
+        return _merge(results, k, len(queries))
+
+    def search_subset(self, queries, k, ids, exact_max):
+        """Search only the given ids: exactly against their vectors when there are at most
+        exact_max of them, otherwise through an id selector on each layer."""
+        if self.tombstones:
+            ids = ids[~np.isin(ids, np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones)))]
+        in_base = self._in_base(ids)
+        base_ids = ids[in_base]
+        # Rows another worker has written but this one has not loaded yet are not searchable.
+        delta_ids = ids[~in_base]
+        delta_ids = delta_ids[np.isin(delta_ids, stored_ids(self.delta))]
+        if not len(base_ids) and not len(delta_ids):
+            return _merge([], k, len(queries))
+        if len(base_ids) + len(delta_ids) <= exact_max:
+            vectors = [reconstruct_ids(self.delta, delta_ids)]
+            if len(base_ids):
+                vectors.insert(0, reconstruct_ids(self.base, base_ids))
+            ordered = np.concatenate([base_ids, delta_ids])
+            D, positions = faiss.knn(queries, np.vstack(vectors), min(k, len(ordered)))
+            return _pad(D, ordered[positions], k)
+        results = []
+        if len(base_ids):
+            results.append(self.base.search(queries, k, params=selector_params(self.base, base_ids)))
+        if len(delta_ids):
+            results.append(self.delta.search(queries, k, params=selector_params(self.delta, delta_ids)))
+        return _merge(results, k, len(queries))
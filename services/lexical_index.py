@@ -0,0 +1,61 @@
+"""
+Keyword side of hybrid retrieval.
+
+The inverted index itself is the FTS5 table in services.chunk_store, updated in the same
+transaction as the chunk rows. This module turns questions into FTS5 queries for its BM25
+ranking, fuses BM25 and vector rankings with reciprocal rank fusion, and tags each chunk at
+ingestion time with the keyword groups retrieval checks for, so those checks are lookups on
+the chunk's metadata rather than text scans per query.
+"""
+import os
+import re
+
+# Reciprocal rank fusion constant: higher values flatten the difference between top ranks.
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Substrings retrieval looks for in chunks, by group; a chunk belongs to a group when its
+# lowercased text contains any of the group's terms.
+KEYWORD_GROUPS = {
+    "special": ("waiting period", "limit", "exception", "benefit", "table", "ppn"),
+    "exclusion": ("exclusion", "not covered"),
+    "coverage": ("cover", "benefit", "included"),
+}
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it its me my of on or our "
+    "the this that to under what when where which who why will with you your".split()
+)
+
+_WORD = re.compile(r"\w+")
+_CLAUSE_NUMBER = re.compile(r"\d+(?:\.\d+)+")
+
+
+def keyword_groups(text):
+    """Return the KEYWORD_GROUPS names whose terms occur in text."""
+    text_l = text.lower()
+    return [group for group, terms in KEYWORD_GROUPS.items() if any(term in text_l for term in terms)]
+
+
+def fts_query(question):
+    """Build an FTS5 MATCH expression (any of the question's words) from a question, or None.
+
+    Every word is quoted so FTS5 operators and punctuation in the question are taken
+    literally; clause numbers such as 3.2.1 become phrases so they match as a unit.
+    """
+    terms = []
+    for number in _CLAUSE_NUMBER.findall(question):
+        terms.append('"' + " ".join(number.split(".")) + '"')
+    for word in _WORD.findall(question.lower()):
+        if word in STOPWORDS or (len(word) < 2 and not word.isdigit()):
+            continue
+        terms.append(f'"{word}"')
+    return " OR ".join(dict.fromkeys(terms)) or None
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked id lists into [(id, score)], best first; score = sum of 1 / (k + rank)."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,122 @@
+"""
+Pooled async HTTP client for chat-completion providers.
+
+One ``httpx.AsyncClient`` per event loop keeps connections alive (over HTTP/2 when the
+``h2`` package is installed) instead of opening a new connection per question. Each provider
+gets its own concurrency cap so a slow upstream cannot tie up every in-flight request.
+"""
+import asyncio
+import json
+import os
+import weakref
+import httpx
+from dotenv import load_dotenv
+from utils.logging_utils import get_logger
+
+logger = get_logger("llm_client")
+load_dotenv()
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+
+PROVIDERS = {
+    "openai": {
+        "url": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1") + "/chat/completions",
+        "api_key": os.getenv("OPENAI_API_KEY"),
+    },
+    "openrouter": {
+        "url": os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1") + "/chat/completions",
+        "api_key": os.getenv("OPENROUTER_API_KEY"),
+    },
+}
+
+_clients = weakref.WeakKeyDictionary()     # event loop -> httpx.AsyncClient
+_semaphores = weakref.WeakKeyDictionary()  # event loop -> {provider: asyncio.Semaphore}
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the pooled client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=_http2_available(),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        )
+        _clients[loop] = client
+    return client
+
+
+def _semaphore(provider):
+    per_loop = _semaphores.setdefault(asyncio.get_running_loop(), {})
+    if provider not in per_loop:
+        per_loop[provider] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return per_loop[provider]
+
+
+async def close_client():
+    """Close the pooled client of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.pop(loop, None)
+    if client is not None:
+        await client.aclose()
+    _semaphores.pop(loop, None)
+
+
+def build_request(prompt, model, provider, temperature=0.1, **extra):
+    settings = PROVIDERS[provider]
+    headers = {"Authorization": f"Bearer {settings['api_key']}"}
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        **extra,
+    }
+    return settings["url"], headers, data
+
+
+async def chat_completion(prompt, model="gpt-3.5-turbo", provider=None, temperature=0.1):
+    """Send one chat completion request and return the message content."""
+    provider = provider or LLM_PROVIDER
+    url, headers, data = build_request(prompt, model, provider, temperature)
+
+    async def send():
+        async with _semaphore(provider):
+            return await get_client().post(url, headers=headers, json=data)
+
+    # Bound the whole call, including time spent waiting for a concurrency slot.
+    resp = await asyncio.wait_for(send(), LLM_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()["choices"][0]["message"]["content"]
+
+
+async def stream_chat_completion(prompt, model="gpt-3.5-turbo", provider=None, temperature=0.1):
+    """Stream a chat completion, yielding content deltas as the provider sends them."""
+    provider = provider or LLM_PROVIDER
+    url, headers, data = build_request(prompt, model, provider, temperature, stream=True)
+    async with _semaphore(provider):
+        async with get_client().stream("POST", url, headers=headers, json=data) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                # Server-sent events: skip blank lines and ": keep-alive" comments.
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                choices = json.loads(payload).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
@@ -0,0 +1,254 @@
+"""
+Gateway in front of the chat-completion providers.
+
+Identical questions that arrive together would otherwise each pay for their own multi-second
+LLM call, and one slow provider would stall every answer. The gateway sits between the query
+service and ``services.llm_client`` and
+
+* coalesces in-flight calls for the same (model, temperature, prompt) into one upstream call;
+* hedges: when a call is still running after the provider's observed p95 latency (or a fixed
+  delay), it sends a second request, to the next provider if there is one, and keeps the
+  answer that arrives first;
+* fails over to the next provider when a call fails;
+* paces each provider with a token-bucket rate limit, sending calls to a provider with spare
+  capacity before queueing on a saturated one.
+
+Streaming calls fail over before their first token; they are neither coalesced nor hedged.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from collections import deque
+import numpy as np
+from dotenv import load_dotenv
+from services import llm_client
+from utils.logging_utils import get_logger
+from utils.metrics import LLM_GATEWAY_EVENTS, LLM_REQUESTS
+
+logger = get_logger("llm_gateway")
+load_dotenv()
+
+# Failover order, e.g. "openrouter,openai"; by default LLM_PROVIDER first, then every other
+# provider that has an API key.
+LLM_PROVIDERS = [name.strip() for name in os.getenv("LLM_PROVIDERS", "").split(",") if name.strip()]
+# Share one upstream call between identical in-flight questions.
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") != "0"
+# Hedge a call still running after this quantile of the provider's recent latencies ...
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# ... once this many calls have been timed (0 disables hedging) ...
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# ... or after a fixed delay instead, when set.
+LLM_HEDGE_AFTER_MS = float(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+# Recent call latencies kept per provider for the hedge quantile.
+LLM_LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Requests per second per provider, e.g. "openai=5,openrouter=20"; unlisted providers are unlimited.
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")
+
+
+def parse_rate_limits(spec):
+    """Parse "provider=rate,..." into {provider: requests per second}."""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition("=")
+        limits[name.strip()] = float(rate)
+    return limits
+
+
+def prompt_key(prompt, model, temperature):
+    """Hash identifying calls that would get the same answer."""
+    payload = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available now."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def reserve(self):
+        """Take a token, borrowing from the future if needed. Returns the seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+
+class LLMGateway:
+    def __init__(self, providers=None, rate_limits=None, coalesce=LLM_COALESCE, hedge_quantile=LLM_HEDGE_QUANTILE,
+                 hedge_min_samples=LLM_HEDGE_MIN_SAMPLES, hedge_after_ms=LLM_HEDGE_AFTER_MS):
+        self._providers = providers or LLM_PROVIDERS
+        limits = parse_rate_limits(LLM_RATE_LIMITS) if rate_limits is None else rate_limits
+        self.limiters = {name: RateLimiter(rate) for name, rate in limits.items() if rate > 0}
+        self.coalesce = coalesce
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_after_ms = hedge_after_ms
+        self._latencies = {}  # provider -> deque of recent call seconds
+        self._inflight = weakref.WeakKeyDictionary()  # event loop -> {prompt key: asyncio.Task}
+
+    def providers(self):
+        """Providers in failover order."""
+        if self._providers:
+            return list(self._providers)
+        primary = llm_client.LLM_PROVIDER
+        # The primary is always tried (a local stub needs no key); fallbacks only with a key.
+        return [primary] + [name for name, settings in llm_client.PROVIDERS.items() if name != primary and settings.get("api_key")]
+
+    def hedge_delay(self, provider):
+        """Seconds to wait on a call to provider before hedging it, or None to not hedge."""
+        if self.hedge_after_ms > 0:
+            return self.hedge_after_ms / 1000
+        latencies = self._latencies.get(provider)
+        if not self.hedge_min_samples or latencies is None or len(latencies) < self.hedge_min_samples:
+            return None
+        return float(np.quantile(np.fromiter(latencies, dtype=np.float64), self.hedge_quantile))
+
+    def _observe(self, provider, seconds):
+        self._latencies.setdefault(provider, deque(maxlen=LLM_LATENCY_WINDOW)).append(seconds)
+
+    def _has_capacity(self, provider):
+        limiter = self.limiters.get(provider)
+        return limiter is None or limiter.try_acquire()
+
+    async def _take_provider(self, queue):
+        """Pop the first provider in queue with spare capacity, else wait for the first one's turn."""
+        for i, provider in enumerate(queue):
+            if self._has_capacity(provider):
+                return queue.pop(i)
+        provider = queue.pop(0)
+        wait = self.limiters[provider].reserve()
+        LLM_GATEWAY_EVENTS.inc(event="rate_limited")
+        await asyncio.sleep(wait)
+        return provider
+
+    async def _attempt(self, provider, prompt, model, temperature):
+        started = time.perf_counter()
+        try:
+            content = await llm_client.chat_completion(prompt, model=model, provider=provider, temperature=temperature)
+        except asyncio.CancelledError:
+            # Lost to a hedge. A call already slower than the hedge delay is still a lower bound
+            # on the provider's latency, and leaving it out would pull the quantile down; one
+            # cancelled sooner (a hedge that lost) says nothing about the tail.
+            elapsed = time.perf_counter() - started
+            delay = self.hedge_delay(provider)
+            if delay is not None and elapsed >= delay:
+                self._observe(provider, elapsed)
+            LLM_REQUESTS.inc(provider=provider, outcome="cancelled")
+            raise
+        except Exception:
+            LLM_REQUESTS.inc(provider=provider, outcome="error")
+            raise
+        self._observe(provider, time.perf_counter() - started)
+        LLM_REQUESTS.inc(provider=provider, outcome="ok")
+        return content
+
+    def _hedge_target(self, queue, current):
+        """Provider for a hedge of a call to current: the next one with spare capacity, else
+        current itself if it has capacity, else None. Never queues for a hedge."""
+        for i, provider in enumerate(queue):
+            if self._has_capacity(provider):
+                return queue.pop(i)
+        return current if self._has_capacity(current) else None
+
+    async def _complete(self, prompt, model, temperature):
+        queue = self.providers()
+        running = {}  # attempt task -> provider
+
+        def start(provider):
+            running[asyncio.ensure_future(self._attempt(provider, prompt, model, temperature))] = provider
+            return provider
+
+        current = start(await self._take_provider(queue))
+        hedge_delay = self.hedge_delay(current)
+        error = None
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Each attempt is hedged at most once.
+                    hedge_delay = None
+                    hedge = self._hedge_target(queue, current)
+                    if hedge is not None:
+                        LLM_GATEWAY_EVENTS.inc(event="hedged")
+                        start(hedge)
+                    continue
+                for task in done:
+                    provider = running.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    logger.warning(f"LLM call to {provider} failed: {error!r}")
+                if not running and queue:
+                    # Failed providers have left the queue, so neither a failover nor its hedge goes back to them.
+                    LLM_GATEWAY_EVENTS.inc(event="failover")
+                    current = start(await self._take_provider(queue))
+                    hedge_delay = self.hedge_delay(current)
+        finally:
+            for task in running:
+                task.cancel()
+        raise error
+
+    async def chat_completion(self, prompt, model="gpt-3.5-turbo", temperature=0.1):
+        """Return the message content for prompt, sharing the call with identical in-flight ones."""
+        if not self.coalesce:
+            return await self._complete(prompt, model, temperature)
+        inflight = self._inflight.setdefault(asyncio.get_running_loop(), {})
+        key = prompt_key(prompt, model, temperature)
+        task = inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._complete(prompt, model, temperature))
+            inflight[key] = task
+            task.add_done_callback(lambda _: inflight.pop(key, None))
+        else:
+            LLM_GATEWAY_EVENTS.inc(event="coalesced")
+        # Shielded so a caller that goes away does not cancel the call for the others.
+        return await asyncio.shield(task)
+
+    async def stream_chat_completion(self, prompt, model="gpt-3.5-turbo", temperature=0.1):
+        """Stream content deltas, failing over to the next provider if one fails before its first token."""
+        queue = self.providers()
+        error = None
+        while queue:
+            if error is not None:
+                LLM_GATEWAY_EVENTS.inc(event="failover")
+            provider = await self._take_provider(queue)
+            started = False
+            try:
+                async for token in llm_client.stream_chat_completion(prompt, model=model, provider=provider, temperature=temperature):
+                    started = True
+                    yield token
+            except Exception as e:
+                LLM_REQUESTS.inc(provider=provider, outcome="error")
+                if started:
+                    raise
+                error = e
+                logger.warning(f"Streaming LLM call to {provider} failed: {e!r}")
+                continue
+            LLM_REQUESTS.inc(provider=provider, outcome="ok")
+            return
+        raise error
@@ -1,166 +1,462 @@
 """
 Flexible service for natural language document analysis and question answering.
 """
+import asyncio
+import logging
 import os
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+from services.llm_gateway import LLMGateway
+from services.answer_cache import AnswerCache, normalize_query
+from services.content_store import ContentStore
+from services.context_builder import ContextBuilder, count_tokens
 from services.embedding_service import EmbeddingService
+from services.lexical_index import KEYWORD_GROUPS, fts_query, keyword_groups, reciprocal_rank_fusion
+from services.reranker import RERANK, Reranker
 from utils.prompt_templates import FLEXIBLE_QUERY_PROMPT
 from utils.logging_utils import get_logger
-import openai
-import httpx
+from utils.metrics import LLM_TOKENS, STAGE_SECONDS, span
 from dotenv import load_dotenv
 
 logger = get_logger("query_reasoning_service")
 load_dotenv()
 
-LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+# Threads for query encoding and FAISS search, kept off the event loop.
+QUERY_CPU_WORKERS = int(os.getenv("QUERY_CPU_WORKERS", str(min(8, os.cpu_count() or 1))))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+# Concurrent LLM calls per /ask-query/batch request.
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+# Add a BM25 keyword leg to retrieval, fused with the vector hits; 0 searches vectors only.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") != "0"
+
+# Keywords for complex queries
+SPECIAL_TERMS = list(KEYWORD_GROUPS["special"])
+
+NO_CONTENT_RESPONSE = {
+    "answer": "I could not find any relevant information in the uploaded documents to answer your question. This could be due to several reasons: 1) The document may not contain information about this specific topic, 2) The information might be in a different section that wasn't retrieved, 3) The document might need to be re-uploaded or processed differently, or 4) The question might be too specific for the available content.",
+    "confidence": "low",
+    "source_sections": [],
+    "additional_info": "Here are some suggestions to help: 1) Try rephrasing your question with different keywords or terms, 2) Ask a more general question about the document first to see what information is available, 3) Check if you have uploaded the correct document that should contain this information, 4) Consider uploading additional documents if this information might be in a different file, 5) If this is about a specific policy term, try asking about related terms or broader categories. You can also use the /debug/chunks endpoint to see what content is actually available in the uploaded document."
+}
+
+LLM_ERROR_RESPONSE = {
+    "answer": "I apologize, but I encountered an error while processing your question. This could be due to a temporary issue with the language model service, network connectivity problems, or an issue with the API configuration.",
+    "confidence": "low",
+    "source_sections": [],
+    "additional_info": "Here are some steps you can try: 1) Wait a moment and try your question again, 2) Check if your API keys are properly configured in the .env file, 3) Verify that you have sufficient API credits or quota remaining, 4) Try asking a simpler question first to test the system, 5) If the problem persists, you may need to restart the server or check the server logs for more detailed error information. The system is designed to be robust, so temporary issues usually resolve quickly."
+}
+
+
+def unexpected_error_response(e):
+    return {
+        "answer": f"An unexpected error occurred while processing your question: {str(e)}. This is not typical and indicates a system issue that needs attention.",
+        "confidence": "low",
+        "source_sections": [],
+        "additional_info": "This error suggests there might be an issue with the system configuration, the document processing, or the language model service. Here are some troubleshooting steps: 1) Check if the document was properly uploaded and processed, 2) Verify that all required services are running correctly, 3) Check the server logs for more detailed error information, 4) Try restarting the server, 5) If the problem persists, there might be an issue with the API configuration or the language model service. Please try again, and if the issue continues, consider checking the system logs or contacting support."
+    }
+
 
 class QueryReasoningService:
-    def __init__(self, top_k=15):  # Increased from 12 to 15 for more comprehensive coverage
-        self.embedding_service = EmbeddingService()
+    def __init__(self, top_k=15, embedding_service=None, answer_cache=None, content_store=None, reranker=None, llm_gateway=None):  # Increased from 12 to 15 for more comprehensive coverage
+        self.embedding_service = embedding_service or EmbeddingService()
         self.top_k = top_k
-
-    def _call_llm(self, prompt, model="gpt-3.5-turbo"):
+        self._content_store = content_store
+        self._owns_content_store = False
+        # (doc_id, tenant) -> (vector ids, labels), valid for one content generation.
+        self._scope_rows_cache = {}
+        self._scope_generation = None
+        self._scope_lock = threading.Lock()
+        # None builds the default cache (ANSWER_CACHE_SIZE entries, 0 for none); False disables it.
+        if answer_cache is None and ANSWER_CACHE_SIZE > 0:
+            answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
+        self.answer_cache = answer_cache or None
+        self.context_builder = ContextBuilder()
+        if reranker is None and RERANK:
+            reranker = Reranker()
+        self.reranker = reranker
+        self.llm_gateway = llm_gateway or LLMGateway()
+        self._executor = ThreadPoolExecutor(max_workers=QUERY_CPU_WORKERS, thread_name_prefix="query-cpu")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        if self._owns_content_store:
+            self._content_store.close()
+
+    async def _call_llm(self, prompt, model="gpt-3.5-turbo"):
         """Call the LLM with the given prompt."""
+        started = time.perf_counter()
         try:
-            if LLM_PROVIDER == "openai":
-                openai.api_key = OPENAI_API_KEY
-                response = openai.ChatCompletion.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.1,  # Slightly higher for more natural responses
-                )
-                return response.choices[0].message["content"]
-            else:
-                headers = {"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
-                data = {
-                    "model": model,
-                    "messages": [{"role": "user", "content": prompt}],
-                    "temperature": 0.1,
-                }
-                url = "https://openrouter.ai/api/v1/chat/completions"
-                with httpx.Client(timeout=60) as client:
-                    resp = client.post(url, headers=headers, json=data)
-                    resp.raise_for_status()
-                    return resp.json()["choices"][0]["message"]["content"]
+            with span("llm"):
+                response = await self.llm_gateway.chat_completion(prompt, model=model)
         except Exception as e:
-            logger.error(f"LLM call failed: {e}")
+            logger.error(f"LLM call failed: {e!r}")
             return None
+        # Token counting is tokenizer work over the whole prompt: off the event loop, and not waited for.
+        self._executor.submit(self._log_llm_tokens, prompt, response or "", time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def _log_llm_tokens(prompt, completion, seconds, first_token_seconds=None):
+        """Log prompt/completion token counts with the call's latency, for latency-per-token tracking."""
+        prompt_tokens = count_tokens(prompt)
+        completion_tokens = count_tokens(completion)
+        LLM_TOKENS.inc(prompt_tokens, kind="prompt")
+        LLM_TOKENS.inc(completion_tokens, kind="completion")
+        first_token = f", first token after {first_token_seconds * 1000:.0f} ms" if first_token_seconds is not None else ""
+        per_token = f" ({seconds * 1000 / completion_tokens:.1f} ms/completion token)" if completion_tokens else ""
+        logger.info(
+            f"LLM call: {prompt_tokens} prompt tokens, {completion_tokens} completion tokens "
+            f"in {seconds * 1000:.0f} ms{per_token}{first_token}"
+        )
+
+    def _encode_queries(self, queries):
+        with span("query_encode"):
+            return self.embedding_service.encode(queries)
+
+    async def _run_cpu(self, fn, *args, **kwargs):
+        """Run CPU-bound work (encoding, search) on the query executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    @property
+    def content_store(self):
+        if self._content_store is None:
+            self._content_store = ContentStore(
+                os.path.join(os.path.dirname(self.embedding_service.index_path), "content.db")
+            )
+            self._owns_content_store = True
+        return self._content_store
+
+    def _generation(self):
+        """Version of everything a question can see: the index and the documents recorded over it."""
+        return self.embedding_service.generation, self.content_store.version()
+
+    def _scope_rows(self, scope):
+        """Resolve a (doc_id, tenant) scope to (vector ids, labels), or None for an unscoped question.
 
-    def _retrieve_relevant_content(self, query: str, k=None):
-        """Retrieve relevant document chunks for the query."""
+        Vectors are shared between documents with identical chunks, so labels maps each row to
+        the in-scope (doc_id, chunk_id, filename, tenant) to report instead of the stored one.
+        """
+        if scope is None:
+            return None
+        generation = self._generation()
+        with self._scope_lock:
+            if generation != self._scope_generation:
+                self._scope_rows_cache.clear()
+                self._scope_generation = generation
+            resolved = self._scope_rows_cache.get(scope)
+        if resolved is None:
+            doc_id, tenant = scope
+            chunks = self.content_store.scope_chunks(doc_id, tenant)
+            labels = {row_id: label for row_id, *label in chunks}
+            ids = list(labels)
+            if not ids and doc_id is not None and tenant is None:
+                # Documents ingested before deduplication are only known to the chunk store.
+                ids = self.embedding_service.chunk_store.doc_row_ids(doc_id)
+            resolved = (np.array(sorted(ids), dtype=np.int64), labels)
+            with self._scope_lock:
+                if len(self._scope_rows_cache) >= 256:
+                    self._scope_rows_cache.clear()
+                self._scope_rows_cache[scope] = resolved
+        return resolved
+
+    @staticmethod
+    def _relabel(meta, idx, labels):
+        label = labels.get(int(idx)) if labels else None
+        if meta is None or label is None:
+            return meta
+        doc_id, chunk_id, filename, tenant = label
+        return {**meta, "doc_id": doc_id, "chunk_id": chunk_id, "filename": filename, "tenant": tenant}
+
+    def _scoped_search(self, query_embs, search_k, scope):
+        """embedding_service.search, restricted to a scope and with rows labelled for it."""
+        resolved = self._scope_rows(scope)
+        if resolved is None:
+            with span("search"):
+                return self.embedding_service.search(query_embs, search_k)
+        ids, labels = resolved
+        with span("search"):
+            search_result = self.embedding_service.search(query_embs, search_k, ids=ids)
+        if search_result is None or not labels:
+            return search_result
+        D, I, rows = search_result
+        rows = [[self._relabel(meta, idx, labels) for idx, meta in zip(query_ids, query_rows)] for query_ids, query_rows in zip(I, rows)]
+        return D, I, rows
+
+    def _lexical_ranking(self, query, search_k, scope):
+        """Row ids ranked by BM25 for the query (within the scope), best first."""
+        match = fts_query(query) if HYBRID_SEARCH else None
+        if match is None:
+            return []
+        resolved = self._scope_rows(scope)
+        with span("lexical_search"):
+            hits = self.embedding_service.chunk_store.lexical_search(match, search_k, resolved[0] if resolved else None)
+        return [row_id for row_id, _ in hits]
+
+    def _fuse(self, distances, ids, rows, lexical, scope):
+        """Merge vector hits and BM25 hits into [(row_id, fused score, metadata)], best first."""
+        vector_rows = {int(idx): meta for idx, meta in zip(ids, rows) if idx >= 0}
+        fused = reciprocal_rank_fusion([list(vector_rows), lexical])
+        missing = [idx for idx, _ in fused if idx not in vector_rows]
+        if missing:
+            # Keyword-only hits were not part of the vector search, so fetch their rows here.
+            resolved = self._scope_rows(scope)
+            labels = resolved[1] if resolved else None
+            for idx, meta in self.embedding_service.chunk_store.get_rows(missing).items():
+                vector_rows[idx] = self._relabel(meta, idx, labels)
+        return [(idx, score, vector_rows.get(idx)) for idx, score in fused]
+
+    @staticmethod
+    def _scope(doc_id=None, tenant=None):
+        return None if doc_id is None and tenant is None else (doc_id, tenant)
+
+    def _retrieval_depth(self, query: str, k=None):
+        """Return (k, is_complex, search_k) for a query."""
         if k is None:
             k = self.top_k
 
         # Keywords for complex queries
-        special_terms = ["waiting period", "limit", "exception", "benefit", "table", "ppn"]
         query_lower = query.lower()
-        is_complex = any(term in query_lower for term in special_terms)
+        is_complex = any(term in query_lower for term in SPECIAL_TERMS)
         if is_complex:
             k = max(k, 25)
 
+        # Get more chunks initially to have better coverage
+        search_k = min(k * 2, 40)  # Get more chunks for complex queries
+        return k, is_complex, search_k
+
+    def _retrieve_relevant_content(self, query: str, k=None, query_emb=None, scope=None):
+        """Retrieve relevant document chunks for the query, optionally only from a (doc_id, tenant) scope."""
+        k, is_complex, search_k = self._retrieval_depth(query, k)
+
         try:
-            logger.info(f"Starting retrieval for query: '{query}'")
-            logger.info(f"FAISS index exists: {self.embedding_service.index is not None}")
-            logger.info(f"Total metadata entries: {len(self.embedding_service.metadata)}")
+            logger.debug(f"Starting retrieval for query: '{query}'")
 
             # Semantic retrieval using embeddings
-            query_emb = self.embedding_service.model.encode([query])
-            logger.info(f"Query embedding shape: {query_emb.shape}")
+            if query_emb is None:
+                query_emb = self._encode_queries([query])
 
-            if self.embedding_service.index is None:
+            search_result = self._scoped_search(query_emb, search_k, scope)
+            if search_result is None:
                 logger.error("FAISS index not loaded.")
                 return []
-
-            # Get more chunks initially to have better coverage
-            search_k = min(k * 2, 40)  # Get more chunks for complex queries
-            D, I = self.embedding_service.index.search(
-                np.array(query_emb, dtype=np.float32), search_k
-            )
-            logger.info(f"FAISS search results - Distances: {D[0]}, Indices: {I[0]}")
-
-            results = []
-            for idx in I[0]:
-                if idx < len(self.embedding_service.metadata):
-                    meta = self.embedding_service.metadata[idx]
-                    chunk_text = meta.get("text", "")
-                    if chunk_text.strip():  # Only include non-empty chunks
-                        results.append({
-                            "text": chunk_text,
-                            "metadata": meta,
-                            "relevance_score": float(D[0][list(I[0]).index(idx)]) if idx in I[0] else 0.0
-                        })
-                        logger.info(f"Added chunk {idx} with text preview: {chunk_text[:100]}...")
-                    else:
-                        logger.warning(f"Chunk {idx} has empty text")
-                else:
-                    logger.warning(f"Index {idx} out of bounds for metadata")
-
-            # Sort by relevance (lower distance = higher relevance)
-            results.sort(key=lambda x: x["relevance_score"])
-
-            # Take top k results but ensure we have a good mix
-            final_results = results[:k]
-
-            # For complex queries, always include chunks mentioning special terms
-            if is_complex:
-                extra_chunks = []
-                for chunk in results[k:]:
-                    text_l = chunk["text"].lower()
-                    if any(term in text_l for term in special_terms):
-                        extra_chunks.append(chunk)
-                        if len(extra_chunks) >= 5:
-                            break
-                final_results.extend(extra_chunks)
-
-            # If we have exclusions but no coverage info, try to get more coverage-related chunks
-            has_exclusions = any("exclusion" in chunk["text"].lower() or "not covered" in chunk["text"].lower() for chunk in final_results)
-            has_coverage = any("cover" in chunk["text"].lower() or "benefit" in chunk["text"].lower() or "included" in chunk["text"].lower() for chunk in final_results)
-
-            if has_exclusions and not has_coverage:
-                logger.info("Found exclusions but no coverage info, expanding search...")
-                # Get additional chunks that might contain coverage information
-                for chunk in results[k:]:
-                    if "cover" in chunk["text"].lower() or "benefit" in chunk["text"].lower() or "included" in chunk["text"].lower():
-                        final_results.append(chunk)
-                        if len(final_results) >= k + 5:  # Add a few more coverage chunks
-                            break
-
-            logger.info(f"Retrieved {len(final_results)} relevant chunks for query")
-            return final_results
+            D, I, rows = search_result
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"FAISS search results - Distances: {D[0]}, Indices: {I[0]}")
+            lexical = self._lexical_ranking(query, search_k, scope)
+            return self._rerank(query, self._select_chunks(k, is_complex, self._fuse(D[0], I[0], rows[0], lexical, scope)))
 
         except Exception as e:
             logger.error(f"Retrieval failed: {e}")
             return []
 
-    def answer_query(self, query: str):
+    def _retrieve_batch(self, queries, query_embs, scope=None):
+        """Retrieve chunks for many queries with a single FAISS search over the (n, d) query matrix."""
+        depths = [self._retrieval_depth(query) for query in queries]
+        try:
+            search_result = self._scoped_search(query_embs, max(search_k for _, _, search_k in depths), scope)
+            if search_result is None:
+                logger.error("FAISS index not loaded.")
+                return [[] for _ in queries]
+            D, I, rows = search_result
+            return [
+                self._rerank(query, self._select_chunks(k, is_complex, self._fuse(
+                    D[i][:search_k], I[i][:search_k], rows[i][:search_k], self._lexical_ranking(query, search_k, scope), scope
+                )))
+                for i, (query, (k, is_complex, search_k)) in enumerate(zip(queries, depths))
+            ]
+        except Exception as e:
+            logger.error(f"Batch retrieval failed: {e}")
+            return [[] for _ in queries]
+
+    def _rerank(self, query, chunks):
+        """Cut the selected chunks to the reranker's top N, when reranking is enabled."""
+        if self.reranker is None or not chunks:
+            return chunks
+        try:
+            with span("rerank"):
+                return self.reranker.rerank(query, chunks)
+        except Exception as e:
+            logger.error(f"Reranking failed, keeping retrieval order: {e!r}")
+            return chunks
+
+    def _select_chunks(self, k, is_complex, candidates):
+        """Turn fused (row_id, score, metadata) hits, best first, into the ranked chunk list sent to the LLM."""
+        results = []
+        seen_texts = set()
+        verbose = logger.isEnabledFor(logging.DEBUG)  # Per-chunk previews cost real time under load
+        for idx, score, meta in candidates:
+            if meta is not None:
+                chunk_text = meta.get("text", "")
+                if chunk_text in seen_texts:  # Skip copies indexed before uploads were deduplicated
+                    continue
+                seen_texts.add(chunk_text)
+                if chunk_text.strip():  # Only include non-empty chunks
+                    results.append({
+                        "text": chunk_text,
+                        "metadata": meta,
+                        "relevance_score": float(score)
+                    })
+                    if verbose:
+                        logger.debug(f"Added chunk {idx} with text preview: {chunk_text[:100]}...")
+                else:
+                    logger.warning(f"Chunk {idx} has empty text")
+            elif idx >= 0:
+                logger.warning(f"Index {idx} out of bounds for metadata")
+
+        # Candidates are already in fused rank order (higher score = higher relevance).
+        # Take top k results but ensure we have a good mix
+        final_results = results[:k]
+
+        # For complex queries, always include chunks mentioning special terms
+        if is_complex:
+            extra_chunks = []
+            for chunk in results[k:]:
+                if "special" in self._keyword_groups(chunk):
+                    extra_chunks.append(chunk)
+                    if len(extra_chunks) >= 5:
+                        break
+            final_results.extend(extra_chunks)
+
+        # If we have exclusions but no coverage info, try to get more coverage-related chunks
+        has_exclusions = any("exclusion" in self._keyword_groups(chunk) for chunk in final_results)
+        has_coverage = any("coverage" in self._keyword_groups(chunk) for chunk in final_results)
+
+        if has_exclusions and not has_coverage:
+            logger.info("Found exclusions but no coverage info, expanding search...")
+            # Get additional chunks that might contain coverage information
+            for chunk in results[k:]:
+                if "coverage" in self._keyword_groups(chunk):
+                    final_results.append(chunk)
+                    if len(final_results) >= k + 5:  # Add a few more coverage chunks
+                        break
+
+        logger.info(f"Retrieved {len(final_results)} relevant chunks for query")
+        return final_results
+
+    @staticmethod
+    def _keyword_groups(chunk):
+        """Keyword groups tagged on the chunk at ingestion (computed here for chunks indexed before tagging)."""
+        groups = chunk["metadata"].get("keywords")
+        return groups if groups is not None else keyword_groups(chunk["text"])
+
+    async def _check_answer_cache(self, query: str, scope=None):
+        """Look the question up in the answer cache.
+
+        Returns (cached result or None, query embedding, content generation). The embedding is
+        computed on an exact-match miss and reused for retrieval.
+        """
+        generation = self._generation()
+        if self.answer_cache is not None:
+            cached = self.answer_cache.get_exact(query, generation, scope)
+            if cached is not None:
+                return cached, None, generation
+        try:
+            query_emb = await self._run_cpu(self._encode_queries, [query])
+        except Exception as e:
+            logger.error(f"Query embedding failed: {e}")
+            query_emb = None
+        if self.answer_cache is not None and query_emb is not None:
+            cached = self.answer_cache.get_similar(query_emb[0], generation, scope)
+            if cached is not None:
+                return cached, query_emb, generation
+        return None, query_emb, generation
+
+    def _store_answer(self, query, query_emb, generation, result, scope=None):
+        if self.answer_cache is not None:
+            self.answer_cache.put(query, query_emb[0] if query_emb is not None else None, generation, result, scope)
+
+    async def answer_query(self, query: str, doc_id=None, tenant=None):
         """
         Answer any natural language question about the uploaded document.
         This is a completely flexible system that can handle any type of question.
+        doc_id / tenant restrict retrieval to one document / one tenant's documents.
+        The returned dict carries "cached": True when it was served from the answer cache.
         """
-        try:
-            # Step 1: Retrieve relevant document content
-            relevant_chunks = self._retrieve_relevant_content(query)
+        scope = self._scope(doc_id, tenant)
+        cached, query_emb, generation = await self._check_answer_cache(query, scope)
+        if cached is not None:
+            return {**cached, "cached": True}
 
-            if not relevant_chunks:
-                return {
-                    "answer": "I could not find any relevant information in the uploaded documents to answer your question. This could be due to several reasons: 1) The document may not contain information about this specific topic, 2) The information might be in a different section that wasn't retrieved, 3) The document might need to be re-uploaded or processed differently, or 4) The question might be too specific for the available content.",
-                    "confidence": "low",
-                    "source_sections": [],
-                    "additional_info": "Here are some suggestions to help: 1) Try rephrasing your question with different keywords or terms, 2) Ask a more general question about the document first to see what information is available, 3) Check if you have uploaded the correct document that should contain this information, 4) Consider uploading additional documents if this information might be in a different file, 5) If this is about a specific policy term, try asking about related terms or broader categories. You can also use the /debug/chunks endpoint to see what content is actually available in the uploaded document."
-                }
+        result, cacheable = await self._answer_uncached(query, query_emb, scope)
+        if cacheable:
+            self._store_answer(query, query_emb, generation, result, scope)
+        return {**result, "cached": False}
 
-            # Step 2: Prepare document content for analysis
-            document_content = "\n\n---\n\n".join([
-                f"Section {chunk['metadata'].get('chunk_id', '?')}:\n{chunk['text']}"
-                for chunk in relevant_chunks
-            ])
+    async def stream_answer(self, query: str, doc_id=None, tenant=None):
+        """
+        Stream an answer as (event, data) pairs: one "sources" event with the retrieved
+        sections, "token" events as the LLM produces text, then a final "result" event
+        holding the same structured dict answer_query would return.
+        """
+        scope = self._scope(doc_id, tenant)
+        cached, query_emb, generation = await self._check_answer_cache(query, scope)
+        if cached is not None:
+            yield "sources", {"source_sections": cached.get("source_sections", [])}
+            yield "result", {**cached, "cached": True}
+            return
+
+        relevant_chunks = await self._run_cpu(self._retrieve_relevant_content, query, query_emb=query_emb, scope=scope)
+        if not relevant_chunks:
+            yield "sources", {"source_sections": []}
+            yield "result", {**NO_CONTENT_RESPONSE, "cached": False}
+            return
+
+        analysis_prompt, packed_chunks = await self._run_cpu(self._build_prompt, query, relevant_chunks)
+        yield "sources", {"source_sections": [self._source_section(chunk) for chunk in packed_chunks]}
+        parts = []
+        started = time.perf_counter()
+        first_token_at = None
+        try:
+            async for token in self.llm_gateway.stream_chat_completion(analysis_prompt):
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(token)
+                yield "token", {"text": token}
+        except Exception as e:
+            logger.error(f"Streaming LLM call failed: {e!r}")
+            yield "result", {**LLM_ERROR_RESPONSE, "cached": False}
+            return
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm")
+        if first_token_at is not None:
+            self._executor.submit(self._log_llm_tokens, analysis_prompt, "".join(parts), time.perf_counter() - started, first_token_at - started)
+        if not parts:
+            yield "result", {**LLM_ERROR_RESPONSE, "cached": False}
+            return
+
+        with span("json_parse"):
+            result, cacheable = self._parse_llm_response("".join(parts))
+        if cacheable:
+            self._store_answer(query, query_emb, generation, result, scope)
+        yield "result", {**result, "cached": False}
+
+    @staticmethod
+    def _source_section(chunk):
+        meta = chunk["metadata"]
+        return {
+            "section": f"Section {meta.get('chunk_id', '?')}",
+            "content": chunk["text"],
+            "doc_id": meta.get("doc_id"),
+            "page": meta.get("page"),
+            "relevance_score": chunk.get("relevance_score"),
+        }
+
+    def _build_prompt(self, query: str, relevant_chunks):
+        """Build the analysis prompt from the question and the retrieved chunks.
+
+        Returns (prompt, the chunks that fit the context token budget). Counts tokens, so it
+        runs on the query executor.
+        """
+        with span("prompt_build"):
+            document_content, packed_chunks = self.context_builder.build(relevant_chunks)
 
-            # Step 3: Build the analysis prompt
-            analysis_prompt = f"""
+        prompt = f"""
 {FLEXIBLE_QUERY_PROMPT}
 
 User Question: {query}
@@ -177,51 +473,133 @@ Do not focus only on exclusions - always look for the actual coverage informatio
 
 Please analyze the document content and provide a comprehensive, detailed answer to the user's question. Remember to be extremely thorough and provide maximum context and explanation.
 """
+        return prompt, packed_chunks
 
-            # Step 4: Get LLM response
-            llm_response = self._call_llm(analysis_prompt)
+    def _parse_llm_response(self, llm_response):
+        """Turn raw LLM output into the response dict. Returns (result, whether it may be cached)."""
+        try:
+            result = json.loads(llm_response)
 
-            if not llm_response:
-                return {
-                    "answer": "I apologize, but I encountered an error while processing your question. This could be due to a temporary issue with the language model service, network connectivity problems, or an issue with the API configuration.",
-                    "confidence": "low",
+            # Validate response structure and enhance if needed
+            if "answer" not in result:
+                result = {
+                    "answer": f"The system processed your question but returned an unexpected format. Here's what was found: {llm_response}",
+                    "confidence": "medium",
                     "source_sections": [],
-                    "additional_info": "Here are some steps you can try: 1) Wait a moment and try your question again, 2) Check if your API keys are properly configured in the .env file, 3) Verify that you have sufficient API credits or quota remaining, 4) Try asking a simpler question first to test the system, 5) If the problem persists, you may need to restart the server or check the server logs for more detailed error information. The system is designed to be robust, so temporary issues usually resolve quickly."
+                    "additional_info": "The response format was not as expected, but the system did process your query. This might indicate that the language model returned a different format than anticipated. The answer above contains the raw response from the analysis. If this doesn't fully address your question, try rephrasing it or asking a more specific question."
                 }
 
+            # Enhance the response with additional context if it's too brief
+            if len(result.get("answer", "")) < 100:
+                result["additional_info"] = result.get("additional_info", "") + " Note: The answer provided is quite brief. This might indicate that the specific information you're looking for is not extensively covered in the document, or it might be mentioned only in passing. Consider asking follow-up questions or checking related topics in the document."
+
+            return result, True
+
+        except json.JSONDecodeError:
+            # If LLM didn't return valid JSON, wrap the response with detailed explanation
+            return {
+                "answer": f"The system analyzed your question and found relevant information, but encountered a formatting issue. Here's the analysis result: {llm_response}",
+                "confidence": "medium",
+                "source_sections": [],
+                "additional_info": "The language model provided an answer but it wasn't in the expected JSON format. This sometimes happens when the model provides a natural language response instead of structured data. The answer above contains the raw response from the analysis. While this might not be as structured as usual, it should still contain relevant information to help answer your question. If you need more specific details, try asking follow-up questions or rephrasing your original question."
+            }, False
+
+    async def _answer_uncached(self, query: str, query_emb=None, scope=None):
+        """Run retrieval and the LLM. Returns (result, whether the result may be cached)."""
+        try:
+            # Step 1: Retrieve relevant document content
+            relevant_chunks = await self._run_cpu(self._retrieve_relevant_content, query, query_emb=query_emb, scope=scope)
+        except Exception as e:
+            logger.error(f"Error in answer_query: {e}")
+            return unexpected_error_response(e), False
+        return await self._answer_with_chunks(query, relevant_chunks)
+
+    async def _answer_with_chunks(self, query: str, relevant_chunks):
+        """Prompt the LLM with already retrieved chunks. Returns (result, whether the result may be cached)."""
+        try:
+            if not relevant_chunks:
+                return dict(NO_CONTENT_RESPONSE), False
+
+            # Step 2-3: Prepare document content and build the analysis prompt
+            analysis_prompt, _ = await self._run_cpu(self._build_prompt, query, relevant_chunks)
+
+            # Step 4: Get LLM response
+            llm_response = await self._call_llm(analysis_prompt)
+
+            if not llm_response:
+                return dict(LLM_ERROR_RESPONSE), False
+
             # Step 5: Parse the response
-            try:
-                result = json.loads(llm_response)
-
-                # Validate response structure and enhance if needed
-                if "answer" not in result:
-                    result = {
-                        "answer": f"The system processed your question but returned an unexpected format. Here's what was found: {llm_response}",
-                        "confidence": "medium",
-                        "source_sections": [],
-                        "additional_info": "The response format was not as expected, but the system did process your query. This might indicate that the language model returned a different format than anticipated. The answer above contains the raw response from the analysis. If this doesn't fully address your question, try rephrasing it or asking a more specific question."
-                    }
-
-                # Enhance the response with additional context if it's too brief
-                if len(result.get("answer", "")) < 100:
-                    result["additional_info"] = result.get("additional_info", "") + " Note: The answer provided is quite brief. This might indicate that the specific information you're looking for is not extensively covered in the document, or it might be mentioned only in passing. Consider asking follow-up questions or checking related topics in the document."
-
-                return result
-
-            except json.JSONDecodeError:
-                # If LLM didn't return valid JSON, wrap the response with detailed explanation
-                return {
-                    "answer": f"The system analyzed your question and found relevant information, but encountered a formatting issue. Here's the analysis result: {llm_response}",
-                    "confidence": "medium",
-                    "source_sections": [],
-                    "additional_info": "The language model provided an answer but it wasn't in the expected JSON format. This sometimes happens when the model provides a natural language response instead of structured data. The answer above contains the raw response from the analysis. While this might not be as structured as usual, it should still contain relevant information to help answer your question. If you need more specific details, try asking follow-up questions or rephrasing your original question."
-                }
+            with span("json_parse"):
+                return self._parse_llm_response(llm_response)
 
         except Exception as e:
             logger.error(f"Error in answer_query: {e}")
-            return {
-                "answer": f"An unexpected error occurred while processing your question: {str(e)}. This is not typical and indicates a system issue that needs attention.",
-                "confidence": "low",
-                "source_sections": [],
-                "additional_info": "This error suggests there might be an issue with the system configuration, the document processing, or the language model service. Here are some troubleshooting steps: 1) Check if the document was properly uploaded and processed, 2) Verify that all required services are running correctly, 3) Check the server logs for more detailed error information, 4) Try restarting the server, 5) If the problem persists, there might be an issue with the API configuration or the language model service. Please try again, and if the issue continues, consider checking the system logs or contacting support."
-            }
\ No newline at end of file
+            return unexpected_error_response(e), False
+
+    async def answer_queries(self, queries, doc_id=None, tenant=None):
+        """
+        Answer a batch of questions. All uncached questions are encoded in one model call and
+        searched in one FAISS call; LLM calls run concurrently up to BATCH_LLM_CONCURRENCY.
+        doc_id / tenant scope every question in the batch.
+        Results are returned in input order, each with a "cached" flag.
+        """
+        scope = self._scope(doc_id, tenant)
+        generation = self._generation()
+        results = [None] * len(queries)
+
+        # Identical questions within the batch are answered once.
+        groups = {}
+        for i, query in enumerate(queries):
+            groups.setdefault(normalize_query(query), []).append(i)
+
+        def fill(positions, result, cached):
+            for i in positions:
+                results[i] = {**result, "cached": cached}
+
+        pending = []
+        for positions in groups.values():
+            query = queries[positions[0]]
+            cached = self.answer_cache.get_exact(query, generation, scope) if self.answer_cache is not None else None
+            if cached is not None:
+                fill(positions, cached, True)
+            else:
+                pending.append((query, positions))
+        if not pending:
+            return results
+
+        try:
+            query_embs = await self._run_cpu(self._encode_queries, [query for query, _ in pending])
+        except Exception as e:
+            logger.error(f"Batch query embedding failed: {e}")
+            for _, positions in pending:
+                fill(positions, unexpected_error_response(e), False)
+            return results
+
+        to_answer = []
+        for (query, positions), query_emb in zip(pending, query_embs):
+            cached = self.answer_cache.get_similar(query_emb, generation, scope) if self.answer_cache is not None else None
+            if cached is not None:
+                fill(positions, cached, True)
+            else:
+                to_answer.append((query, positions, query_emb))
+        if not to_answer:
+            return results
+
+        retrieved = await self._run_cpu(
+            self._retrieve_batch, [query for query, _, _ in to_answer], np.stack([emb for _, _, emb in to_answer]), scope
+        )
+        semaphore = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+
+        async def answer_one(query, positions, query_emb, chunks):
+            async with semaphore:
+                result, cacheable = await self._answer_with_chunks(query, chunks)
+            if cacheable:
+                self._store_answer(query, query_emb.reshape(1, -1), generation, result, scope)
+            fill(positions, result, False)
+
+        await asyncio.gather(*[
+            answer_one(query, positions, query_emb, chunks)
+            for (query, positions, query_emb), chunks in zip(to_answer, retrieved)
+        ])
+        return results
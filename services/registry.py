@@ -0,0 +1,175 @@
+"""
+Process-wide registry of shared services.
+
+The SentenceTransformer model and FAISS index are loaded once per worker and shared by
+every router, so documents ingested through /upload-docs are immediately searchable
+through /ask-query.
+
+Service modules (and with them torch, sentence-transformers and faiss) are imported when a
+service is first built, so importing the app stays cheap. STARTUP_MODE decides when that is:
+    eager       at startup, before the server accepts requests (default)
+    background  in a thread started at startup; requests are served meanwhile, and those
+                that need a service wait for it to finish loading
+    lazy        on the first request that needs each service (serverless cold starts)
+"""
+import os
+import threading
+import time
+from utils.logging_utils import get_logger
+
+logger = get_logger("registry")
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+STARTUP_MODE = os.getenv("STARTUP_MODE", "eager")
+
+STARTUP_MODES = ("eager", "background", "lazy")
+
+
+class ServiceRegistry:
+    """Lazily builds and owns the single instance of each service."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._embedding_service = None
+        self._ingestion_service = None
+        self._query_service = None
+        self._ingestion_jobs = None
+        self._warm_thread = None
+        self.state = "cold"  # cold -> warming -> ready (or failed); "lazy" when loaded on demand
+
+    def embedding_service(self):
+        if self._embedding_service is None:
+            with self._lock:
+                if self._embedding_service is None:
+                    from services.embedding_service import EmbeddingService
+
+                    self._embedding_service = EmbeddingService(model_name=EMBEDDING_MODEL)
+                    logger.info(f"Loaded shared embedding service ({EMBEDDING_MODEL})")
+        return self._embedding_service
+
+    def ingestion_service(self):
+        if self._ingestion_service is None:
+            embedding_service = self.embedding_service()
+            with self._lock:
+                if self._ingestion_service is None:
+                    from services.doc_ingestion_service import DocIngestionService
+
+                    self._ingestion_service = DocIngestionService(embedding_service=embedding_service)
+        return self._ingestion_service
+
+    def ingestion_jobs(self):
+        if self._ingestion_jobs is None:
+            ingestion_service = self.ingestion_service()
+            with self._lock:
+                if self._ingestion_jobs is None:
+                    from services.ingestion_jobs import IngestionJobManager
+
+                    jobs = IngestionJobManager(ingestion_service)
+                    jobs.start()
+                    self._ingestion_jobs = jobs
+        return self._ingestion_jobs
+
+    def query_service(self):
+        if self._query_service is None:
+            embedding_service = self.embedding_service()
+            content_store = self.ingestion_service().content_store
+            with self._lock:
+                if self._query_service is None:
+                    from services.query_reasoning_service import QueryReasoningService
+
+                    self._query_service = QueryReasoningService(embedding_service=embedding_service, content_store=content_store)
+        return self._query_service
+
+    def _services(self):
+        return {
+            "embedding": self._embedding_service,
+            "ingestion": self._ingestion_service,
+            "ingestion_jobs": self._ingestion_jobs,
+            "query": self._query_service,
+        }
+
+    def loaded(self):
+        """Names of the services built so far."""
+        return [name for name, service in self._services().items() if service is not None]
+
+    def built(self, name):
+        """The named service if it has been built, else None. Never builds it."""
+        return self._services()[name]
+
+    def current_state(self):
+        """state, except that lazily loaded services report "ready" once every one has been built."""
+        if self.state == "lazy" and len(self.loaded()) == 4:
+            return "ready"
+        return self.state
+
+    def warm(self):
+        """Build every service (model, index, ingestion workers) so no request pays for it."""
+        self.state = "warming"
+        start = time.perf_counter()
+        try:
+            self.embedding_service()
+            self.ingestion_service()
+            self.ingestion_jobs()
+            self.query_service()
+        except Exception:
+            self.state = "failed"
+            raise
+        self.state = "ready"
+        logger.info(f"Services ready in {time.perf_counter() - start:.2f}s")
+
+    def startup(self, mode=None):
+        """Load services according to STARTUP_MODE (see the module docstring)."""
+        mode = mode or STARTUP_MODE
+        if mode not in STARTUP_MODES:
+            raise ValueError(f"Unknown STARTUP_MODE {mode!r}; expected one of {', '.join(STARTUP_MODES)}")
+        if mode == "eager":
+            self.warm()
+        elif mode == "lazy":
+            self.state = "lazy"
+        else:
+            self._warm_thread = threading.Thread(target=self._warm_in_background, name="registry-warm", daemon=True)
+            self._warm_thread.start()
+
+    def _warm_in_background(self):
+        try:
+            self.warm()
+        except Exception as e:
+            logger.error(f"Background warm-up failed; services load on first use instead: {e!r}")
+
+    def shutdown(self):
+        """Wait for background ingestion and index work and drop the shared services."""
+        if self._warm_thread is not None:
+            self._warm_thread.join()
+            self._warm_thread = None
+        if self._ingestion_jobs is not None:
+            self._ingestion_jobs.shutdown()
+        if self._query_service is not None:
+            self._query_service.close()
+        if self._embedding_service is not None:
+            self._embedding_service.close()
+        with self._lock:
+            self._query_service = None
+            self._ingestion_jobs = None
+            self._ingestion_service = None
+            self._embedding_service = None
+            self.state = "cold"
+        logger.info("Service registry shut down")
+
+
+registry = ServiceRegistry()
+
+
+def get_embedding_service():
+    return registry.embedding_service()
+
+
+def get_ingestion_service():
+    return registry.ingestion_service()
+
+
+def get_ingestion_jobs():
+    return registry.ingestion_jobs()
+
+
+def get_query_service():
+    return registry.query_service()
@@ -0,0 +1,89 @@
+"""
+Cross-encoder reranking of retrieved chunks.
+
+A small local cross-encoder reads the question and each candidate chunk together and
+scores their relevance, which ranks far more precisely than vector distance or keyword
+matches. Retrieval can then hand the LLM the best few chunks instead of 25+. Pairs are
+scored in batches on CPU, and scores are cached by (question, chunk text) so repeated
+and batch questions only score new pairs.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from services.answer_cache import normalize_query
+from services.content_store import text_sha256
+from utils.logging_utils import get_logger
+
+logger = get_logger("reranker")
+
+# Rerank retrieved chunks with a cross-encoder; 0 keeps the retrieval order.
+RERANK = os.getenv("RERANK", "0") != "0"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+# Chunks kept after reranking.
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "8"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+# (question, chunk) scores kept in memory; 0 disables the cache.
+RERANK_CACHE_ENTRIES = int(os.getenv("RERANK_CACHE_ENTRIES", "50000"))
+
+
+class Reranker:
+    def __init__(self, model_name=RERANK_MODEL, top_n=RERANK_TOP_N, batch_size=RERANK_BATCH_SIZE, cache_entries=RERANK_CACHE_ENTRIES, model=None):
+        if model is None:
+            from sentence_transformers import CrossEncoder
+
+            model = CrossEncoder(model_name, device="cpu")
+        self.model = model
+        self.model_name = model_name
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.cache_entries = cache_entries
+        self._cache = OrderedDict()  # (normalized question, text hash) -> score
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        logger.info(f"Loaded reranker {model_name} (top {top_n})")
+
+    def scores(self, query, texts):
+        """Cross-encoder relevance of each text to the query (higher is more relevant)."""
+        question = normalize_query(query)
+        keys = [(question, text_sha256(text)) for text in texts]
+        scores = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                score = self._cache.get(key)
+                if score is not None:
+                    self._cache.move_to_end(key)
+                    scores[i] = score
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            start = time.perf_counter()
+            predicted = self.model.predict([(query, texts[i]) for i in missing], batch_size=self.batch_size, show_progress_bar=False)
+            logger.info(f"Scored {len(missing)} of {len(texts)} chunks in {(time.perf_counter() - start) * 1000:.1f} ms")
+            for i, score in zip(missing, predicted):
+                scores[i] = float(score)
+        with self._lock:
+            self._hits += len(texts) - len(missing)
+            self._misses += len(missing)
+            if self.cache_entries > 0:
+                for i in missing:
+                    self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query, chunks, top_n=None):
+        """Return the top_n chunks by cross-encoder score, best first, each with a rerank_score."""
+        if not chunks:
+            return []
+        scores = self.scores(query, [chunk["text"] for chunk in chunks])
+        ranked = sorted(
+            ({**chunk, "rerank_score": score} for chunk, score in zip(chunks, scores)),
+            key=lambda chunk: chunk["rerank_score"],
+            reverse=True,
+        )
+        return ranked[:top_n or self.top_n]
+
+    def stats(self):
+        with self._lock:
+            return {"model": self.model_name, "top_n": self.top_n, "entries": len(self._cache), "hits": self._hits, "misses": self._misses}
@@ -0,0 +1,27 @@
+import numpy as np
+from services.answer_cache import AnswerCache
+
+def test_exact_and_semantic_hits():
+    cache = AnswerCache(similarity_threshold=0.9)
+    cache.put("What is the grace period?", np.array([1.0, 0.0]), 1, {"answer": "30 days"})
+
+    assert cache.get_exact("what is the  GRACE period", 1) == {"answer": "30 days"}
+    assert cache.get_similar(np.array([0.99, 0.05]), 1) == {"answer": "30 days"}
+    assert cache.get_similar(np.array([0.0, 1.0]), 1) is None
+
+def test_index_change_invalidates_entries():
+    cache = AnswerCache()
+    cache.put("grace period", np.array([1.0, 0.0]), 1, {"answer": "30 days"})
+    assert cache.get_exact("grace period", 2) is None
+
+def test_query_service_cache_can_be_turned_off():
+    from services.query_reasoning_service import QueryReasoningService
+
+    class NoEmbeddings:
+        pass
+
+    default = QueryReasoningService(embedding_service=NoEmbeddings())
+    disabled = QueryReasoningService(embedding_service=NoEmbeddings(), answer_cache=False)
+    assert isinstance(default.answer_cache, AnswerCache) and disabled.answer_cache is None
+    default.close()
+    disabled.close()
@@ -0,0 +1,14 @@
+from benchmarks.suite import compare_reports, summarize
+
+def _report(throughput, p99, rss):
+    stage = summarize([0.001, 0.002], 2, "queries")
+    stage.update(throughput_per_sec=throughput, peak_rss_mb=rss)
+    stage["latency_ms"]["p99"] = p99
+    return {"stages": {"search": stage}}
+
+def test_compare_flags_only_metrics_worse_than_threshold():
+    rows = compare_reports(_report(100.0, 2.0, 50.0), _report(80.0, 2.1, 40.0), threshold=0.1)
+    regressed = {metric for _, metric, _, _, _, worse in rows if worse}
+    assert regressed == {"throughput_per_sec"}
+    changes = {metric: change for _, metric, _, _, change, _ in rows}
+    assert changes["throughput_per_sec"] == 0.2 and changes["peak_rss_mb"] == -0.2
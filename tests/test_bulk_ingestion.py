@@ -0,0 +1,83 @@
+import os
+from services.doc_ingestion_service import DocIngestionService
+from services.embedding_service import EmbeddingService
+
+def _eml(path, body):
+    with open(path, "w") as f:
+        f.write(f"Subject: policy\nContent-Type: text/plain\n\n{body}\n")
+    return path
+
+def test_pipeline_ingests_dedups_and_reports(tmp_path):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    files = [
+        _eml(str(tmp_path / "a.eml"), "The grace period for premium payment is thirty days."),
+        _eml(str(tmp_path / "b.eml"), "Room rent is capped at one percent of the sum insured."),
+        _eml(str(tmp_path / "copy.eml"), "The grace period for premium payment is thirty days."),
+        _eml(str(tmp_path / "empty.eml"), ""),
+    ]
+    report = ingestion.ingest_many([(path, os.path.basename(path)) for path in files], parse_workers=2)
+
+    statuses = [result["status"] for result in report["results"]]
+    assert statuses == ["ingested", "ingested", "duplicate", "failed"]
+    assert report["results"][2]["doc_id"] == report["results"][0]["doc_id"]
+    assert report["chunks"] == report["chunks_embedded"] == 2 and report["docs_per_sec"] > 0
+    doc_id = report["results"][1]["doc_id"]
+    assert ingestion.content_store.get_document(doc_id)["filename"] == "b.eml"
+    # Originals are copied into the upload directory unless move_sources is set.
+    assert os.path.exists(files[1]) and f"{doc_id}_b.eml" in os.listdir(str(tmp_path / "uploads"))
+    _, I, rows = embedding_service.search(embedding_service.encode(["Room rent is capped at one percent of the sum insured."]), 1)
+    assert rows[0][0]["doc_id"] == doc_id
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def _live_vectors(embedding_service):
+    return embedding_service.index.ntotal - len(embedding_service.tombstones)
+
+def test_aborted_run_rolls_back_unrecorded_vectors(tmp_path, monkeypatch):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    files = [
+        _eml(str(tmp_path / "a.eml"), "The grace period for premium payment is thirty days."),
+        _eml(str(tmp_path / "b.eml"), "Room rent is capped at one percent of the sum insured."),
+    ]
+    record_document = ingestion.content_store.record_document
+
+    def fail_second(file_hash, doc_id, filename, *args, **kwargs):
+        if filename == "b.eml":
+            raise RuntimeError("disk full")
+        return record_document(file_hash, doc_id, filename, *args, **kwargs)
+
+    monkeypatch.setattr(ingestion.content_store, "record_document", fail_second)
+    try:
+        ingestion.ingest_many([(path, os.path.basename(path)) for path in files], parse_workers=1)
+        assert False, "the run should fail"
+    except RuntimeError:
+        pass
+
+    # Only a.eml was recorded; b.eml's vector and chunk row are gone again.
+    assert _live_vectors(embedding_service) == embedding_service.chunk_store.count() == 1
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def test_concurrent_upload_of_the_same_file_wins(tmp_path, monkeypatch):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    path = _eml(str(tmp_path / "a.eml"), "The grace period for premium payment is thirty days.")
+    add_embeddings = embedding_service.add_embeddings
+    uploaded = []
+
+    def upload_meanwhile(chunks, embeddings):
+        rows = add_embeddings(chunks, embeddings)
+        # A single-file upload of the same file lands between the bulk write and its record.
+        monkeypatch.setattr(embedding_service, "add_embeddings", add_embeddings)
+        uploaded.append(ingestion.ingest_document(path))
+        return rows
+
+    monkeypatch.setattr(embedding_service, "add_embeddings", upload_meanwhile)
+    report = ingestion.ingest_many([(path, "a.eml")], parse_workers=1)
+
+    assert report["results"][0] == {"filename": "a.eml", "status": "duplicate", "doc_id": uploaded[0]}
+    assert _live_vectors(embedding_service) == embedding_service.chunk_store.count() == 1
+    embedding_service.close()
+    ingestion.content_store.close()
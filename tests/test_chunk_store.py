@@ -0,0 +1,44 @@
+import pickle
+from services.chunk_store import ChunkStore
+from services.lexical_index import fts_query, reciprocal_rank_fusion
+
+def _chunk(doc_id, chunk_id, text):
+    return {"doc_id": doc_id, "chunk_id": chunk_id, "text": text, "page": 1}
+
+def test_rows_are_found_by_row_and_by_document(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.db"))
+    store.put_rows(0, [_chunk("doc-a", 0, "Grace period"), _chunk("doc-a", 1, "Exclusions")])
+    store.put_rows(2, [_chunk("doc-b", 0, "Room rent")])
+
+    assert store.get_rows([2, 0, 99]) == {0: _chunk("doc-a", 0, "Grace period"), 2: _chunk("doc-b", 0, "Room rent")}
+    assert store.find("doc-b", 0) == (2, _chunk("doc-b", 0, "Room rent"))
+    assert len(store.find_by_chunk_id(0)) == 2
+    assert store.delete_rows([2, 99]) == 1
+    assert store.count() == 2
+    # Deleted ids are never handed out again.
+    assert store.next_row_id() == 3
+
+def test_legacy_pickle_is_migrated_once(tmp_path):
+    meta_path = tmp_path / "meta.pkl"
+    meta_path.write_bytes(pickle.dumps([_chunk("doc-a", 0, "Grace period"), _chunk("doc-a", 1, "Exclusions")]))
+    store = ChunkStore(str(tmp_path / "chunks.db"))
+    assert store.migrate_pickle(str(meta_path)) == 2
+    assert not meta_path.exists()
+    assert store.migrate_pickle(str(meta_path)) == 0
+    assert store.find("doc-a", 1)[1]["text"] == "Exclusions"
+
+def test_lexical_search_tracks_row_changes(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.db"))
+    store.put_rows(0, [_chunk("doc-a", 0, "Treatment at PPN hospitals is cashless"), _chunk("doc-a", 1, "Clause 3.2.1 waiting periods")])
+    store.put_rows(2, [_chunk("doc-b", 0, "Room rent limits")])
+
+    assert [row for row, _ in store.lexical_search(fts_query("Is a PPN hospital cashless?"), 5)] == [0]
+    assert [row for row, _ in store.lexical_search(fts_query("What does clause 3.2.1 say?"), 5)] == [1]
+    assert store.lexical_search(fts_query("room rent"), 5, row_ids=[0, 1]) == []
+    store.put_rows(0, [_chunk("doc-a", 0, "Replaced text")])
+    store.delete_rows([2])
+    assert store.lexical_search(fts_query("PPN room"), 5) == []
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 4]], k=60)
+    assert [row for row, _ in fused] == [3, 1, 2, 4]
@@ -0,0 +1,34 @@
+from services.content_store import ContentStore, file_sha256, text_sha256
+
+def test_known_file_and_chunks_are_found(tmp_path):
+    doc = tmp_path / "policy.pdf"
+    doc.write_bytes(b"same bytes")
+    store = ContentStore(str(tmp_path / "content.db"))
+    file_hash = file_sha256(str(doc))
+    assert store.find_document(file_hash) is None
+
+    chunk_hash = text_sha256("Grace period of 30 days")
+    store.record_document(file_hash, "doc-1", "policy.pdf", [(0, 7)], {chunk_hash: 7})
+
+    assert store.find_document(file_hash) == "doc-1"
+    assert store.find_chunk_rows([chunk_hash, text_sha256("unseen")]) == {chunk_hash: 7}
+    assert store.document_rows("doc-1") == [7]
+
+def test_scope_sees_documents_recorded_after_their_vectors(tmp_path):
+    from services.embedding_service import EmbeddingService
+    from services.query_reasoning_service import QueryReasoningService
+
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    store = ContentStore(str(tmp_path / "content.db"))
+    service = QueryReasoningService(embedding_service=embedding_service, content_store=store, answer_cache=False)
+    rows = embedding_service.embed_chunks([{"text": "Grace period of 30 days", "metadata": {"doc_id": "doc-1", "chunk_id": 0}}])
+    # A question lands between the vectors being written and the document being recorded.
+    assert service._scope_rows((None, "acme"))[0].tolist() == []
+
+    version = store.version()
+    store.record_document("acme/hash", "doc-1", "policy.pdf", [(0, rows[0])], {text_sha256("Grace period of 30 days"): rows[0]}, tenant="acme")
+    assert store.version() == version + 1
+    assert service._scope_rows((None, "acme"))[0].tolist() == rows
+    service.close()
+    embedding_service.close()
+    store.close()
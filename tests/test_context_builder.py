@@ -0,0 +1,33 @@
+from services.context_builder import ContextBuilder, count_tokens, overlap_length
+from utils.text_splitter import semantic_chunk
+
+TEXT = " ".join(f"clause {i} pays claim type {i} after a waiting period of {i} months" for i in range(40))
+
+def _chunks(doc_id="doc-a"):
+    chunks = semantic_chunk(TEXT, chunk_size=200, chunk_overlap=60)
+    for chunk in chunks:
+        chunk["metadata"]["doc_id"] = doc_id
+    return chunks
+
+def test_adjacent_chunks_merge_without_repeating_overlap():
+    chunks = _chunks()
+    assert overlap_length(chunks[0]["text"], chunks[1]["text"]) > 0
+    sections, packed = ContextBuilder(token_budget=10_000).pack([chunks[2], chunks[0], chunks[1]])
+    assert len(packed) == 3
+    assert len(sections) == 1
+    assert sections[0]["chunk_ids"] == [0, 1, 2]
+    assert TEXT.startswith(sections[0]["text"])
+
+def test_budget_keeps_best_chunks_first():
+    chunks = _chunks()
+    ranked = [chunks[10], chunks[3], chunks[7], chunks[1]]
+    budget = count_tokens(chunks[10]["text"]) + count_tokens(chunks[3]["text"]) + 20
+    sections, packed = ContextBuilder(token_budget=budget).pack(ranked)
+    assert packed == [chunks[10], chunks[3]]
+    assert [section["chunk_ids"] for section in sections] == [[10], [3]]
+    # The best chunk is kept even when it alone is over budget.
+    assert ContextBuilder(token_budget=1).pack(ranked)[1] == [chunks[10]]
+
+def test_same_chunk_ids_in_different_documents_stay_separate():
+    sections, _ = ContextBuilder(token_budget=10_000).pack([_chunks("doc-a")[0], _chunks("doc-b")[1]])
+    assert [(section["doc_id"], section["chunk_ids"]) for section in sections] == [("doc-a", [0]), ("doc-b", [1])]
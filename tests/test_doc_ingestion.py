@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from services import doc_ingestion_service
+from services.doc_ingestion_service import DocIngestionService
+from services.embedding_service import EmbeddingService
+from services.ingestion_jobs import IngestionJobManager
+from utils.locks import file_lock
+
+def test_failed_ingest_rolls_back_written_batches(tmp_path, monkeypatch):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    kept = tmp_path / "kept.eml"
+    kept.write_text("Subject: policy\nContent-Type: text/plain\n\nThe grace period is thirty days.\n")
+    assert ingestion.ingest_document(str(kept))
+    ntotal, rows = embedding_service.index.ntotal - len(embedding_service.tombstones), embedding_service.chunk_store.count()
+
+    def pages(file_path, ext, progress):
+        yield 1, "Room rent is capped at one percent of the sum insured."
+        yield 2, "Cataract surgery is covered after two years."
+        raise RuntimeError("page 3 is corrupt")
+
+    # One chunk per batch, so pages 1 and 2 are written before page 3 fails.
+    monkeypatch.setattr(doc_ingestion_service, "EMBED_BATCH_CHUNKS", 1)
+    monkeypatch.setattr(ingestion, "_iter_pages", pages)
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not parsed")
+    with pytest.raises(RuntimeError):
+        ingestion.ingest_document(str(broken))
+
+    assert embedding_service.index.ntotal - len(embedding_service.tombstones) == ntotal
+    assert embedding_service.chunk_store.count() == rows
+    _, _, hits = embedding_service.search(embedding_service.encode(["Room rent is capped"]), 5)
+    assert {hit["filename"] for hit in hits[0] if hit} == {"kept.eml"}
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def test_tenants_do_not_share_chunk_vectors(tmp_path):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    path = tmp_path / "policy.eml"
+    path.write_text("Subject: policy\nContent-Type: text/plain\n\nThe grace period is thirty days.\n")
+    doc_a = ingestion.ingest_document(str(path), filename="a.eml", tenant="a")
+    doc_b = ingestion.ingest_document(str(path), filename="b.eml", tenant="b")
+
+    assert set(ingestion.content_store.document_rows(doc_a)).isdisjoint(ingestion.content_store.document_rows(doc_b))
+    _, _, hits = embedding_service.search(embedding_service.encode(["The grace period is thirty days."]), 2)
+    assert {(hit["doc_id"], hit["tenant"]) for hit in hits[0]} == {(doc_a, "a"), (doc_b, "b")}
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def test_ingest_waits_for_a_delete_in_another_worker(tmp_path):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    path = tmp_path / "policy.eml"
+    path.write_text("Subject: policy\nContent-Type: text/plain\n\nThe grace period is thirty days.\n")
+    done = threading.Event()
+    # Another worker process deleting a document holds the documents lock exclusively.
+    with file_lock(str(tmp_path / "index" / "locks" / "documents.lock")):
+        thread = threading.Thread(target=lambda: (ingestion.ingest_document(str(path)), done.set()))
+        thread.start()
+        assert not done.wait(0.5)
+    thread.join(10)
+    assert done.is_set()
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def test_job_recovered_after_a_crash_discards_what_the_crashed_run_wrote(tmp_path, monkeypatch):
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploads"), embedding_service=embedding_service)
+    jobs = IngestionJobManager(ingestion, jobs_dir=str(tmp_path / "jobs"), workers=1)
+    path = jobs.incoming_path("job-1", ".pdf")
+    with open(path, "wb") as f:
+        f.write(b"not parsed")
+    jobs.submit("job-1", path, "policy.pdf")
+
+    def pages(file_path, ext, progress):
+        yield 1, "Room rent is capped at one percent of the sum insured."
+        yield 2, "Cataract surgery is covered after two years."
+        raise SystemExit("worker killed")  # Not an Exception: nothing gets to roll back
+
+    with monkeypatch.context() as patch:
+        patch.setattr(doc_ingestion_service, "EMBED_BATCH_CHUNKS", 1)
+        patch.setattr(ingestion, "_iter_pages", pages)
+        with pytest.raises(SystemExit):
+            jobs._run("job-1")
+    pending_doc_id = jobs.get("job-1")["pending_doc_id"]
+    orphans = embedding_service.chunk_store.doc_row_ids(pending_doc_id)
+    assert orphans and ingestion.content_store.get_document(pending_doc_id) is None
+    jobs.shutdown()
+
+    def pages_again(file_path, ext, progress):
+        yield 1, "Room rent is capped at one percent of the sum insured."
+        yield 2, "Cataract surgery is covered after two years."
+
+    monkeypatch.setattr(ingestion, "_iter_pages", pages_again)
+    restarted = IngestionJobManager(ingestion, jobs_dir=str(tmp_path / "jobs"), workers=1)
+    restarted.start()
+    deadline = time.time() + 10
+    while restarted.get("job-1")["status"] not in ("succeeded", "failed") and time.time() < deadline:
+        time.sleep(0.01)
+    restarted.shutdown()
+
+    assert restarted.get("job-1")["doc_id"] == pending_doc_id
+    rows = ingestion.content_store.document_rows(pending_doc_id)
+    assert set(orphans).isdisjoint(rows)
+    # Only the recorded document's vectors are left.
+    assert embedding_service.index.ntotal - len(embedding_service.tombstones) == embedding_service.chunk_store.count() == len(rows)
+    embedding_service.close()
+    ingestion.content_store.close()
@@ -1,6 +1,117 @@
+import numpy as np
 from services.embedding_service import EmbeddingService
+from services.embedding_cache import EmbeddingCache
+from services.embedding_engine import EmbeddingEngine
 
-def test_embeddings_stub():
-    service = EmbeddingService()
+def test_embeddings_stub(tmp_path):
+    service = EmbeddingService(index_path=str(tmp_path / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
     # Should have index loaded or empty
-    assert service.index is not None or service.metadata == []
\ No newline at end of file
+    assert service.index is not None or service.chunk_store.count() == 0
+    service.close()
+
+def test_embedding_cache_hits_and_model_invalidation(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = EmbeddingCache("model-a", db_path)
+    cache.put_many(["grace period"], np.ones((1, 4), dtype=np.float32))
+    cache.close()
+
+    cache = EmbeddingCache("model-a", db_path)
+    found, missing = cache.get_many(["grace period", "room rent"])
+    assert missing == [1]
+    assert np.allclose(found[0], 1.0)
+    assert cache.stats()["disk_hits"] == 1
+    cache.close()
+
+    cache = EmbeddingCache("model-b", db_path)
+    found, missing = cache.get_many(["grace period"])
+    assert found == {} and missing == [0]
+
+def test_embedding_cache_is_namespaced_by_backend(tmp_path):
+    index_path = str(tmp_path / "index.bin")
+    service = EmbeddingService(index_path=index_path, meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    service.encode(["grace period"])
+    service.close()
+
+    engine = EmbeddingEngine("sentence-transformers/all-MiniLM-L6-v2")
+    engine.backend = "torch-int8"
+    service = EmbeddingService(index_path=index_path, meta_path=str(tmp_path / "meta.pkl"), engine=engine, refresh_seconds=0)
+    found, missing = service.embedding_cache.get_many(["grace period"])
+    assert found == {} and missing == [0]
+    service.close()
+
+def test_engine_matches_single_encode_call():
+    engine = EmbeddingEngine("sentence-transformers/all-MiniLM-L6-v2", batch_size=2)
+    texts = ["grace period", "a much longer clause about pre-existing disease waiting periods", "room rent", "co-pay"]
+    expected = np.asarray(engine.model.encode(texts, show_progress_bar=False), dtype=np.float32)
+    vectors = engine.encode(texts)
+    assert vectors.shape == expected.shape
+    assert np.allclose(vectors, expected, atol=1e-5)
+    assert engine.stats()["batches"] == 2
+
+def test_deleted_rows_never_come_back(tmp_path):
+    index_path = str(tmp_path / "index.bin")
+    chunks = [{"text": text, "metadata": {"doc_id": "doc-a", "chunk_id": i}} for i, text in enumerate(["grace period", "room rent", "co-pay"])]
+    service = EmbeddingService(index_path=index_path, meta_path=str(tmp_path / "meta.pkl"))
+    ids = service.embed_chunks(chunks)
+    assert service.delete_rows([ids[1]]) == 1
+    _, I, rows = service.search(service.encode(["room rent"]), 3)
+    assert ids[1] not in I[0] and all(row is None or row["text"] != "room rent" for row in rows[0])
+    service.close()
+
+    reloaded = EmbeddingService(index_path=index_path, meta_path=str(tmp_path / "meta.pkl"))
+    assert reloaded.index.ntotal == 2
+    assert reloaded.embed_chunks(chunks[1:2]) == [ids[-1] + 1]
+    reloaded.close()
+
+def test_scoped_search_only_returns_scope(tmp_path):
+    service = EmbeddingService(index_path=str(tmp_path / "index.bin"), meta_path=str(tmp_path / "meta.pkl"))
+    texts = ["grace period", "room rent", "co-pay", "cataract waiting period"]
+    ids = service.embed_chunks([{"text": t, "metadata": {"doc_id": "doc-a" if i < 2 else "doc-b", "chunk_id": i}} for i, t in enumerate(texts)])
+    _, I, rows = service.search(service.encode(["grace period"]), 3, ids=ids[2:])
+    assert sorted(I[0][:2].tolist()) == ids[2:] and I[0][2] == -1
+    assert {row["doc_id"] for row in rows[0] if row} == {"doc-b"}
+    _, I, _ = service.search(service.encode(["grace period"]), 3, ids=[])
+    assert (I == -1).all()
+    service.close()
+
+def test_workers_share_index_and_follow_compaction(tmp_path):
+    paths = {"index_path": str(tmp_path / "index.bin"), "meta_path": str(tmp_path / "meta.pkl"), "refresh_seconds": 0}
+    writer, reader = EmbeddingService(**paths), EmbeddingService(**paths)
+    first = writer.embed_chunks([{"text": t, "metadata": {"doc_id": "doc-a", "chunk_id": i}} for i, t in enumerate(["grace period", "room rent"])])
+    assert reader.search(reader.encode(["room rent"]), 1) is None
+    assert reader.refresh() and not reader.refresh()
+    _, I, rows = reader.search(reader.encode(["room rent"]), 1)
+    assert I[0][0] == first[1] and rows[0][0]["chunk_id"] == 1
+
+    # Ids keep increasing whichever worker writes next.
+    second = reader.embed_chunks([{"text": "co-pay", "metadata": {"doc_id": "doc-b", "chunk_id": 0}}])
+    assert second == [first[-1] + 1]
+
+    writer.save_index()
+    assert writer.index.base is not None and writer.index.delta.ntotal == 0
+    reader.delete_rows(first[:1])
+    writer.refresh()
+    assert writer.tombstones == {first[0]}
+    _, I, _ = writer.search(writer.encode(["grace period"]), 3)
+    assert sorted(I[0][:2].tolist()) == [first[1], second[0]] and I[0][2] == -1
+    writer.close()
+    reader.close()
+
+def test_legacy_metadata_waits_for_its_index(tmp_path):
+    import faiss
+    import pickle
+
+    meta_path = tmp_path / "meta.pkl"
+    meta_path.write_bytes(pickle.dumps([{"text": "grace period", "chunk_id": 0}, {"text": "room rent", "chunk_id": 1}]))
+    service = EmbeddingService(index_path=str(tmp_path / "index.bin"), meta_path=str(meta_path), refresh_seconds=0)
+    # Without index.bin every row would be an orphan: the pickle is left as it is.
+    assert service.chunk_store.count() == 0 and meta_path.exists()
+    service.close()
+
+    base = faiss.IndexFlatL2(4)
+    base.add(np.ones((2, 4), dtype=np.float32))
+    faiss.write_index(base, str(tmp_path / "index.bin"))
+    service = EmbeddingService(index_path=str(tmp_path / "index.bin"), meta_path=str(meta_path), refresh_seconds=0)
+    assert service.chunk_store.count() == 2 and not meta_path.exists()
+    assert service.chunk_store.get_rows([1])[1]["text"] == "room rent"
+    service.close()
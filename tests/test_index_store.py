@@ -0,0 +1,107 @@
+import os
+import sys
+import threading
+import faiss
+import numpy as np
+from services import index_factory
+from services.embedding_service import EmbeddingService
+from services.index_factory import IndexConfig, create_empty_index, has_stable_ids, index_kind, stored_ids
+from services.index_store import SegmentedIndexStore
+from utils.file_utils import atomic_write
+
+def _vectors(n, dim=8, seed=0):
+    return np.random.default_rng(seed).random((n, dim), dtype=np.float32)
+
+def _new_index(dim):
+    return create_empty_index(dim, IndexConfig())
+
+def _load(tmp_path):
+    return EmbeddingService(index_path=str(tmp_path / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+
+def test_segments_replay_on_load(tmp_path):
+    store = SegmentedIndexStore(str(tmp_path / "index.bin"))
+    store.append_segment(np.arange(3), _vectors(3))
+    store.append_segment(np.arange(3, 5), _vectors(2, seed=1))
+
+    service = _load(tmp_path)
+    assert service.index.ntotal == 5
+    service.close()
+
+def test_compacted_segments_are_not_replayed_twice(tmp_path):
+    store = SegmentedIndexStore(str(tmp_path / "index.bin"))
+    vectors = _vectors(4)
+    store.append_segment(np.arange(4), vectors)
+    index = _new_index(8)
+    index.add_with_ids(vectors, np.arange(4))
+    # Base written but the process died before the segment was dropped.
+    store.write_base(faiss.serialize_index(index))
+
+    service = _load(tmp_path)
+    assert service.index.ntotal == 4
+    service.close()
+
+def test_deletes_replay_and_positional_base_keeps_row_ids(tmp_path):
+    store = SegmentedIndexStore(str(tmp_path / "index.bin"))
+    legacy = faiss.IndexFlatL2(8)
+    legacy.add(_vectors(3))
+    store.write_base(faiss.serialize_index(legacy))
+    store.append_segment(np.arange(3, 5), _vectors(2, seed=1))
+    store.append_deletes(np.array([1, 3]))
+
+    service = _load(tmp_path)
+    assert sorted(set(service.index.stored_ids().tolist()) - service.tombstones) == [0, 2, 4]
+    _, I = service.index.search(_vectors(3)[1:2], 3)
+    assert 1 not in I[0]
+    service.close()
+
+def test_migration_is_published_to_running_workers(tmp_path, monkeypatch):
+    store = SegmentedIndexStore(str(tmp_path / "index.bin"))
+    store.append_segment(np.arange(4), _vectors(4))
+    worker = _load(tmp_path)
+
+    monkeypatch.setattr(sys, "argv", ["index_factory", "--type", "hnsw", "--index-path", str(tmp_path / "index.bin"), "--meta-path", str(tmp_path / "meta.pkl")])
+    index_factory.main()
+
+    assert store.list_segments() == []
+    assert worker.refresh() and index_kind(worker.index.base) == "hnsw" and worker.index.ntotal == 4
+    worker.close()
+
+def test_positional_base_is_converted_before_it_is_mapped(tmp_path):
+    vectors = _vectors(64)
+    quantizer = faiss.IndexFlatL2(8)
+    legacy_ivf = faiss.IndexIVFFlat(quantizer, 8, 2)
+    legacy_ivf.train(vectors)
+    legacy_ivf.add(vectors)
+    legacy_flat = faiss.IndexFlatL2(8)
+    legacy_flat.add(vectors)
+    for name, legacy in (("flat", legacy_flat), ("ivf", legacy_ivf)):
+        store = SegmentedIndexStore(str(tmp_path / name / "index.bin"))
+        store.write_base(faiss.serialize_index(legacy))
+
+        base = store.read_base(mmap=True)
+        assert sorted(stored_ids(base).tolist()) == list(range(64))
+        # Reading converts in memory only; the file is rewritten under the exclusive lock.
+        assert not has_stable_ids(faiss.read_index(store.index_path))
+        assert store.upgrade_base() and not store.upgrade_base()
+        assert SegmentedIndexStore(str(tmp_path / name / "index.bin")).read_base(mmap=True).ntotal == 64
+
+def test_concurrent_atomic_writes_never_tear(tmp_path):
+    path = str(tmp_path / "index.bin")
+    payloads = [bytes([i]) * (1 << 20) for i in range(8)]
+    errors = []
+
+    def write(payload):
+        try:
+            atomic_write(path, payload)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(payload,)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(path, "rb") as f:
+        assert f.read() in payloads
+    assert os.listdir(tmp_path) == ["index.bin"]
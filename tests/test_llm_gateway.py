@@ -0,0 +1,149 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+import pytest
+import uvicorn
+from benchmarks.stub_llm_server import ANSWER, create_app
+from services import llm_client
+from services.llm_gateway import LLMGateway, RateLimiter
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Start fake providers, e.g. providers(openai=50, openrouter=None) -> {name: app}; latency None fails."""
+    servers = []
+
+    def start(**latencies_ms):
+        apps = {}
+        for name, latency_ms in latencies_ms.items():
+            port = free_port()
+            url = f"http://127.0.0.1:{port}/v1/chat/completions"
+            if latency_ms is not None:
+                apps[name] = create_app(latency_ms=latency_ms)
+                server = uvicorn.Server(uvicorn.Config(apps[name], port=port, log_level="warning"))
+                thread = threading.Thread(target=server.run, daemon=True)
+                thread.start()
+                while not server.started:
+                    time.sleep(0.01)
+                servers.append((server, thread))
+            # latency None: nothing listens on the port, so every call fails.
+            monkeypatch.setitem(llm_client.PROVIDERS, name, {"url": url, "api_key": "test"})
+        return apps
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join()
+
+
+def run(gateway, *prompts):
+    async def main():
+        try:
+            return await asyncio.gather(*(gateway.chat_completion(prompt) for prompt in prompts))
+        finally:
+            await llm_client.close_client()
+    return asyncio.run(main())
+
+
+def test_identical_inflight_calls_share_one_upstream_request(providers):
+    apps = providers(openrouter=200)
+    gateway = LLMGateway(providers=["openrouter"], hedge_min_samples=0)
+
+    answers = run(gateway, *["What is the grace period?"] * 5, "Is room rent capped?")
+
+    assert [json.loads(answer) for answer in answers] == [ANSWER] * 6
+    assert apps["openrouter"].state.requests == 2
+
+
+def test_slow_call_is_hedged_to_the_next_provider(providers):
+    apps = providers(openrouter=3000, openai=50)
+    gateway = LLMGateway(providers=["openrouter", "openai"], hedge_after_ms=100)
+
+    start = time.perf_counter()
+    answer, = run(gateway, "What is the grace period?")
+
+    assert json.loads(answer) == ANSWER
+    assert time.perf_counter() - start < 1.5
+    assert apps["openrouter"].state.requests == 1
+    assert apps["openai"].state.requests == 1
+
+
+def test_failed_provider_fails_over(providers):
+    apps = providers(openrouter=None, openai=50)
+    gateway = LLMGateway(providers=["openrouter", "openai"], hedge_min_samples=0)
+
+    answer, = run(gateway, "What is the grace period?")
+
+    assert json.loads(answer) == ANSWER
+    assert apps["openai"].state.requests == 1
+
+
+def test_rate_limited_provider_spills_to_the_next(providers):
+    apps = providers(openrouter=50, openai=50)
+    gateway = LLMGateway(providers=["openrouter", "openai"], rate_limits={"openrouter": 1}, hedge_min_samples=0)
+
+    run(gateway, "first question", "second question")
+
+    assert apps["openrouter"].state.requests == 1
+    assert apps["openai"].state.requests == 1
+
+
+def test_rate_limiter_paces_reservations():
+    limiter = RateLimiter(rate=10, burst=2)
+    assert limiter.try_acquire() and limiter.try_acquire()
+    assert not limiter.try_acquire()
+    assert limiter.reserve() == pytest.approx(0.1, abs=0.02)
+    assert limiter.reserve() == pytest.approx(0.2, abs=0.02)
+
+
+def test_hedge_delay_follows_observed_p95():
+    gateway = LLMGateway(providers=["openrouter"], hedge_min_samples=20, hedge_after_ms=0)
+    for ms in range(1, 20):
+        gateway._observe("openrouter", ms / 1000)
+    assert gateway.hedge_delay("openrouter") is None
+    gateway._observe("openrouter", 0.02)
+    assert gateway.hedge_delay("openrouter") == pytest.approx(0.019, abs=0.001)
+
+
+def test_failover_attempt_is_hedged_with_its_own_delay_and_never_back(providers):
+    providers(openrouter=None, openai=400)
+    gateway = LLMGateway(providers=["openrouter", "openai"], hedge_min_samples=20, hedge_after_ms=0)
+    for _ in range(20):
+        # The primary fails long before its own hedge delay; openai is hedged after 100 ms.
+        gateway._observe("openrouter", 5.0)
+        gateway._observe("openai", 0.1)
+    attempts = []
+    attempt = gateway._attempt
+
+    async def recording_attempt(provider, *args):
+        attempts.append(provider)
+        return await attempt(provider, *args)
+
+    gateway._attempt = recording_attempt
+    answer, = run(gateway, "What is the grace period?")
+
+    assert json.loads(answer) == ANSWER
+    # The failed primary is not hedged back to; the slow failover is hedged to itself.
+    assert attempts == ["openrouter", "openai", "openai"]
+
+
+def test_hedge_that_loses_early_is_not_a_latency_sample(providers):
+    providers(openrouter=300, openai=1000)
+    gateway = LLMGateway(providers=["openrouter", "openai"], hedge_min_samples=20, hedge_after_ms=0)
+    for _ in range(20):
+        gateway._observe("openrouter", 0.05)
+        gateway._observe("openai", 1.0)
+
+    run(gateway, "What is the grace period?")
+
+    # openai was cancelled ~250 ms in, well before its own p95: its window is unchanged.
+    assert list(gateway._latencies["openai"]) == [1.0] * 20
+    assert len(gateway._latencies["openrouter"]) == 21
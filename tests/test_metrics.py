@@ -0,0 +1,44 @@
+from utils.metrics import Counter, Gauge, Histogram, MetricsRegistry, timed_iter
+
+def test_histogram_counter_and_gauge_exposition():
+    registry = MetricsRegistry()
+    latency = registry.register(Histogram("stage_seconds", "Stage time.", ["stage"], buckets=(0.1, 1.0)))
+    tokens = registry.register(Counter("tokens_total", "Tokens.", ["kind"]))
+    generation = registry.register(Gauge("generation", "Generation."))
+    latency.observe(0.05, stage="search")
+    latency.observe(0.5, stage="search")
+    latency.observe(5.0, stage="search")
+    tokens.inc(10, kind="prompt")
+    tokens.inc(5, kind="prompt")
+    generation.set(3)
+    generation.set(4)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE stage_seconds histogram" in lines
+    assert 'stage_seconds_bucket{stage="search",le="0.1"} 1' in lines
+    assert 'stage_seconds_bucket{stage="search",le="1.0"} 2' in lines
+    assert 'stage_seconds_bucket{stage="search",le="+Inf"} 3' in lines
+    assert 'stage_seconds_count{stage="search"} 3' in lines
+    assert 'stage_seconds_sum{stage="search"} 5.55' in lines
+    assert 'tokens_total{kind="prompt"} 15' in lines
+    assert "# TYPE generation gauge" in lines and "generation 4" in lines
+
+def test_timed_iter_sums_time_per_stage():
+    seconds = {}
+    assert list(timed_iter(range(3), seconds, "parse")) == [0, 1, 2]
+    assert seconds["parse"] >= 0
+
+def test_scrape_in_lazy_mode_loads_nothing(monkeypatch):
+    from fastapi.testclient import TestClient
+    from main import app
+    from routes import metrics
+    from services.registry import ServiceRegistry
+
+    lazy = ServiceRegistry()
+    lazy.startup("lazy")
+    monkeypatch.setattr(metrics, "registry", lazy)
+    response = TestClient(app).get("/metrics")
+
+    assert response.status_code == 200 and "# TYPE rag_stage_seconds histogram" in response.text
+    assert lazy.loaded() == []
+    assert not any(line.startswith(("rag_index_size", "rag_cache_lookups_total{")) for line in response.text.splitlines())
@@ -0,0 +1,38 @@
+import fitz
+from utils import parser_utils, text_splitter
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"Page {i + 1}: premiums are due within thirty days.")
+    doc.save(path)
+    doc.close()
+
+
+def test_parallel_pages_stream_in_order(tmp_path, monkeypatch):
+    pdf_path = str(tmp_path / "policy.pdf")
+    make_pdf(pdf_path, 7)
+    monkeypatch.setattr(parser_utils, "PDF_PARALLEL_MIN_PAGES", 0)
+    serial = list(parser_utils.iter_pdf_pages(pdf_path, workers=1))
+    parallel = list(parser_utils.iter_pdf_pages(pdf_path, workers=2, pages_per_task=2))
+    assert [page_no for page_no, _ in parallel] == list(range(1, 8))
+    assert parallel == serial
+
+
+def test_chunks_carry_page_numbers():
+    pages = [(1, "Section 1: Grace period. " * 40), (2, "Section 2: Exclusions.")]
+    chunks = list(text_splitter.semantic_chunk_pages(pages, chunk_size=200, chunk_overlap=20))
+    assert [c["metadata"]["chunk_id"] for c in chunks] == list(range(len(chunks)))
+    assert chunks[0]["metadata"]["page"] == 1
+    assert chunks[-1]["metadata"]["page"] == 2
+    assert chunks[-1]["text"] == "Section 2: Exclusions."
+
+
+def test_split_text_packs_and_overlaps():
+    text = "premium due within thirty days of the renewal date"
+    chunks = list(text_splitter.split_text(text, chunk_size=20, chunk_overlap=10))
+    assert chunks == ["premium due within", "within thirty days", "days of the renewal", "renewal date"]
+    info = text_splitter.extract_document_info("Clause 4.2: Waiting period of 30 days, limit Rs. 50,000")
+    assert (info["section_type"], info["section_number"]) == ("Clause", "4.2")
+    assert info["currency_amounts"] == ["Rs. 50,000"]
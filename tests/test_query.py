@@ -1,9 +1,28 @@
+import json
+import threading
+import time
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from services.registry import get_query_service
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True, scope="module")
+def query_service(tmp_path_factory):
+    """Serve the questions from an index in a temporary directory, not the app's data directory."""
+    from services.embedding_service import EmbeddingService
+    from services.query_reasoning_service import QueryReasoningService
+
+    index_dir = tmp_path_factory.mktemp("faiss_index")
+    embedding_service = EmbeddingService(index_path=str(index_dir / "index.bin"), meta_path=str(index_dir / "meta.pkl"), refresh_seconds=0)
+    service = QueryReasoningService(embedding_service=embedding_service)
+    app.dependency_overrides[get_query_service] = lambda: service
+    yield service
+    app.dependency_overrides.pop(get_query_service)
+    service.close()
+    embedding_service.close()
+
 def test_flexible_query():
     """Test that the system can handle any type of question flexibly."""
     response = client.post("/ask-query", json={"query": "What is the grace period for premium payment?"})
@@ -31,4 +50,53 @@ def test_general_question():
     response = client.post("/ask-query", json={"query": "What are the main benefits of this policy?"})
     assert response.status_code == 200
     data = response.json()
-    assert "answer" in data or "error" in data
\ No newline at end of file
+    assert "answer" in data or "error" in data
+
+def test_batch_questions_keep_input_order(query_service, monkeypatch):
+    """Test that batch answers come back one per question, in order, with repeats answered once."""
+    prompts = []
+
+    async def call_llm(prompt, model="gpt-3.5-turbo"):
+        prompts.append(prompt)
+        return json.dumps({"answer": f"Answer {len(prompts)}", "confidence": "high", "source_sections": []})
+
+    chunk = {"text": "The grace period is thirty days.", "metadata": {"doc_id": "doc-a", "chunk_id": 0}}
+    monkeypatch.setattr(query_service, "answer_cache", None)
+    monkeypatch.setattr(query_service, "_retrieve_batch", lambda queries, query_embs, scope=None: [[chunk] for _ in queries])
+    monkeypatch.setattr(query_service, "_call_llm", call_llm)
+    queries = ["What is the grace period?", "Is maternity covered?", "what is the grace period"]
+    response = client.post("/ask-query/batch", json={"queries": queries})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == len(queries)
+    # The repeated question shares one LLM call.
+    assert len(prompts) == 2
+    assert "User Question: What is the grace period?" in prompts[0] and "User Question: Is maternity covered?" in prompts[1]
+    assert [r["answer"] for r in results] == ["Answer 1", "Answer 2", "Answer 1"]
+
+def test_prompt_tokens_are_counted_off_the_event_loop(query_service, monkeypatch):
+    """Test that prompt building and token logging run on the query executor."""
+    threads = []
+    build_prompt, log_llm_tokens = query_service._build_prompt, query_service._log_llm_tokens
+
+    def recording(fn):
+        def wrapper(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return fn(*args, **kwargs)
+        return wrapper
+
+    async def chat_completion(prompt, model="gpt-3.5-turbo"):
+        return json.dumps({"answer": "Thirty days.", "confidence": "high", "source_sections": []})
+
+    chunk = {"text": "The grace period is thirty days.", "metadata": {"doc_id": "doc-a", "chunk_id": 0}}
+    monkeypatch.setattr(query_service, "answer_cache", None)
+    monkeypatch.setattr(query_service, "_retrieve_relevant_content", lambda query, query_emb=None, scope=None: [chunk])
+    monkeypatch.setattr(query_service.llm_gateway, "chat_completion", chat_completion)
+    monkeypatch.setattr(query_service, "_build_prompt", recording(build_prompt))
+    monkeypatch.setattr(query_service, "_log_llm_tokens", recording(log_llm_tokens))
+    response = client.post("/ask-query", json={"query": "What is the grace period?"})
+    assert response.json()["answer"] == "Thirty days."
+    deadline = time.time() + 5
+    while len(threads) < 2 and time.time() < deadline:  # Token logging is not waited for
+        time.sleep(0.01)
+    assert len(threads) == 2 and all(name.startswith("query-cpu") for name in threads)
@@ -0,0 +1,28 @@
+from services.reranker import Reranker
+
+class WordOverlapModel:
+    """Scores a pair by shared words, and counts the pairs it was asked to score."""
+    def __init__(self):
+        self.scored = 0
+
+    def predict(self, pairs, batch_size=32, show_progress_bar=False):
+        self.scored += len(pairs)
+        return [len(set(q.lower().split()) & set(d.lower().split())) for q, d in pairs]
+
+def _chunk(text):
+    return {"text": text, "metadata": {}, "relevance_score": 0.5}
+
+def test_rerank_keeps_top_n_and_caches_scores():
+    model = WordOverlapModel()
+    reranker = Reranker("fake", top_n=2, model=model)
+    chunks = [_chunk("room rent is capped"), _chunk("the grace period is thirty days"), _chunk("grace period for premium payment")]
+
+    ranked = reranker.rerank("grace period for premium payment", chunks)
+    assert [chunk["text"] for chunk in ranked] == ["grace period for premium payment", "the grace period is thirty days"]
+    assert ranked[0]["rerank_score"] > ranked[1]["rerank_score"]
+    assert model.scored == 3
+
+    # Same question, differently cased and spaced: every score comes from the cache.
+    reranker.rerank("Grace period  for premium payment?", chunks)
+    assert model.scored == 3
+    assert reranker.stats()["hits"] == 3
@@ -0,0 +1,17 @@
+import subprocess
+import sys
+from services.registry import ServiceRegistry
+
+def test_importing_the_app_defers_heavy_libraries():
+    code = "import sys, main; print(sorted(m for m in ('faiss', 'sentence_transformers', 'torch', 'fitz', 'docx', 'bs4') if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+def test_lazy_services_report_ready_once_loaded():
+    registry = ServiceRegistry()
+    registry.startup("lazy")
+    assert registry.current_state() == "lazy" and registry.loaded() == []
+    registry._embedding_service = registry._ingestion_service = registry._query_service = object()
+    assert registry.current_state() == "lazy" and registry.loaded() == ["embedding", "ingestion", "query"]
+    registry._ingestion_jobs = object()
+    assert registry.current_state() == "ready"
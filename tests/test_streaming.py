@@ -0,0 +1,73 @@
+import asyncio
+import socket
+import threading
+import time
+import numpy as np
+import pytest
+import uvicorn
+from benchmarks.stub_llm_server import ANSWER, create_app
+from services import llm_client
+from services.chunk_store import ChunkStore
+from services.content_store import ContentStore
+from services.query_reasoning_service import QueryReasoningService
+
+
+class FakeEmbeddingService:
+    """Two-chunk index so the test does not need the real model."""
+    generation = 1
+    chunks = [
+        {"text": "A grace period of thirty days is allowed.", "doc_id": "doc-1", "chunk_id": 0},
+        {"text": "Room rent is capped at 1% of the sum insured.", "doc_id": "doc-1", "chunk_id": 1},
+    ]
+
+    def __init__(self):
+        self.chunk_store = ChunkStore(":memory:")
+        self.chunk_store.put_rows(0, self.chunks)
+
+    def encode(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    def search(self, query_embeddings, k):
+        n = len(self.chunks)
+        return np.zeros((1, n)), np.arange(n).reshape(1, -1), [[dict(c) for c in self.chunks]]
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(create_app(latency_ms=100, token_delay_ms=20), port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    monkeypatch.setitem(llm_client.PROVIDERS, "openrouter", {"url": f"http://127.0.0.1:{port}/v1/chat/completions", "api_key": "test"})
+    monkeypatch.setattr(llm_client, "LLM_PROVIDER", "openrouter")
+    yield
+    server.should_exit = True
+    thread.join()
+
+
+def test_stream_sends_sources_before_tokens_and_result_last(stub_llm):
+    service = QueryReasoningService(embedding_service=FakeEmbeddingService(), answer_cache=False, content_store=ContentStore(":memory:"))
+
+    async def collect():
+        events = []
+        start = time.perf_counter()
+        async for event, data in service.stream_answer("What is the grace period?"):
+            events.append((event, data, time.perf_counter() - start))
+        await llm_client.close_client()
+        return events
+
+    events = asyncio.run(collect())
+    names = [name for name, _, _ in events]
+    assert names[0] == "sources"
+    assert names[-1] == "result"
+    assert set(names[1:-1]) == {"token"}
+    assert len(events[0][1]["source_sections"]) == 2
+    assert events[-1][1]["answer"] == ANSWER["answer"]
+
+    first_token_at = events[1][2]
+    total = events[-1][2]
+    assert first_token_at < total / 2
@@ -1,12 +1,32 @@
 import os
 import tempfile
+import time
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from services.ingestion_jobs import IngestionJobManager, QueueFullError
+from services.registry import get_ingestion_jobs
 
 client = TestClient(app)
 
-def test_upload_pdf():
+@pytest.fixture
+def app_jobs(tmp_path):
+    """The app's ingestion jobs, with the index, uploaded documents and job files in tmp_path."""
+    from services.doc_ingestion_service import DocIngestionService
+    from services.embedding_service import EmbeddingService
+
+    embedding_service = EmbeddingService(index_path=str(tmp_path / "faiss_index" / "index.bin"), meta_path=str(tmp_path / "meta.pkl"), refresh_seconds=0)
+    ingestion = DocIngestionService(upload_dir=str(tmp_path / "uploaded_docs"), embedding_service=embedding_service)
+    jobs = IngestionJobManager(ingestion, jobs_dir=str(tmp_path / "jobs"), workers=1)
+    jobs.start()
+    app.dependency_overrides[get_ingestion_jobs] = lambda: jobs
+    yield jobs
+    app.dependency_overrides.pop(get_ingestion_jobs)
+    jobs.shutdown()
+    embedding_service.close()
+    ingestion.content_store.close()
+
+def test_upload_pdf(app_jobs):
     # Create a dummy PDF file
     pdf_path = tempfile.mktemp(suffix=".pdf")
     with open(pdf_path, "wb") as f:
@@ -16,4 +36,68 @@ def test_upload_pdf():
     os.remove(pdf_path)
     assert response.status_code == 200
     data = response.json()
-    assert "doc_id" in data or "error" in data
\ No newline at end of file
+    assert "job_id" in data or "error" in data
+    if "job_id" in data:
+        status = client.get(f"/upload-jobs/{data['job_id']}").json()
+        assert status["status"] in ("queued", "running", "succeeded", "failed")
+
+
+class FakeIngestionService:
+    def __init__(self):
+        self.calls = []
+
+    def ingest_document(self, file_path, filename=None, progress=None, tenant=None, move_source=False, doc_id=None):
+        progress("parsing", pages_parsed=1, pages_total=1)
+        progress("embedding", chunks_total=2, chunks_embedded=2)
+        self.calls.append(filename)
+        return f"doc-{filename}"
+
+
+def test_jobs_survive_restart_and_queue_is_bounded(tmp_path):
+    service = FakeIngestionService()
+    # Workers are not started, so submitted jobs stay queued as if the process had stopped.
+    jobs = IngestionJobManager(service, jobs_dir=str(tmp_path), workers=1, max_queue=1)
+    path = jobs.incoming_path("job-1", ".pdf")
+    open(path, "wb").close()
+    jobs.submit("job-1", path, "a.pdf")
+    with pytest.raises(QueueFullError):
+        jobs.submit("job-2", path, "b.pdf")
+    # Another worker process starting meanwhile leaves the job to its owner ...
+    other = IngestionJobManager(service, jobs_dir=str(tmp_path), workers=1)
+    other.start()
+    assert other.queue_depth() == 0
+    other.shutdown()
+    assert other.get("job-1")["status"] == "queued" and service.calls == []
+    # ... and once the owner stops, the next start picks it up.
+    jobs.shutdown()
+
+    restarted = IngestionJobManager(service, jobs_dir=str(tmp_path), workers=1)
+    restarted.start()
+    deadline = time.time() + 5
+    while restarted.get("job-1")["status"] != "succeeded" and time.time() < deadline:
+        time.sleep(0.01)
+    restarted.shutdown()
+    job = restarted.get("job-1")
+    assert job["status"] == "succeeded"
+    assert job["doc_id"] == "doc-a.pdf"
+    assert job["progress"]["chunks_embedded"] == 2
+    assert service.calls == ["a.pdf"]
+    assert not os.path.exists(path)
+
+def test_batch_upload_streams_files_into_one_job(tmp_path):
+    # Workers are not started, so the job stays queued with its files in tmp_path.
+    jobs = IngestionJobManager(FakeIngestionService(), jobs_dir=str(tmp_path), workers=1)
+    app.dependency_overrides[get_ingestion_jobs] = lambda: jobs
+    files = [
+        ("files", ("a.eml", b"Subject: a\n\nThe grace period is thirty days.\n", "message/rfc822")),
+        ("files", ("b.eml", b"Subject: b\n\nRoom rent is capped.\n", "message/rfc822")),
+        ("files", ("notes.txt", b"not a policy", "text/plain")),
+    ]
+    try:
+        data = client.post("/upload-docs/batch", files=files, data={"tenant": "acme"}).json()
+        status = client.get(f"/upload-jobs/{data['job_id']}").json()
+    finally:
+        app.dependency_overrides.pop(get_ingestion_jobs)
+    assert data["files"] == 2 and data["rejected"][0]["filename"] == "notes.txt"
+    assert status["files"] == ["a.eml", "b.eml"] and status["tenant"] == "acme"
+    assert sorted(os.listdir(jobs.incoming_dir)) == [f"{data['job_id']}-0.eml", f"{data['job_id']}-1.eml"]
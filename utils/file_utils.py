@@ -0,0 +1,28 @@
+"""
+File helpers shared by the persistence code.
+"""
+import os
+import tempfile
+
+
+def atomic_write(path: str, data: bytes):
+    """Write bytes to path so readers only ever see the old or the new file.
+
+    Each call writes its own temporary file, so concurrent writers (other threads or
+    processes) never interleave; the last rename wins.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # mkstemp creates the file private to its owner; keep the permissions open() would give.
+            os.fchmod(f.fileno(), 0o644)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,93 @@
+"""
+Locking primitives shared by the services.
+"""
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, run a single worker there.
+    fcntl = None
+
+
+class RWLock:
+    """Reader/writer lock: many concurrent readers or a single writer.
+
+    Writers are preferred, so a steady stream of queries cannot starve an upload.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read_lock(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write_lock(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    """Hold an advisory lock on path across processes: shared for readers, exclusive for writers.
+
+    Locks are not reentrant, not even within one process; never nest two on the same path.
+    """
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        # Closing the file releases the lock.
+        yield
+
+
+def try_lock_file(path):
+    """Take an exclusive advisory lock on path without waiting.
+
+    Returns the open file holding the lock (close it to release), or None if another holder,
+    in this process or another one, already has it.
+    """
+    f = open(path, "a+b")
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
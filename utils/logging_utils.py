@@ -2,6 +2,10 @@
 Logging utilities for the insurance reasoning engine.
 """
 import logging
+import os
+
+# DEBUG adds per-chunk retrieval details; they are skipped entirely at INFO and above.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 
 def get_logger(name: str):
     """Get a configured logger instance."""
@@ -11,5 +15,5 @@ def get_logger(name: str):
         formatter = logging.Formatter('[%(asctime)s] %(levelname)s %(name)s: %(message)s')
         handler.setFormatter(formatter)
         logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(LOG_LEVEL)
     return logger
\ No newline at end of file
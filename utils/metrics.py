@@ -0,0 +1,196 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+A small native implementation of counters, gauges and histograms, so there is no
+prometheus_client dependency. ``span(stage)`` times one stage of ingestion or query
+answering into the ``rag_stage_seconds`` histogram. Each worker process keeps its own
+metrics, so with several uvicorn workers every scrape of /metrics sees one of them.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans range from sub-millisecond searches to LLM calls of tens of seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_family(name, kind, help_text, samples):
+    """Exposition lines of one metric family; samples are (suffix, [(label, value)...], value)."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [("", list(zip(self.labelnames, key)), value) for key, value in self._values.items()]
+
+    def render(self):
+        return format_family(self.name, self.kind, self.help_text, self._samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        for key, (counts, total) in values.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(("_bucket", labels + [("le", le)], cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra_lines=()):
+        """Every registered metric, then extra_lines (collected at scrape time), as exposition text."""
+        lines = [line for metric in self._metrics for line in metric.render()]
+        lines.extend(extra_lines)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "rag_stage_seconds",
+    "Time spent in each stage of ingestion and query answering.",
+    ["stage"],
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "rag_http_request_seconds",
+    "HTTP request latency by route.",
+    ["method", "route", "status"],
+))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "rag_llm_tokens_total",
+    "Tokens sent to and received from the LLM.",
+    ["kind"],
+))
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "rag_llm_requests_total",
+    "Upstream LLM requests by provider and outcome (ok, error, cancelled).",
+    ["provider", "outcome"],
+))
+LLM_GATEWAY_EVENTS = REGISTRY.register(Counter(
+    "rag_llm_gateway_events_total",
+    "LLM gateway decisions: coalesced, hedged, failover and rate_limited calls.",
+    ["event"],
+))
+INDEX_SIZE = REGISTRY.register(Gauge(
+    "rag_index_size",
+    "Vectors, tombstoned vectors and chunk rows in the index.",
+    ["kind"],
+))
+INDEX_GENERATION = REGISTRY.register(Gauge(
+    "rag_index_generation",
+    "Index generation; bumped on every ingest and delete.",
+))
+
+
+def span(stage):
+    """Time a block as one stage (parse, chunk, embed, index_write, query_encode, search, ...)."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+def timed_iter(iterable, totals, key):
+    """Yield from iterable, adding the time spent producing its items to totals[key].
+
+    For generator pipelines where stages interleave (pages are parsed while chunks are cut),
+    so each stage's time can be summed per document and observed once.
+    """
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            totals[key] = totals.get(key, 0.0) + time.perf_counter() - start
+        yield item
@@ -0,0 +1,110 @@
+"""
+Streaming multipart/form-data reader.
+
+Starlette's form parsing spools every uploaded file into a temporary file before the route
+sees it, which the route then copies again. This reader feeds the request body through
+python-multipart as it arrives and writes each file part straight to the file its caller
+opens, so an upload is written to disk once and memory stays bounded by the body chunk size.
+Parsing (and with it every open, write and close) runs in a worker thread, off the event loop.
+"""
+from starlette.concurrency import run_in_threadpool
+
+# Form fields (not files) are kept in memory; larger ones are rejected.
+MAX_FIELD_BYTES = 64 * 1024
+# Body bytes collected before they are handed to the parser thread, to keep thread hops rare.
+PARSE_BUFFER_BYTES = 1024 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised for a body that is not valid multipart/form-data."""
+
+
+def _parse_content_disposition(value):
+    from python_multipart.multipart import parse_options_header
+
+    _, options = parse_options_header(value)
+    name = options.get(b"name", b"").decode("utf-8", errors="replace")
+    filename = options.get(b"filename")
+    return name, filename.decode("utf-8", errors="replace") if filename is not None else None
+
+
+async def stream_multipart(request, open_file):
+    """Read a multipart/form-data request, writing file parts as they arrive.
+
+    open_file(field_name, filename) returns a writable binary file for the part, or None to
+    discard it; each returned file is closed when its part ends. It is called from a worker
+    thread. Returns {field: value} for the plain (non-file) fields.
+    """
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise MultipartError("Expected a multipart/form-data body.")
+
+    fields = {}
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, header_field=b"", header_value=b"", out=None, value=bytearray(), filename=None)
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header_field"].lower()] = part["header_value"]
+        part["header_field"], part["header_value"] = b"", b""
+
+    def on_headers_finished():
+        disposition = part["headers"].get(b"content-disposition")
+        if disposition is None:
+            raise MultipartError("Part without a Content-Disposition header.")
+        part["name"], part["filename"] = _parse_content_disposition(disposition)
+        if part["filename"] is not None:
+            part["out"] = open_file(part["name"], part["filename"])
+
+    def on_part_data(data, start, end):
+        if part["filename"] is not None:
+            if part["out"] is not None:
+                part["out"].write(data[start:end])
+            return
+        if len(part["value"]) + end - start > MAX_FIELD_BYTES:
+            raise MultipartError(f"Form field '{part['name']}' is larger than {MAX_FIELD_BYTES} bytes.")
+        part["value"] += data[start:end]
+
+    def on_part_end():
+        if part["filename"] is None:
+            fields[part["name"]] = part["value"].decode("utf-8", errors="replace")
+        elif part["out"] is not None:
+            part["out"].close()
+            part["out"] = None
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    def close_open_part():
+        if part.get("out") is not None:
+            part["out"].close()
+
+    buffer = bytearray()
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= PARSE_BUFFER_BYTES:
+                await run_in_threadpool(parser.write, bytes(buffer))
+                buffer.clear()
+        await run_in_threadpool(parser.write, bytes(buffer))
+        await run_in_threadpool(parser.finalize)
+    finally:
+        await run_in_threadpool(close_open_part)
+    return fields
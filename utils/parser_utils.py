@@ -1,20 +1,79 @@
 """
 Utilities for parsing PDF, DOCX, and EML files.
+
+The parser libraries (PyMuPDF, python-docx, BeautifulSoup) are imported by the functions that
+use them, so importing this module, and starting the API, does not pay for all of them.
 """
-import fitz  # PyMuPDF
-import docx
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import email
-from bs4 import BeautifulSoup
 from .logging_utils import get_logger
 
 logger = get_logger("parser_utils")
 
-def parse_pdf(file_path: str) -> str:
-    """Parse PDF and return normalized text."""
+# Processes used to extract text from large PDFs (1 parses in-process).
+PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages handed to a worker at a time.
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+# Smaller PDFs are parsed in-process; starting workers would cost more than it saves.
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "64"))
+
+def _parse_page_range(file_path: str, start: int, end: int):
+    """Return [(page_no, text)] for pages start..end-1 (page_no is 1-based)."""
+    import fitz  # PyMuPDF
+
+    with fitz.open(file_path) as doc:
+        return [(i + 1, doc[i].get_text()) for i in range(start, end)]
+
+def iter_pdf_pages(file_path: str, on_page=None, workers=None, pages_per_task=None):
+    """Yield (page_no, text) for every page of a PDF, in page order.
+
+    Large PDFs are split into page ranges parsed by a process pool. Only a few ranges are
+    in flight at once, so memory stays bounded by the ranges being parsed rather than the
+    whole document. on_page(pages_done, pages_total) reports progress.
+    """
+    import fitz  # PyMuPDF
+
+    workers = workers or PDF_PARSE_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    with fitz.open(file_path) as doc:
+        total = doc.page_count
+    ranges = [(start, min(start + pages_per_task, total)) for start in range(0, total, pages_per_task)]
+
+    if workers <= 1 or total < PDF_PARALLEL_MIN_PAGES:
+        batches = (_parse_page_range(file_path, start, end) for start, end in ranges)
+        for batch in batches:
+            for page_no, text in batch:
+                yield page_no, text
+                if on_page:
+                    on_page(page_no, total)
+        return
+
+    # Spawned workers avoid forking a process that has request and ingestion threads running.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending = deque()
+        remaining = iter(ranges)
+        for start, end in remaining:
+            pending.append(pool.submit(_parse_page_range, file_path, start, end))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            batch = pending.popleft().result()
+            next_range = next(remaining, None)
+            if next_range:
+                pending.append(pool.submit(_parse_page_range, file_path, *next_range))
+            for page_no, text in batch:
+                yield page_no, text
+                if on_page:
+                    on_page(page_no, total)
+
+def parse_pdf(file_path: str, on_page=None) -> str:
+    """Parse PDF and return normalized text. on_page(pages_done, pages_total) reports progress."""
     try:
-        doc = fitz.open(file_path)
-        text = "\n".join(page.get_text() for page in doc)
-        doc.close()
+        text = "\n".join(text for _, text in iter_pdf_pages(file_path, on_page=on_page))
         return text.strip()
     except Exception as e:
         logger.error(f"Failed to parse PDF: {e}")
@@ -23,6 +82,8 @@ def parse_pdf(file_path: str) -> str:
 def parse_docx(file_path: str) -> str:
     """Parse DOCX and return normalized text."""
     try:
+        import docx
+
         doc = docx.Document(file_path)
         text = "\n".join([para.text for para in doc.paragraphs])
         return text.strip()
@@ -43,6 +104,8 @@ def parse_eml(file_path: str) -> str:
                     body += part.get_payload(decode=True).decode(errors='ignore')
                 elif ctype == 'text/html':
                     html = part.get_payload(decode=True).decode(errors='ignore')
+                    from bs4 import BeautifulSoup
+
                     soup = BeautifulSoup(html, 'html.parser')
                     body += soup.get_text()
         else:
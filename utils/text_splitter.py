@@ -1,74 +1,149 @@
 """
-Utilities for semantic chunking of text using LangChain's RecursiveCharacterTextSplitter.
+Utilities for semantic chunking of text.
+
+The splitter follows the semantics of LangChain's RecursiveCharacterTextSplitter (with
+keep_separator=True and whitespace stripping) but is implemented natively as generators, so
+chunks are produced lazily and importing this module stays cheap.
 """
 import re
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from collections import deque
+from itertools import islice
 from .logging_utils import get_logger
 
 logger = get_logger("text_splitter")
 
+SEPARATORS = ["\n\n", "\n", ".", "!", "?", " "]
+
+# Tried in order; the first pattern that matches anywhere in the chunk describes its section.
+SECTION_PATTERNS = [
+    re.compile(r'(Section|Clause|Article|Part)\s*(\d+[\.\d]*)[:\s]+(.+)', re.IGNORECASE),
+    re.compile(r'(\d+[\.\d]*)\s*[:\s]+(.+)', re.IGNORECASE),
+    re.compile(r'([A-Z][A-Z\s]+)[:\s]+(.+)', re.IGNORECASE),
+]
+NUMBER_PATTERN = re.compile(r'\d+[\.\d]*%?')
+CURRENCY_PATTERN = re.compile(r'₹\s*\d+[,\d]*|\$\s*\d+[,\d]*|Rs\.?\s*\d+[,\d]*')
+
 def extract_document_info(text):
     """Extract any available document structure information."""
     info = {}
-    
-    # Look for any section-like patterns (flexible)
-    section_patterns = [
-        r'(Section|Clause|Article|Part)\s*(\d+[\.\d]*)[:\s]+(.+)',
-        r'(\d+[\.\d]*)\s*[:\s]+(.+)',
-        r'([A-Z][A-Z\s]+)[:\s]+(.+)'
-    ]
-    
-    for pattern in section_patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        if matches:
-            info['section_type'] = matches[0][0] if len(matches[0]) > 2 else 'Section'
-            info['section_number'] = matches[0][1] if len(matches[0]) > 2 else matches[0][0]
-            info['section_title'] = matches[0][-1].strip()
+
+    # Look for any section-like patterns (flexible); only the first match is needed.
+    for pattern in SECTION_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            groups = match.groups()
+            info['section_type'] = groups[0] if len(groups) > 2 else 'Section'
+            info['section_number'] = groups[1] if len(groups) > 2 else groups[0]
+            info['section_title'] = groups[-1].strip()
             break
-    
+
     # Extract any numbers, dates, percentages that might be important
-    numbers = re.findall(r'\d+[\.\d]*%?', text)
+    numbers = [m.group(0) for m in islice(NUMBER_PATTERN.finditer(text), 5)]
     if numbers:
-        info['numbers'] = numbers[:5]  # Limit to first 5 numbers
-    
+        info['numbers'] = numbers  # Limit to first 5 numbers
+
     # Extract any currency amounts
-    currency = re.findall(r'₹\s*\d+[,\d]*|\$\s*\d+[,\d]*|Rs\.?\s*\d+[,\d]*', text)
+    currency = [m.group(0) for m in islice(CURRENCY_PATTERN.finditer(text), 3)]
     if currency:
-        info['currency_amounts'] = currency[:3]  # Limit to first 3 amounts
-    
+        info['currency_amounts'] = currency  # Limit to first 3 amounts
+
     return info
 
+def _split_on(text, separator):
+    """Split text on separator, keeping each separator at the start of the piece after it."""
+    if not separator:
+        return list(text)
+    pieces = text.split(separator)
+    splits = [pieces[0]] + [separator + piece for piece in pieces[1:]]
+    return [s for s in splits if s]
+
+def _merge_splits(splits, chunk_size, chunk_overlap):
+    """Greedily pack small splits into chunks of at most chunk_size, carrying chunk_overlap over."""
+    current = deque()
+    total = 0
+    for split in splits:
+        length = len(split)
+        if total + length > chunk_size and current:
+            chunk = "".join(current).strip()
+            if chunk:
+                yield chunk
+            # Drop leading splits until what is left fits in the overlap and leaves room for this one.
+            while total > chunk_overlap or (total + length > chunk_size and total > 0):
+                total -= len(current.popleft())
+        current.append(split)
+        total += length
+    chunk = "".join(current).strip()
+    if chunk:
+        yield chunk
+
+def _split_recursive(text, separators, chunk_size, chunk_overlap):
+    # Use the first separator present in the text; longer pieces recurse with the rest.
+    separator = separators[-1]
+    remaining = []
+    for i, candidate in enumerate(separators):
+        if candidate == "":
+            separator = candidate
+            break
+        if candidate in text:
+            separator = candidate
+            remaining = separators[i + 1:]
+            break
+
+    good_splits = []
+    for split in _split_on(text, separator):
+        if len(split) < chunk_size:
+            good_splits.append(split)
+            continue
+        if good_splits:
+            yield from _merge_splits(good_splits, chunk_size, chunk_overlap)
+            good_splits = []
+        if remaining:
+            yield from _split_recursive(split, remaining, chunk_size, chunk_overlap)
+        else:
+            yield split
+    if good_splits:
+        yield from _merge_splits(good_splits, chunk_size, chunk_overlap)
+
+def split_text(text: str, chunk_size: int = 600, chunk_overlap: int = 100, separators=None):
+    """Lazily split text into chunks of at most chunk_size characters with chunk_overlap overlap."""
+    if chunk_overlap > chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) is larger than chunk_size ({chunk_size})")
+    return _split_recursive(text, separators or SEPARATORS, chunk_size, chunk_overlap)
+
+def _make_chunk(chunk_text, chunk_id, metadata=None):
+    """Build a chunk dict with the flexible metadata extracted from its text."""
+    metadata = dict(metadata or {})
+    metadata.update(extract_document_info(chunk_text))
+    metadata['chunk_id'] = chunk_id
+    metadata['text'] = chunk_text  # Store text in metadata for retrieval
+    metadata['length'] = len(chunk_text)
+    return {"text": chunk_text, "metadata": metadata}
+
 def semantic_chunk(text: str, chunk_size: int = 600, chunk_overlap: int = 100):
     """Split text into semantically meaningful chunks with flexible metadata."""
     try:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", "!", "?", " "]
-        )
-        chunks = splitter.create_documents([text])
-        
-        # Process each chunk to add flexible metadata
-        processed_chunks = []
-        for i, chunk in enumerate(chunks):
-            chunk_text = chunk.page_content
-            doc_info = extract_document_info(chunk_text)
-            
-            # Combine existing metadata with document info
-            metadata = chunk.metadata.copy()
-            metadata.update(doc_info)
-            metadata['chunk_id'] = i
-            metadata['text'] = chunk_text  # Store text in metadata for retrieval
-            metadata['length'] = len(chunk_text)
-            
-            processed_chunks.append({
-                "text": chunk_text,
-                "metadata": metadata
-            })
-        
+        processed_chunks = [
+            _make_chunk(chunk_text, i)
+            for i, chunk_text in enumerate(split_text(text, chunk_size, chunk_overlap))
+        ]
         logger.info(f"Created {len(processed_chunks)} flexible chunks")
         return processed_chunks
-        
+
     except Exception as e:
         logger.error(f"Failed to chunk text: {e}")
-        return []
\ No newline at end of file
+        return []
+
+def semantic_chunk_pages(pages, chunk_size: int = 600, chunk_overlap: int = 100):
+    """Lazily chunk an iterable of (page_no, text) pairs, one page at a time.
+
+    Yields the same chunk dicts as semantic_chunk, with chunk_ids running across pages and
+    the source page stored as metadata['page'] (skipped when page_no is None). Chunks never
+    span a page break, so only one page of text is held at a time.
+    """
+    chunk_id = 0
+    for page_no, text in pages:
+        metadata = {} if page_no is None else {'page': page_no}
+        for chunk_text in split_text(text.strip(), chunk_size, chunk_overlap):
+            yield _make_chunk(chunk_text, chunk_id, metadata)
+            chunk_id += 1
+    logger.info(f"Created {chunk_id} flexible chunks")